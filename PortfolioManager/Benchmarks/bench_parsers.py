@@ -0,0 +1,30 @@
+import time
+import Strategies.ContractDef.contract_info as ci
+import Strategies.FileUtil.file_parser as fp
+import Strategies.DateDef.date_util as dt
+import Benchmarks.bench_util as bu
+
+# per line cost of turning market data lines into prices & dates
+def Run(bars):
+  results = {}
+
+  args = list((ci.ContractInfoDatabase[shc], line) for shc, date, line in bars)
+  results['parser.TokenizeToPriceInfo'] = bu.Summarize(bu.TimeCalls(fp.TokenizeToPriceInfo, args))
+  results['parser.TokenizeToDate'] = bu.Summarize(bu.TimeCalls(fp.TokenizeToDate, args))
+
+  dates = list(date for shc, date, line in bars)
+  date_pairs = list(zip(dates[:-1], dates[1:]))
+  results['dates.CompareDates'] = bu.Summarize(bu.TimeCalls(dt.CompareDates, date_pairs))
+  results['dates.NumDaysBetween'] = bu.Summarize(bu.TimeCalls(dt.NumDaysBetween, date_pairs))
+  results['dates.NormalizeDate'] = bu.Summarize(bu.TimeCalls(dt.NormalizeDate, list((date,) for date in dates)))
+  results['dates.ToDatetime64'] = bu.Summarize(bu.TimeCalls(dt.ToDatetime64, [(dates,)]), num_bars=len(dates))
+
+  # whole files, oldest line first, against reading everything & reversing it
+  filenames = list('MarketData/csvs/market_data_' + shc + '.csv' for shc in sorted(set(shc for shc, date, line in bars)))
+  for name, read in [('parser.ReadLinesOldestFirst', lambda filename: sum(1 for line in fp.ReadLinesOldestFirst(filename))),
+                     ('parser.ReversedReadlines', lambda filename: len(list(reversed(list(open(filename, 'r'))))))]:
+    start = time.perf_counter_ns()
+    num_lines = sum(read(filename) for filename in filenames)
+    results[name] = bu.Summarize([time.perf_counter_ns() - start], num_bars=num_lines)
+
+  return results
@@ -0,0 +1,109 @@
+import time, functools
+import numpy
+import Strategies.PnlUtil.pnl_util as pu
+import Strategies.PnlUtil.bootstrap as bs
+import Strategies.PnlUtil.risk_parity as rpar
+import Benchmarks.bench_util as bu
+import portfolio_manager as pmgr
+import run_portfolios as rp
+
+recalibrate_pm_list = [pmgr.UniformAllocPM, pmgr.IndividualPnlAllocPM, pmgr.IndividualSharpeAllocPM,
+                       pmgr.IndividualSortinoAllocPM, pmgr.MarkowitzAllocPM,
+                       pmgr.InverseVolatilityAllocPM, pmgr.RiskParityAllocPM, pmgr.MLPredictiveAllocPM]
+
+# synthetic traders a daily risk parity recalibration gets timed with, see RiskParityDays
+NUM_RISK_PARITY_TRADERS = 500
+
+def NewPM(pm_type):
+  pm_list, regime_pm = rp.InitializePMs([pm_type])
+  return (pm_list + regime_pm)[0]
+
+def Feed(pm, bars):
+  for shc, date, line in bars:
+    pm.OnMarketDataUpdate(shc, date, line)
+
+"""
+Daily risk parity recalibrations of NUM_RISK_PARITY_TRADERS synthetic traders one after the other,
+all RiskParityAllocPM does past catching up with ledgers: a new day of returns, the solver warm
+started off the day before & capped allocations.
+:return: latency of every day
+"""
+def RiskParityDays(num_days):
+  rng = numpy.random.default_rng(bs.DEFAULT_SEED)
+  num_traders, window = NUM_RISK_PARITY_TRADERS, rpar.DEFAULT_WINDOW
+  # traders moved by a handful of common factors, in a book big enough for all of them to fit between MIN & MAX
+  returns = rng.normal(size=(window + num_days, 8)) @ rng.normal(size=(8, num_traders))
+  returns = (returns + rng.normal(size=returns.shape)) * rng.lognormal(0, 1, num_traders) / 1000
+  total = num_traders * pmgr.FIRST_ALLOCATION
+
+  covariance, series, workspace = rpar.RollingCovariance(window), list(range(num_traders)), {}
+  covariance.Grow(num_traders)
+  for day in returns[:window]:
+    covariance.Add(day)
+  solution = {'weights': rpar.EqualRiskContributionWeights(*covariance.Factors(series))}
+
+  def Recalibrate(day):
+    covariance.Add(day)
+    solution['weights'] = rpar.EqualRiskContributionWeights(*covariance.Factors(series), start=solution['weights'],
+                                                            workspace=workspace)
+    rpar.CappedAllocations(solution['weights'], total, pmgr.MIN_ALLOCATION, pmgr.MAX_ALLOCATION)
+
+  return bu.TimeCalls(Recalibrate, list((day,) for day in returns[window:]))
+
+"""
+PM dispatch, allocators, end to end replay & aggregation.
+
+:param shc_market_data_lines: fixed input, as returned by bench_util.LoadFixedMarketData
+:param bars: the same input in replay order
+:param repeat: how many times to time each allocator/aggregation
+:return: (benchmark results, pnl fingerprint of the end to end replay)
+"""
+def Run(shc_market_data_lines, bars, repeat):
+  results = {}
+
+  # every bar goes through the PM to all of its traders, includes the odd recalibration
+  uniform_pm = NewPM(pmgr.UniformAllocPM)
+  results['pm.UniformAllocPM.OnMarketDataUpdate'] = bu.Summarize(bu.TimeCalls(uniform_pm.OnMarketDataUpdate, bars))
+
+  for pm_type in recalibrate_pm_list:
+    pm = (uniform_pm if pm_type == pmgr.UniformAllocPM else NewPM(pm_type))
+    if pm != uniform_pm:
+      Feed(pm, bars)
+    results['recalibrate.' + pm_type.__name__] = bu.Summarize(bu.TimeCalls(pm.RecalibrateAllocations, [()] * repeat))
+  results['recalibrate.RiskParityDaily' + str(NUM_RISK_PARITY_TRADERS)] = bu.Summarize(RiskParityDays(20 * repeat))
+
+  # every feature reduction, after the first refit a reduction only has the fits & a transform left to do
+  for reduction in pmgr.REGIME_REDUCTIONS:
+    name = 'RegimePredictiveAllocPM' + ('.' + reduction if reduction else '')
+    try:
+      regime_pm = NewPM(functools.partial(pmgr.RegimePredictiveAllocPM, reduction=reduction))
+      regime_pm.SetUniformReturns(uniform_pm.traders)
+      regime_pm.last_date = bars[-1][1]
+
+      def RecalibrateRegime():
+        regime_pm.last_date_index = 0 # force a refit on everything before last_date
+        regime_pm.RecalibrateAllocations()
+
+      results['recalibrate.' + name] = bu.Summarize(bu.TimeCalls(RecalibrateRegime, [()] * repeat))
+    except (IndexError, ValueError) as e:
+      print('Skipping ' + name + ', not enough data in ' + str(len(bars)) + ' bars: ' + repr(e))
+
+  pm_list, regime_pm = rp.InitializePMs()
+  start = time.perf_counter_ns()
+  rp.ReplayMarketData(shc_market_data_lines, dict.fromkeys(shc_market_data_lines, 0), pm_list)
+  results['replay.ReplayMarketData'] = bu.Summarize([time.perf_counter_ns() - start], num_bars=len(bars))
+  print(end='\n')
+
+  trades = {name: trader.trades for name, trader in pm_list[0].traders.items()}
+  allocs = {name: trader.alloc for name, trader in pm_list[0].traders.items()}
+  results['aggregate.AlignTradesAndAllocs'] =\
+    bu.Summarize(bu.TimeCalls(pu.AlignTradesAndAllocs, [(trades, allocs)] * repeat),
+                 num_bars=sum(len(rows) for rows in trades.values()) * repeat)
+
+  # confidence intervals SummarizePerformance prints, every trader at once
+  names, dates, pnl_matrix, alloc_matrix = pu.AlignTradesAndAllocs(trades, allocs)
+  daily_pnl = pu.DailyPnl(pnl_matrix.T)
+  results['stats.BootstrapIntervals'] =\
+    bu.Summarize(bu.TimeCalls(functools.partial(bs.BootstrapIntervals, drawdowns=True), [(daily_pnl,)] * repeat), num_bars=daily_pnl.size * repeat)
+
+  return results, bu.PnlFingerprint(pm_list)
@@ -0,0 +1,34 @@
+import itertools
+import Benchmarks.bench_util as bu
+import portfolio_manager as pmgr
+import run_portfolios as rp
+import trader_bank as tb
+
+# banks get timed with this many copies of every trader, bars are trader bars
+BANK_COPIES = 100
+
+# per bar cost of every trader style, fed every bar of the contracts it trades
+def Run(bars):
+  results = {}
+
+  for trader_type in rp.trader_list:
+    contracts = rp.trader_contracts[trader_type][0]
+    trader = trader_type(contracts, rp.trader_params[trader_type])
+
+    args = list((shc, date, line, pmgr.FIRST_ALLOCATION) for shc, date, line in bars if shc in trader.ContractList())
+    results['trader.' + trader_type.__name__ + '.OnMarketDataUpdate'] =\
+      bu.Summarize(bu.TimeCalls(trader.OnMarketDataUpdate, args))
+
+  # the same styles stepped in banks, one call per day
+  days = list(list((shc, line) for shc, date, line in day) for date, day in itertools.groupby(bars, key=lambda bar: bar[1]))
+  for trader_type in tb.BANKABLE_TRADERS:
+    bank = tb.TraderBank(trader_type(contracts, rp.trader_params[trader_type])
+                         for contracts in rp.trader_contracts[trader_type] for copy in range(BANK_COPIES))
+    alloc = dict.fromkeys(bank.names, pmgr.FIRST_ALLOCATION)
+
+    args = list((day, alloc) for day in days)
+    num_bars = sum(len(bank.instances.get(shc, [])) for day in days for shc, line in day)
+    results['bank.' + trader_type.__name__ + '.OnMarketDataUpdates'] =\
+      bu.Summarize(bu.TimeCalls(bank.OnMarketDataUpdates, args), num_bars=num_bars)
+
+  return results
@@ -0,0 +1,153 @@
+import os, json, time, platform, hashlib
+import numpy
+import Strategies.SyntheticData.market_data_generator as mdg
+import run_portfolios as rp
+
+# a benchmark is slower than baseline if it lost more than this fraction of its throughput
+REGRESSION_TOLERANCE = 0.10
+
+"""
+Turn a list of per-bar latencies into what we report.
+
+:param latencies_ns: one entry per timed call, in nanoseconds
+:param num_bars: how many bars those calls covered, defaults to one bar per call
+:return: dict with bars, seconds, bars_per_sec, p50_us, p99_us, max_us
+"""
+def Summarize(latencies_ns, num_bars=None):
+  latencies = numpy.asarray(latencies_ns, dtype=float)
+  num_bars = len(latencies) if num_bars is None else num_bars
+  seconds = latencies.sum() / 1e9
+
+  return {'bars': int(num_bars),
+          'calls': int(len(latencies)),
+          'seconds': seconds,
+          'bars_per_sec': (num_bars / seconds if seconds > 0 else float('inf')),
+          'p50_us': (float(numpy.percentile(latencies, 50)) / 1e3 if len(latencies) else 0),
+          'p99_us': (float(numpy.percentile(latencies, 99)) / 1e3 if len(latencies) else 0),
+          'max_us': (float(latencies.max()) / 1e3 if len(latencies) else 0)}
+
+# call function once for every entry in args_list, return latency of every call
+def TimeCalls(function, args_list):
+  latencies = []
+  for args in args_list:
+    start = time.perf_counter_ns()
+    function(*args)
+    latencies.append(time.perf_counter_ns() - start)
+  return latencies
+
+"""
+Fixed benchmark input: the oldest num_bars lines of every contract.
+:param shortcodes: contracts to load, defaults to the 12 real ones
+:return: map from contract to market data lines in chrono order, header last like LoadMarketDataLines
+"""
+def LoadFixedMarketData(num_bars, shortcodes=None):
+  shc_market_data_lines, shc_market_line_index = {}, {}
+  rp.LoadMarketDataLines(shc_market_data_lines, shc_market_line_index, shortcodes)
+  for shc in shc_market_data_lines:
+    lines = shc_market_data_lines[shc]
+    shc_market_data_lines[shc] = lines[:min(num_bars, len(lines) - 1)] + lines[-1:]
+
+  return shc_market_data_lines
+
+"""
+Run against a data set written by market_data_generator instead of the real contracts,
+every trader style gets every synthetic contract/pair.
+:return: list of synthetic shortcodes
+"""
+def UseSyntheticData(data_root):
+  shortcodes, pairs = mdg.LoadManifest(data_root)
+  os.chdir(data_root)
+
+  rp.trader_contracts.update({rp.TrendFollowTrader: shortcodes,
+                              rp.MeanReversionTrader: shortcodes,
+                              rp.RelativeValueTrader: pairs + list([shc_2, shc_1] for shc_1, shc_2 in pairs),
+                              rp.PairsTrader: pairs})
+  return shortcodes
+
+# stands in for a PM during replay and remembers every update in the order it was dispatched
+class BarRecorder:
+  def __init__(self):
+    self.bars = []
+
+  def OnMarketDataUpdate(self, shc, date, line):
+    self.bars.append((shc, date, line))
+
+# every (contract, date, line) in the order ReplayMarketData dispatches them
+def ReplayOrder(shc_market_data_lines):
+  recorder = BarRecorder()
+  rp.ReplayMarketData(shc_market_data_lines, dict.fromkeys(shc_market_data_lines, 0), [recorder])
+  return recorder.bars
+
+"""
+Digest of everything the traders of a list of PMs did, used to prove an
+optimization left results unchanged.
+:return: map from PM to {'digest': sha1 of every trades row & alloc, 'final_pnl': {trader: pnl}}
+"""
+def PnlFingerprint(pm_list):
+  fingerprint = {}
+  for pm in pm_list:
+    digest = hashlib.sha1()
+    final_pnl = {}
+    for name, trader in pm.traders.items():
+      digest.update(repr((name, trader.trades, trader.alloc)).encode())
+      final_pnl[name] = (trader.trades[-1][5] if trader.trades else 0)
+
+    fingerprint[str(pm.style)] = {'digest': digest.hexdigest(), 'final_pnl': final_pnl}
+  return fingerprint
+
+def SaveResults(results, filename):
+  results = dict(results)
+  results['meta'] = {'python': platform.python_version(), 'machine': platform.machine(),
+                     'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+  with open(filename, 'w') as out:
+    json.dump(results, out, indent=2, sort_keys=True)
+
+def LoadResults(filename):
+  with open(filename, 'r') as data:
+    return json.load(data)
+
+"""
+Print every benchmark next to its baseline and check results are equivalent.
+:return: (list of benchmarks slower than baseline by more than tolerance, list of PMs whose pnl changed)
+"""
+def CompareResults(results, baseline, tolerance=REGRESSION_TOLERANCE):
+  regressions, mismatches = [], []
+
+  print('    ' + format('Benchmark', '45s')
+        + ' ' + format('bars/sec', '>12s')
+        + ' ' + format('baseline', '>12s')
+        + ' ' + format('ratio', '>8s')
+        + ' ' + format('p99(us)', '>10s')
+        + ' ' + format('baseline', '>10s'))
+  for name in sorted(results.get('benchmarks', {})):
+    current = results['benchmarks'][name]
+    if name not in baseline.get('benchmarks', {}):
+      print('    ' + format(name, '45s') + ' ' + format(current['bars_per_sec'], '12.1f') + ' (no baseline)')
+      continue
+
+    base = baseline['benchmarks'][name]
+    ratio = current['bars_per_sec'] / base['bars_per_sec'] if base['bars_per_sec'] else float('inf')
+    print('    ' + format(name, '45s')
+          + ' ' + format(current['bars_per_sec'], '12.1f')
+          + ' ' + format(base['bars_per_sec'], '12.1f')
+          + ' ' + format(ratio, '8.3f')
+          + ' ' + format(current['p99_us'], '10.1f')
+          + ' ' + format(base['p99_us'], '10.1f'))
+    if ratio < 1 - tolerance:
+      regressions.append(name)
+
+  for pm, base in baseline.get('equivalence', {}).items():
+    current = results.get('equivalence', {}).get(pm)
+    if not current:
+      continue
+
+    if current['digest'] != base['digest']:
+      worst = max((abs(current['final_pnl'].get(trader, 0) - pnl) for trader, pnl in base['final_pnl'].items()),
+                  default=0)
+      print('    PNL CHANGED ' + pm + ' max final pnl difference: ' + str(worst))
+      mismatches.append(pm)
+
+  if results.get('bars') != baseline.get('bars'):
+    print('    WARNING baseline ran on ' + str(baseline.get('bars')) + ' bars, this run on ' + str(results.get('bars')))
+
+  return regressions, mismatches
@@ -0,0 +1,230 @@
+import os, sys, time, json, pickle, getopt, hashlib, functools
+
+DEFAULT_DIRECTORY = '.run_cache'
+DEFAULT_MAX_BYTES = 2 * 1024**3
+
+# every .py under here counts towards the code version, see CodeVersion
+CODE_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# command line flags for the entry points:
+# --cache                    reuse results of identical earlier runs
+# --cache-dir=<dir>          where results are kept (default .run_cache)
+# --cache-size=<MB>          evict least recently used results past this size (default 2048)
+CACHE_OPTIONS = ['cache', 'cache-dir=', 'cache-size=']
+
+"""
+Digest of every .py file under root, any code change makes every earlier result a miss.
+Coarse on purpose: whether a change affects a result is not something to guess at.
+"""
+@functools.lru_cache(maxsize=None)
+def CodeVersion(root=CODE_ROOT):
+  digest = hashlib.sha1()
+  for directory, subdirectories, filenames in os.walk(root):
+    subdirectories[:] = sorted(name for name in subdirectories if not name.startswith('.') and name != '__pycache__')
+    for filename in sorted(filenames):
+      if filename.endswith('.py'):
+        path = os.path.join(directory, filename)
+        digest.update(os.path.relpath(path, root).encode())
+        with open(path, 'rb') as source:
+          digest.update(source.read())
+  return digest.hexdigest()
+
+# content digests of data files, each file only gets read once as long as it doesn't change
+file_digests = {}
+
+def FileDigest(filename):
+  stat = os.stat(filename)
+  key = (os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+  if key not in file_digests:
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as data:
+      for block in iter(lambda: data.read(1 << 20), b''):
+        digest.update(block)
+    file_digests[key] = digest.hexdigest()
+  return file_digests[key]
+
+# something which hashes the same across processes, unlike hash() & object reprs
+def Canonical(value):
+  if isinstance(value, dict):
+    return {str(key): Canonical(item) for key, item in sorted(value.items(), key=lambda entry: str(entry[0]))}
+  if isinstance(value, (list, tuple)):
+    return list(Canonical(item) for item in value)
+  if isinstance(value, type):
+    return value.__module__ + '.' + value.__qualname__
+  if callable(value) and hasattr(value, '__qualname__'):
+    return value.__module__ + '.' + value.__qualname__
+  if hasattr(value, 'Name') and hasattr(value, 'TickValue'): # ContractInfo
+    return [value.Name, value.MinPriceIncrement, value.TickValue]
+  if isinstance(value, (str, int, float, bool)) or value is None:
+    return value
+  return repr(value)
+
+def DescriptionKey(description):
+  return hashlib.sha1(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+"""
+Results of whole backtests, addressed by a digest of everything which decides them:
+what ran (strategy function or PM/trader classes), its full parameters, the contents
+of every data file it read & the code version. Entries are pickles, least recently
+used ones get evicted once the cache outgrows max_bytes.
+
+  cache = RunCache()
+  key = cache.Key('TrendFollowStrategy', data_files, params)
+  hit, trades = cache.Get(key)
+  if not hit:
+    trades = ...
+    cache.Put(key, trades)
+"""
+class RunCache:
+  def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=DEFAULT_MAX_BYTES):
+    self.directory = directory
+    self.max_bytes = max_bytes
+    self.hits, self.misses = 0, 0
+    os.makedirs(directory, exist_ok=True)
+
+  """
+  :param kind: what ran, e.g. a strategy function or 'run_portfolios'
+  :param data_files: every file the run reads
+  :param params: everything else the result depends on, nested dicts/lists/classes/contracts
+  """
+  def Key(self, kind, data_files, params):
+    return DescriptionKey(self.Description(kind, data_files, params))
+
+  def Description(self, kind, data_files, params):
+    return {'kind': Canonical(kind),
+            'data': {os.path.basename(filename): FileDigest(filename) for filename in data_files},
+            'params': Canonical(params),
+            'code': CodeVersion()}
+
+  def Path(self, key, extension):
+    return os.path.join(self.directory, key[:2], key + extension)
+
+  # :return: (True, result) on a hit, (False, None) on a miss
+  def Get(self, key):
+    path = self.Path(key, '.pkl')
+    try:
+      with open(path, 'rb') as data:
+        result = pickle.load(data)
+    except (OSError, EOFError, pickle.UnpicklingError):
+      self.misses += 1
+      return False, None
+
+    os.utime(path) # most recently used now
+    self.hits += 1
+    return True, result
+
+  """
+  :param description: what Description returned for this key, kept next to the result
+                      so entries can be listed & invalidated by kind or data file
+  """
+  def Put(self, key, result, description=None):
+    os.makedirs(os.path.dirname(self.Path(key, '.pkl')), exist_ok=True)
+    for extension, contents in [('.json', json.dumps(description or {}, sort_keys=True, indent=1).encode()),
+                                ('.pkl', pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))]:
+      # other processes may be reading, only ever rename complete files in
+      temporary = self.Path(key, extension) + '.' + str(os.getpid()) + '.tmp'
+      with open(temporary, 'wb') as out:
+        out.write(contents)
+      os.replace(temporary, self.Path(key, extension))
+
+    self.Evict()
+
+  """
+  Look a run up & only run it on a miss.
+  :param run: called with no arguments to produce the result
+  """
+  def Call(self, kind, data_files, params, run):
+    description = self.Description(kind, data_files, params)
+    key = DescriptionKey(description)
+    hit, result = self.Get(key)
+    if not hit:
+      result = run()
+      self.Put(key, result, description)
+    return result
+
+  # :return: list of (key, bytes, last used time, description), least recently used first
+  def Entries(self):
+    entries = []
+    for directory, subdirectories, filenames in os.walk(self.directory):
+      for filename in filenames:
+        if not filename.endswith('.pkl'):
+          continue
+        key = filename[:-len('.pkl')]
+        try:
+          stat = os.stat(os.path.join(directory, filename))
+          with open(self.Path(key, '.json'), 'r') as data:
+            description = json.load(data)
+        except (OSError, ValueError):
+          continue # being written or removed by someone else
+        entries.append((key, stat.st_size, stat.st_mtime, description))
+
+    return sorted(entries, key=lambda entry: entry[2])
+
+  def Evict(self):
+    entries = self.Entries()
+    total = sum(entry[1] for entry in entries)
+    for key, size, used, description in entries:
+      if total <= self.max_bytes:
+        break
+      self.Remove(key)
+      total -= size
+
+  def Remove(self, key):
+    for extension in ['.pkl', '.json']:
+      try:
+        os.remove(self.Path(key, extension))
+      except OSError:
+        pass
+
+  """
+  Drop entries, all of them if nothing is given.
+  :param kind: only runs of this, matches the end of the kind, e.g. 'TrendFollowStrategy'
+  :param data_file: only runs which read this file, matches on file name
+  :param stale: only entries built by a different code version
+  :return: number of entries dropped
+  """
+  def Invalidate(self, kind=None, data_file=None, stale=False):
+    dropped = 0
+    for key, size, used, description in self.Entries():
+      if kind and not str(description.get('kind', '')).endswith(kind):
+        continue
+      if data_file and os.path.basename(data_file) not in description.get('data', {}):
+        continue
+      if stale and description.get('code') == CodeVersion():
+        continue
+      self.Remove(key)
+      dropped += 1
+    return dropped
+
+def CacheFromOptions(opts):
+  opts = dict(opts)
+  if '--cache' not in opts:
+    return None
+
+  return RunCache(opts.get('--cache-dir', DEFAULT_DIRECTORY),
+                  int(float(opts.get('--cache-size', DEFAULT_MAX_BYTES / 1024**2)) * 1024**2))
+
+# --cache-dir=<dir>     cache to look at (default .run_cache)
+# --list                list entries, least recently used first
+# --invalidate          drop entries, all unless narrowed down by
+#   --kind=<name>       runs of this strategy/entry point, e.g. TrendFollowStrategy
+#   --data=<file>       runs which read this data file, e.g. market_data_ES.csv
+#   --stale             entries built by an older code version
+def main(args):
+  opts, args = getopt.getopt(args, '', ['cache-dir=', 'list', 'invalidate', 'kind=', 'data=', 'stale'])
+  opts = dict(opts)
+  cache = RunCache(opts.get('--cache-dir', DEFAULT_DIRECTORY))
+
+  if '--invalidate' in opts:
+    dropped = cache.Invalidate(opts.get('--kind'), opts.get('--data'), '--stale' in opts)
+    print('Dropped ' + str(dropped) + ' entries from ' + cache.directory)
+    return
+
+  entries = cache.Entries()
+  for key, size, used, description in entries:
+    print(key + ' ' + format(size / 1e6, '8.2f') + 'MB ' + time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(used))
+          + ' ' + str(description.get('kind')) + ' ' + ','.join(sorted(description.get('data', {}))))
+  print(str(len(entries)) + ' entries, ' + format(sum(entry[1] for entry in entries) / 1e6, '.2f') + 'MB')
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
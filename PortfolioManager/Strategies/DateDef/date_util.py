@@ -1,4 +1,6 @@
 from datetime import datetime
+import functools
+import numpy
 
 # deal with 2 different year formats
 def NormalizeDate(d):
@@ -34,3 +36,16 @@ def NumDaysBetween(d1, d2):
   dt2 = datetime.strptime(d2, '%m-%d-%y')
 
   return abs((dt1 - dt2).days) - 8
+
+# days since 01-01-0001 for either date format, each distinct date only gets parsed once
+@functools.lru_cache(maxsize=None)
+def DateOrdinal(d):
+  return (datetime.strptime(d, '%m-%d-%y') if len(d) < 10 else datetime.strptime(d, '%Y-%m-%d')).toordinal()
+
+# convert a sequence of dates in either format to numpy datetime64[D],
+# only parsing each distinct date once since series share most of their dates
+def ToDatetime64(dates):
+  unique_dates, inverse = numpy.unique(numpy.asarray(dates, dtype=str), return_inverse=True)
+  parsed = numpy.array([datetime.strptime(d, '%m-%d-%y') if len(d) < 10 else datetime.strptime(d, '%Y-%m-%d')
+                        for d in unique_dates], dtype='datetime64[D]')
+  return parsed[inverse.reshape(-1)]
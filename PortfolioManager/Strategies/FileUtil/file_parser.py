@@ -1,4 +1,6 @@
 import Strategies.ContractDef.contract_info as ci
+import Strategies.DateDef.date_util as dt
+import os, mmap
 
 # function to deal with eberhart csv files
 # tokenize, check sanity, convert prices to ticks
@@ -40,3 +42,67 @@ def TokenizeToDate(contract, line):
     pass
 
   return None
+
+# how much of a file ReadLinesOldestFirst decodes at a time
+READ_BLOCK_SIZE = 1 << 16
+
+"""
+Lines of a newest first csv in chrono order, header last, same as
+reversed(list(open(filename))) but without ever holding the file in memory:
+the file is mapped and walked backwards a block at a time, so the first bar
+is available right away and memory stays bounded whatever the file size.
+"""
+def ReadLinesOldestFirst(filename, block_size=READ_BLOCK_SIZE):
+  with open(filename, 'rb') as data:
+    if os.fstat(data.fileno()).st_size == 0:
+      return
+
+    with mmap.mmap(data.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+      end = len(mapped)
+      while end > 0:
+        # back up a block, then forward to the first line starting inside it,
+        # a line longer than a block gets taken whole
+        start = max(0, end - block_size)
+        cut = (mapped.find(b'\n', start - 1, end - 1) + 1) if start > 0 else 0
+        if cut == 0:
+          cut = mapped.rfind(b'\n', 0, end - 1) + 1
+
+        lines = mapped[cut:end].decode().replace('\r\n', '\n').split('\n')
+        # every line keeps its newline, only the last line of a file may not have one
+        last = lines.pop()
+        if last:
+          yield last
+        for line in reversed(lines):
+          yield line + '\n'
+        end = cut
+
+"""
+Only the lines of a newest first csv dated after a date, in chrono order.
+The newest lines are at the top, so this only reads as far back as it has to.
+:param date_ordinal: dt.DateOrdinal of the last date we already have
+"""
+def ReadLinesNewerThan(filename, contract, date_ordinal):
+  lines = []
+  with open(filename, 'r') as data:
+    for line in data:
+      date = TokenizeToDate(contract, line)
+      if not date: # header, malformed
+        continue
+      if dt.DateOrdinal(date) <= date_ordinal:
+        break
+      lines.append(line)
+
+  return reversed(lines)
+
+"""
+Chrono order lines for the strategies, out of whichever source we got.
+:param data_csv: newest first csv filename
+:param data_list: newest first list of lines
+:param data_stream: anything iterable over lines already in chrono order, e.g. ReadLinesOldestFirst
+"""
+def LinesOldestFirst(data_csv='', data_list=None, data_stream=None):
+  if data_stream is not None:
+    return iter(data_stream)
+  if data_list:
+    return reversed(list(data_list))
+  return ReadLinesOldestFirst(data_csv)
@@ -0,0 +1,97 @@
+import queue, threading, itertools, concurrent.futures
+import Strategies.FileUtil.file_parser as fp
+
+# lines per chunk & chunks buffered per contract, peak memory is about
+# CHUNK_SIZE * MAX_CHUNKS lines per contract whatever the file sizes
+CHUNK_SIZE = 1024
+MAX_CHUNKS = 4
+
+# command line flags for the entry points:
+# --prefetch-workers=<n>     threads reading market data ahead of the replay (default 4), 0 reads inline
+# --prefetch-chunk=<n>       lines per chunk (default 1024)
+PREFETCH_OPTIONS = ['prefetch-workers=', 'prefetch-chunk=']
+
+"""
+Chrono order (date, line) pairs of one contract, read & date-parsed ahead of
+the consumer in chunks on a shared thread pool. At most max_chunks chunks are
+ever buffered or being read, a read only gets scheduled once there is room, so
+pool threads never block on a slow consumer.
+"""
+class PrefetchedStream:
+  def __init__(self, pool, contract, lines, chunk_size=CHUNK_SIZE, max_chunks=MAX_CHUNKS):
+    self.pool = pool
+    self.contract = contract
+    self.lines = iter(lines)
+    self.chunk_size = chunk_size
+    self.max_chunks = max_chunks
+
+    self.chunks = queue.Queue(maxsize=max_chunks)
+    self.lock = threading.Lock()
+    self.reading = False # only one read at a time, lines has to be consumed in order
+    self.buffered = 0    # chunks in the queue or being read
+    self.finished = False
+    self.ScheduleRead()
+
+  def ScheduleRead(self):
+    with self.lock:
+      if self.reading or self.finished or self.buffered >= self.max_chunks:
+        return
+      self.reading = True
+      self.buffered += 1
+    self.pool.submit(self.ReadChunk)
+
+  def ReadChunk(self):
+    try:
+      chunk = list((fp.TokenizeToDate(self.contract, line), line)
+                   for line in itertools.islice(self.lines, self.chunk_size))
+    except Exception as e: # hand it to the consumer
+      chunk = e
+
+    # queued before the next read can get scheduled, or that one could finish & queue first
+    self.chunks.put(chunk)
+    with self.lock:
+      self.reading = False
+      self.finished = isinstance(chunk, Exception) or len(chunk) < self.chunk_size
+    self.ScheduleRead()
+
+  def __iter__(self):
+    while True:
+      chunk = self.chunks.get()
+      with self.lock:
+        self.buffered -= 1
+      self.ScheduleRead()
+
+      if isinstance(chunk, Exception):
+        raise chunk
+      yield from chunk
+      if len(chunk) < self.chunk_size: # short chunk, nothing left
+        return
+
+"""
+Owns the thread pool every contract's PrefetchedStream reads on.
+
+  prefetcher = Prefetcher(workers=4)
+  stream = prefetcher.Open(contract, 'MarketData/csvs/market_data_ES.csv')
+  ...
+  prefetcher.Shutdown()
+"""
+class Prefetcher:
+  def __init__(self, workers=4, chunk_size=CHUNK_SIZE, max_chunks=MAX_CHUNKS):
+    self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+    self.chunk_size = chunk_size
+    self.max_chunks = max_chunks
+
+  def Open(self, contract, filename):
+    return PrefetchedStream(self.pool, contract, fp.ReadLinesOldestFirst(filename), self.chunk_size, self.max_chunks)
+
+  def Shutdown(self):
+    self.pool.shutdown(wait=False)
+
+# Prefetcher configured by the command line, None if prefetching is turned off
+def PrefetcherFromOptions(opts):
+  opts = dict(opts)
+  workers = int(opts.get('--prefetch-workers', 4))
+  if workers <= 0:
+    return None
+
+  return Prefetcher(workers=workers, chunk_size=int(opts.get('--prefetch-chunk', CHUNK_SIZE)))
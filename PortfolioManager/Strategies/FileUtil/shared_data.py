@@ -0,0 +1,169 @@
+import atexit, itertools, multiprocessing.shared_memory
+import numpy
+import Strategies.ContractDef.contract_info as ci
+import Strategies.DateDef.date_util as dt
+import Strategies.FileUtil.file_parser as fp
+
+# arrays start on multiples of this within the segment
+ALIGNMENT = 64
+
+"""
+Chrono order (date, line) pairs of one contract out of a SharedMarketData,
+same as iterating over a PrefetchedStream. Lines get decoded as they're asked for,
+nothing is copied up front.
+"""
+class SharedStream:
+  def __init__(self, data, shc, start=0):
+    self.data = data
+    self.shc = shc
+    self.start = start
+
+  def __len__(self):
+    return len(self.data.Array(self.shc, 'ordinals')) - self.start
+
+  def __iter__(self):
+    dates = self.data.Array(self.shc, 'dates')
+    offsets = self.data.Array(self.shc, 'offsets')
+    text = self.data.Array(self.shc, 'text')
+    for index in range(self.start, len(dates)):
+      yield dates[index].decode(), bytes(text[offsets[index]:offsets[index + 1]]).decode()
+
+"""
+Parsed market data of every contract in one shared memory segment, published once by
+the process running the show, attached to by name in workers without copying or parsing
+anything: attaching maps the segment & lays numpy arrays over it, however big it is.
+Per contract, in chrono order, only the lines which have a date:
+  ordinals:  int64 dt.DateOrdinal of every bar
+  dates:     bar dates as TokenizeToDate has them, bytes
+  ticks:     [num_bars x 4] float64 open, high, low, close in ticks as TokenizeToPriceInfo has them, nan if unparseable
+  offsets:   int64 [num_bars + 1] where every line starts in text
+  text:      uint8 the lines themselves, newlines included
+  contract:  float64 min price increment & tick value
+Arrays are read only, on both ends.
+
+  data = SharedMarketData.Publish(['ES', 'NQ'])
+  handle = data.Handle() # small & picklable, hand it to workers
+  ...
+  worker_data = SharedMarketData.Attach(handle)
+  for date, line in worker_data.Stream('ES'):
+    ...
+  worker_data.Close()
+  ...
+  data.Unlink()
+
+The publisher unlinks the segment when it exits, however it exits: through Unlink, atexit
+or, if it gets killed, multiprocessing's resource tracker. Attached copies never unlink.
+"""
+class SharedMarketData:
+  def __init__(self, segment, layout, owner):
+    self.segment = segment
+    self.layout = layout
+    self.owner = owner
+    self.shortcodes = list(dict.fromkeys(shc for shc, key in layout))
+    self.arrays = {}
+    for (shc, key), (dtype, shape, offset) in layout.items():
+      array = numpy.ndarray(shape, dtype=dtype, buffer=segment.buf, offset=offset)
+      array.flags.writeable = owner # only until Publish has filled it in
+      self.arrays[(shc, key)] = array
+
+  """
+  Parse every contract's csv and put it in a new segment.
+  :param filenames: shortcode to newest first csv, defaults to MarketData/csvs/market_data_<shc>.csv
+  """
+  @classmethod
+  def Publish(cls, shortcodes, filenames=None):
+    contents = {}
+    for shc in shortcodes:
+      filename = (filenames or {}).get(shc, 'MarketData/csvs/market_data_' + shc + '.csv')
+      contents[shc] = ParseContract(ci.ContractInfoDatabase[shc], fp.ReadLinesOldestFirst(filename))
+
+    layout, size = {}, 0
+    for shc, arrays in contents.items():
+      for key, array in arrays.items():
+        layout[(shc, key)] = (array.dtype.str, array.shape, size)
+        size += -(-max(array.nbytes, 1) // ALIGNMENT) * ALIGNMENT
+
+    segment = multiprocessing.shared_memory.SharedMemory(create=True, size=max(size, 1))
+    data = cls(segment, layout, True)
+    for shc, arrays in contents.items():
+      for key, array in arrays.items():
+        data.arrays[(shc, key)][...] = array
+        data.arrays[(shc, key)].flags.writeable = False
+    atexit.register(data.Unlink)
+    return data
+
+  # what workers need to attach, a name & a few numbers per contract
+  def Handle(self):
+    return {'name': self.segment.name, 'layout': self.layout}
+
+  @classmethod
+  def Attach(cls, handle):
+    try:
+      segment = multiprocessing.shared_memory.SharedMemory(name=handle['name'], track=False)
+    except TypeError:
+      # before 3.13 attaching always registers the segment with the resource tracker, workers
+      # share the publisher's, where it's registered already, so that changes nothing
+      segment = multiprocessing.shared_memory.SharedMemory(name=handle['name'])
+    return cls(segment, handle['layout'], False)
+
+  def Array(self, shc, key):
+    return self.arrays[(shc, key)]
+
+  def ContractInfo(self, shc):
+    min_price_increment, tick_value = self.Array(shc, 'contract').tolist()
+    return ci.ContractInfo(shc, min_price_increment, tick_value)
+
+  # :param after: only bars dated after this dt.DateOrdinal, e.g. a replay cursor's
+  def Stream(self, shc, after=None):
+    start = 0 if after is None else int(numpy.searchsorted(self.Array(shc, 'ordinals'), after, side='right'))
+    return SharedStream(self, shc, start)
+
+  # views into the segment have to be gone before it can be unmapped,
+  # if some stream is still being read it stays mapped until we exit
+  def Close(self):
+    if self.segment is None:
+      return
+    self.arrays = {}
+    try:
+      self.segment.close()
+    except BufferError:
+      pass
+    if not self.owner:
+      self.segment = None
+
+  def Unlink(self):
+    if self.segment is None or not self.owner:
+      return
+    self.Close()
+    self.segment.unlink()
+    self.segment = None
+    atexit.unregister(self.Unlink)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    if self.owner:
+      self.Unlink()
+    else:
+      self.Close()
+
+# chrono order lines of one contract as the arrays SharedMarketData keeps
+def ParseContract(contract, lines):
+  ordinals, dates, ticks, text = [], [], [], []
+  for line in lines:
+    date = fp.TokenizeToDate(contract, line)
+    if not date:
+      continue
+    ordinals.append(dt.DateOrdinal(date))
+    dates.append(str(date).encode())
+    ticks.append(list((price if isinstance(price, float) else numpy.nan)
+                      for price in itertools.islice(fp.TokenizeToPriceInfo(contract, line), 1, 5)))
+    text.append(line.encode())
+
+  return {'ordinals': numpy.array(ordinals, dtype=numpy.int64),
+          'dates': numpy.array(dates, dtype=bytes) if dates else numpy.zeros(0, dtype='S1'),
+          'ticks': numpy.array(ticks, dtype=numpy.float64).reshape(len(ticks), 4),
+          'offsets': numpy.concatenate([[0], numpy.cumsum(list(len(line) for line in text), dtype=numpy.int64)]),
+          'text': numpy.frombuffer(b''.join(text), dtype=numpy.uint8),
+          'contract': numpy.array([contract.MinPriceIncrement, contract.TickValue], dtype=numpy.float64)}
@@ -0,0 +1,172 @@
+import sys, os, types, tracemalloc, collections
+import numpy
+
+try:
+  import resource
+except ImportError: # windows
+  resource = None
+
+# command line flags for the entry points:
+# --memory                   tracemalloc diff per phase, retained size per trader/PM & peak RSS
+# --memory-top=<n>           rows per table (default 10)
+MEMORY_OPTIONS = ['memory', 'memory-top=']
+
+# things shared by everybody that shouldn't be charged to whoever points at them
+SKIP_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType)
+
+"""
+Estimate the bytes an object keeps alive: its own size plus everything it
+references through containers and instance attributes. Objects already in
+seen are not counted again, pass the same seen set to charge shared data once.
+"""
+def RetainedSize(obj, seen=None):
+  seen = set() if seen is None else seen
+  size, pending = 0, [obj]
+  while pending:
+    obj = pending.pop()
+    if id(obj) in seen or isinstance(obj, SKIP_TYPES):
+      continue
+    seen.add(id(obj))
+
+    if isinstance(obj, numpy.ndarray):
+      # views don't own their buffer, charge it to the array they look into
+      size += sys.getsizeof(obj)
+      if obj.base is not None:
+        pending.append(obj.base)
+      continue
+
+    size += sys.getsizeof(obj)
+    if isinstance(obj, dict):
+      pending.extend(obj.keys())
+      pending.extend(obj.values())
+    elif isinstance(obj, (list, tuple, set, frozenset, collections.deque)):
+      pending.extend(obj)
+    elif hasattr(obj, '__dict__'):
+      pending.append(obj.__dict__)
+
+  return size
+
+# retained size of every instance attribute of obj
+def AttributeSizes(obj):
+  return {name: RetainedSize(value) for name, value in vars(obj).items()}
+
+# peak resident set size of this process in bytes, None if the platform can't tell
+def PeakRSS():
+  if not resource:
+    return None
+
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return peak if sys.platform == 'darwin' else peak * 1024 # linux reports KB
+
+def FormatBytes(num_bytes):
+  return format(num_bytes / (1024.0 * 1024.0), '10.2f')
+
+"""
+Phase listener which snapshots the python heap with tracemalloc when a phase
+starts and ends, and keeps the difference. Tracing slows everything down a lot,
+only ever enable it to find out where memory goes.
+"""
+class MemoryTracker:
+  def __init__(self, top=10):
+    self.top = top
+    self.phases = [] # stack of (name, snapshot at start)
+    self.reports = [] # (name, traced bytes at end, peak traced bytes during phase, top diff stats)
+
+  def Start(self):
+    tracemalloc.start()
+
+  def Stop(self):
+    tracemalloc.stop()
+
+  def Snapshot(self):
+    return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+  def EnterPhase(self, name):
+    if hasattr(tracemalloc, 'reset_peak'):
+      tracemalloc.reset_peak()
+    self.phases.append((name, self.Snapshot()))
+
+  def ExitPhase(self, name):
+    name, start = self.phases.pop()
+    current, peak = tracemalloc.get_traced_memory()
+    stats = self.Snapshot().compare_to(start, 'lineno')
+    self.reports.append((name, current, peak, stats[:self.top]))
+
+  def PrintPhases(self):
+    for name, current, peak, stats in self.reports:
+      print('  Memory: ' + name + ' traced(MB): ' + FormatBytes(current).strip()
+            + ' phase peak(MB): ' + FormatBytes(peak).strip())
+      print('    ' + format('Allocated at', '70s')
+            + ' ' + format('Diff(MB)', '>10s')
+            + ' ' + format('Total(MB)', '>10s')
+            + ' ' + format('Blocks', '>10s'))
+      for stat in stats:
+        frame = stat.traceback[0]
+        where = os.path.join(os.path.basename(os.path.dirname(frame.filename)), os.path.basename(frame.filename))
+        print('    ' + format(where + ':' + str(frame.lineno), '70s')
+              + ' ' + FormatBytes(stat.size_diff)
+              + ' ' + FormatBytes(stat.size)
+              + ' ' + format(stat.count_diff, '10d'))
+
+"""
+Retained size of a PM: its own attributes, then the traders under it, both
+broken down by attribute so we know which structures are worth compacting.
+"""
+def PrintPMMemory(pm, top=10):
+  trader_sizes, trader_attributes = {}, collections.Counter()
+  for name, trader in pm.traders.items():
+    sizes = AttributeSizes(trader)
+    trader_sizes[trader.ShortName()] = sum(sizes.values())
+    trader_attributes.update(sizes)
+
+  pm_attributes = collections.Counter(AttributeSizes(pm))
+  pm_attributes.pop('traders', None)
+
+  print('  Memory: ' + str(pm) + ' retained(MB): '
+        + FormatBytes(sum(pm_attributes.values()) + sum(trader_sizes.values())).strip())
+  print('    ' + format('PM attribute', '45s') + ' ' + format('MB', '>10s'))
+  for name, size in pm_attributes.most_common(top):
+    print('    ' + format(name, '45s') + ' ' + FormatBytes(size))
+
+  print('    ' + format('Trader attribute, all traders', '45s') + ' ' + format('MB', '>10s'))
+  for name, size in trader_attributes.most_common(top):
+    print('    ' + format(name, '45s') + ' ' + FormatBytes(size))
+
+  print('    ' + format('Trader', '45s') + ' ' + format('MB', '>10s'))
+  for name, size in collections.Counter(trader_sizes).most_common(top):
+    print('    ' + format(name, '45s') + ' ' + FormatBytes(size))
+
+"""
+Start tracking if --memory was given and register for phases.
+:param phase_listeners: perf_util.phase_listeners of the caller
+:return: the tracker or None, hand it to FinishFromOptions at the end of the run
+"""
+def StartFromOptions(opts, phase_listeners):
+  opts = dict(opts)
+  if '--memory' not in opts:
+    return None
+
+  tracker = MemoryTracker(top=int(opts.get('--memory-top', 10)))
+  phase_listeners.append(tracker)
+  tracker.Start()
+  return tracker
+
+"""
+Print the phase diffs, retained size of every PM & of any other named
+structures we were handed, and peak RSS.
+:param structures: map from description to object, e.g. {'market data lines': shc_market_data_lines}
+"""
+def FinishFromOptions(tracker, pm_list=(), structures=None):
+  if not tracker:
+    return
+
+  print('\nMemory usage...')
+  tracker.PrintPhases()
+  for description, obj in (structures or {}).items():
+    print('  Memory: ' + description + ' retained(MB): ' + FormatBytes(RetainedSize(obj)).strip())
+  for pm in pm_list:
+    PrintPMMemory(pm, tracker.top)
+  tracker.Stop()
+
+  peak = PeakRSS()
+  print('  Peak RSS(MB): ' + (FormatBytes(peak).strip() if peak is not None else 'unknown'))
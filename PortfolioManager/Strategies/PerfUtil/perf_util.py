@@ -0,0 +1,188 @@
+import sys, time, functools, contextlib
+
+# instrumentation is opt-in, when this is off nothing gets wrapped and
+# the hot paths run exactly the code they always did
+ENABLED = False
+
+# command line flags for the entry points:
+# --perf                     time every trader, allocator & the replay scheduler
+PERF_OPTIONS = ['perf']
+
+def SetEnabledFromOptions(opts):
+  global ENABLED
+  ENABLED = ('--perf' in dict(opts))
+
+# cumulative time, call count & worst latency of one hot path
+class Counter:
+  def __init__(self, name):
+    self.name = name
+    self.calls = 0
+    self.total_ns = 0
+    self.max_ns = 0
+
+  def Add(self, elapsed_ns):
+    self.calls += 1
+    self.total_ns += elapsed_ns
+    if elapsed_ns > self.max_ns:
+      self.max_ns = elapsed_ns
+
+# counters which don't belong to a PM, like the replay scheduler
+global_counters = {}
+
+def GetCounter(name):
+  if name not in global_counters:
+    global_counters[name] = Counter(name)
+  return global_counters[name]
+
+# anything with EnterPhase(name) & ExitPhase(name), e.g. a profiler, gets told about every Phase
+phase_listeners = []
+phases = [] # names of the phases we're in, outermost first
+
+# the phases we're in as one name, e.g. 'verify-state/replay'
+def PhaseName():
+  return '/'.join(phases) or 'main'
+
+"""
+Mark a phase of a run, like data load or replay, so profilers & memory
+reports can break their numbers down by it. Phases can nest.
+
+  with pf.Phase('replay'):
+    ReplayMarketData(...)
+"""
+@contextlib.contextmanager
+def Phase(name):
+  phases.append(name)
+  for listener in phase_listeners:
+    listener.EnterPhase(name)
+  try:
+    yield
+  finally:
+    for listener in reversed(phase_listeners):
+      listener.ExitPhase(name)
+    phases.pop()
+
+# wrap a bound method so every call gets accumulated into counter
+def Timed(method, counter):
+  @functools.wraps(method)
+  def TimedMethod(*args):
+    start = time.perf_counter_ns()
+    result = method(*args)
+    counter.Add(time.perf_counter_ns() - start)
+    return result
+
+  return TimedMethod
+
+"""
+Time a PM and every trader under it, by shadowing OnMarketDataUpdate,
+RecalibrateAllocations & CheckAllocations on the instances.
+Does nothing unless instrumentation is enabled, call after all traders are added.
+Counters end up in pm.perf_counters, PM's own hot paths first, counters
+already there keep counting.
+"""
+def InstrumentPM(pm):
+  if not ENABLED:
+    return
+
+  pm.perf_counters = pm.perf_counters or {}
+  for method in ['OnMarketDataUpdate', 'OnMarketDataDay', 'RecalibrateAllocations', 'CheckAllocations']:
+    counter = pm.perf_counters.setdefault(method, Counter('pm.' + method))
+    setattr(pm, method, Timed(getattr(pm, method), counter))
+
+  for name, trader in pm.traders.items():
+    counter = pm.perf_counters.setdefault(name, Counter(trader.ShortName()))
+    trader.OnMarketDataUpdate = Timed(trader.OnMarketDataUpdate, counter)
+
+  # banked traders only ever get stepped through their bank
+  for bank in pm.banks:
+    counter = pm.perf_counters.setdefault(bank.Name(), Counter(bank.Name()))
+    bank.OnMarketDataUpdates = Timed(bank.OnMarketDataUpdates, counter)
+
+# drop the instance level wrappers again, e.g. before pickling,
+# counters stay so InstrumentPM can pick up where we left off
+def UninstrumentPM(pm):
+  if not pm.perf_counters:
+    return
+
+  for method in ['OnMarketDataUpdate', 'OnMarketDataDay', 'RecalibrateAllocations', 'CheckAllocations']:
+    pm.__dict__.pop(method, None)
+  for trader in pm.traders.values():
+    trader.__dict__.pop('OnMarketDataUpdate', None)
+  for bank in pm.banks:
+    bank.__dict__.pop('OnMarketDataUpdates', None)
+
+"""
+Print counters sorted by total time, slowest first.
+:param top: only print these many rows, the rest get summed up in one line
+"""
+def PrintCounters(counters, top=None):
+  counters = sorted(counters, key=lambda counter: counter.total_ns, reverse=True)
+  total_ns = sum(counter.total_ns for counter in counters) or 1
+
+  print('    ' + format('Hot path', '45s')
+        + ' ' + format('Calls', '>10s')
+        + ' ' + format('Total(s)', '>10s')
+        + ' ' + format('Share(%)', '>8s')
+        + ' ' + format('Avg(us)', '>10s')
+        + ' ' + format('Max(us)', '>10s'))
+  for counter in counters[:top]:
+    print('    ' + format(counter.name, '45s')
+          + ' ' + format(counter.calls, '10d')
+          + ' ' + format(counter.total_ns / 1e9, '10.3f')
+          + ' ' + format(100.0 * counter.total_ns / total_ns, '8.2f')
+          + ' ' + format(counter.total_ns / 1e3 / max(counter.calls, 1), '10.1f')
+          + ' ' + format(counter.max_ns / 1e3, '10.1f'))
+
+  rest = counters[top:] if top else []
+  if rest:
+    print('    ' + format('... ' + str(len(rest)) + ' more', '45s')
+          + ' ' + format(sum(counter.calls for counter in rest), '10d')
+          + ' ' + format(sum(counter.total_ns for counter in rest) / 1e9, '10.3f')
+          + ' ' + format(100.0 * sum(counter.total_ns for counter in rest) / total_ns, '8.2f'))
+
+# timing table of the counters which don't belong to a PM, like every replay's scheduler
+def PrintGlobalCounters():
+  if not global_counters:
+    return
+
+  print('  Hot paths: replay')
+  PrintCounters(list(global_counters.values()))
+
+# timing table for one PM, traders share the table with the PM's own hot paths
+def PrintPMCounters(pm, top=25):
+  if not pm.perf_counters:
+    return
+
+  print('  Hot paths: ' + str(pm))
+  own = ['OnMarketDataUpdate', 'OnMarketDataDay', 'RecalibrateAllocations', 'CheckAllocations']
+  PrintCounters(list(pm.perf_counters[method] for method in own))
+  PrintCounters(list(counter for name, counter in pm.perf_counters.items() if name not in own), top)
+
+"""
+Single line of throughput & time left, rewritten in place,
+callers decide how often to refresh it.
+:param total: how many updates we expect, 0 if unknown
+"""
+class Progress:
+  def __init__(self, label, total):
+    self.label = label
+    self.total = total
+    self.start = time.perf_counter()
+
+  def Update(self, done):
+    elapsed = time.perf_counter() - self.start
+    rate = done / elapsed if elapsed > 0 else 0
+    line = '  ' + self.label + ' ' + str(done)
+    if self.total:
+      eta = (self.total - done) / rate if rate > 0 else 0
+      line += '/' + str(self.total) + ' (' + format(100.0 * done / self.total, '.1f') + '%)'
+      line += ' ' + format(rate, '.0f') + ' updates/s eta ' + format(eta, '.0f') + 's'
+    else:
+      line += ' ' + format(rate, '.0f') + ' updates/s'
+
+    print('\r' + line, end='')
+    sys.stdout.flush()
+
+  def Finish(self, done):
+    elapsed = time.perf_counter() - self.start
+    print('\r  ' + self.label + ' ' + str(done) + ' in ' + format(elapsed, '.1f') + 's ('
+          + format(done / elapsed if elapsed > 0 else 0, '.0f') + ' updates/s)' + ' ' * 20)
@@ -0,0 +1,139 @@
+import sys, os, threading, collections
+
+# command line flags for the entry points:
+# --profile=<prefix>         sample the whole run, write <prefix>.collapsed & <prefix>.<phase>.collapsed
+# --profile-interval=<ms>    sampling interval in milliseconds (default 5)
+# --profile-top=<n>          rows in the self time tables (default 20)
+PROFILE_OPTIONS = ['profile=', 'profile-interval=', 'profile-top=']
+
+# samples taken outside of any phase end up here
+NO_PHASE = 'other'
+
+def FrameName(frame):
+  code = frame.f_code
+  return code.co_name + ' (' + os.path.basename(code.co_filename) + ':' + str(code.co_firstlineno) + ')'
+
+"""
+Statistical profiler: a background thread grabs the stack of the profiled
+thread every interval and counts identical stacks, per phase.
+
+Only python frames are visible, time spent inside numpy/cvxopt C code shows up
+as self time of the python function which called into it. Figures rendered in
+worker processes are not sampled.
+"""
+class SamplingProfiler:
+  def __init__(self, interval=0.005, thread_id=None):
+    self.interval = interval
+    self.thread_id = thread_id or threading.get_ident()
+    self.phases = [NO_PHASE]
+    self.samples = collections.OrderedDict() # phase -> Counter of stacks, root first
+    self.stop = threading.Event()
+    self.thread = None
+
+  def EnterPhase(self, name):
+    self.phases.append(name)
+
+  def ExitPhase(self, name):
+    if len(self.phases) > 1:
+      self.phases.pop()
+
+  def Start(self):
+    self.stop.clear()
+    self.thread = threading.Thread(target=self.Sample, name='sampling-profiler', daemon=True)
+    self.thread.start()
+
+  def Stop(self):
+    self.stop.set()
+    if self.thread:
+      self.thread.join()
+      self.thread = None
+
+  def Sample(self):
+    while not self.stop.wait(self.interval):
+      frame = sys._current_frames().get(self.thread_id)
+      stack = []
+      while frame is not None:
+        stack.append(FrameName(frame))
+        frame = frame.f_back
+      if not stack:
+        continue
+
+      phase = self.phases[-1]
+      if phase not in self.samples:
+        self.samples[phase] = collections.Counter()
+      self.samples[phase][tuple(reversed(stack))] += 1
+
+  # one line per unique stack, frames separated by ';' then the sample count
+  def WriteCollapsed(self, out, stacks, root=None):
+    for stack, count in stacks.items():
+      out.write(';'.join(((root,) if root else ()) + stack) + ' ' + str(count) + '\n')
+
+  """
+  Write collapsed stacks every flame graph tool understands:
+    <prefix>.collapsed           whole run, phase as the root frame
+    <prefix>.<phase>.collapsed   one per phase
+  """
+  def Write(self, prefix):
+    with open(prefix + '.collapsed', 'w') as out:
+      for phase in self.samples:
+        self.WriteCollapsed(out, self.samples[phase], root=phase)
+
+    for phase in self.samples:
+      with open(prefix + '.' + phase + '.collapsed', 'w') as out:
+        self.WriteCollapsed(out, self.samples[phase])
+
+  # top self time functions of every phase, and of the whole run
+  def PrintReport(self, top=20):
+    total = collections.Counter()
+    for phase in self.samples:
+      total.update(self.samples[phase])
+
+    for phase, stacks in list(self.samples.items()) + [('whole run', total)]:
+      num_samples = sum(stacks.values())
+      print('  Profile: ' + phase + ' ' + str(num_samples) + ' samples ~'
+            + format(num_samples * self.interval, '.1f') + 's')
+      PrintSelfTime(stacks, top)
+
+def PrintSelfTime(stacks, top):
+  self_samples, total_samples = collections.Counter(), collections.Counter()
+  for stack, count in stacks.items():
+    self_samples[stack[-1]] += count
+    for frame in set(stack):
+      total_samples[frame] += count
+
+  num_samples = sum(stacks.values()) or 1
+  print('    ' + format('Function', '60s')
+        + ' ' + format('Self(%)', '>8s')
+        + ' ' + format('Total(%)', '>8s')
+        + ' ' + format('Samples', '>8s'))
+  for frame, count in self_samples.most_common(top):
+    print('    ' + format(frame[:60], '60s')
+          + ' ' + format(100.0 * count / num_samples, '8.2f')
+          + ' ' + format(100.0 * total_samples[frame] / num_samples, '8.2f')
+          + ' ' + format(count, '8d'))
+
+"""
+Start a profiler if --profile was given and register it for phases.
+:param phase_listeners: perf_util.phase_listeners of the caller
+:return: the running profiler or None, hand it to FinishFromOptions at the end of the run
+"""
+def StartFromOptions(opts, phase_listeners):
+  opts = dict(opts)
+  if '--profile' not in opts:
+    return None
+
+  profiler = SamplingProfiler(interval=float(opts.get('--profile-interval', 5)) / 1000.0)
+  profiler.prefix = opts['--profile']
+  profiler.top = int(opts.get('--profile-top', 20))
+  phase_listeners.append(profiler)
+  profiler.Start()
+  return profiler
+
+def FinishFromOptions(profiler):
+  if not profiler:
+    return
+
+  profiler.Stop()
+  print('\nProfile written to ' + profiler.prefix + '.collapsed')
+  profiler.Write(profiler.prefix)
+  profiler.PrintReport(profiler.top)
@@ -1,83 +1,155 @@
 import Strategies.ContractDef.contract_info as ci
+import Strategies.DateDef.date_util as dt
+import Strategies.PnlUtil.pnl_util as pu
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdt
-from datetime import datetime
-import math
+import concurrent.futures
+import numpy
 
 DPI = 96
 
+# render settings, change these through SetRenderMode
+HEADLESS = False    # Agg backend, write pngs and never open/block on a window
+DPI_SCALE = 5       # figures are saved at DPI * DPI_SCALE
+MAX_POINTS = None   # downsample every plotted series to at most these many points
+RENDER_WORKERS = 0  # number of worker processes to render figures in, 0 renders inline
+
+render_pool = None
+pending_renders = []
+
+"""
+Switch how figures get rendered.
+
+:param headless: use the Agg backend, don't toggle full screen or block on plt.show()
+:param workers: render figures concurrently in these many worker processes, call
+                WaitForRenders() before exiting to make sure every png got written
+:param max_points: downsample every series to this many points (largest triangle three buckets)
+:param dpi_scale: figures are saved at DPI * dpi_scale
+"""
+def SetRenderMode(headless=True, workers=0, max_points=None, dpi_scale=1):
+  global HEADLESS, DPI_SCALE, MAX_POINTS, RENDER_WORKERS
+
+  WaitForRenders()
+  HEADLESS, DPI_SCALE, MAX_POINTS, RENDER_WORKERS = headless, dpi_scale, max_points, workers
+  if HEADLESS:
+    plt.switch_backend('Agg')
+
+# command line flags for the entry points:
+# --headless                 write pngs with the Agg backend, never block on a plot window
+# --render-workers=<n>       render figures in n worker processes
+# --max-plot-points=<n>      downsample every plotted series to n points
+RENDER_OPTIONS = ['headless', 'render-workers=', 'max-plot-points=']
+
+def SetRenderModeFromOptions(opts):
+  opts = dict(opts)
+  if not any(('--' + option.strip('=')) in opts for option in RENDER_OPTIONS):
+    return
+
+  SetRenderMode(headless=('--headless' in opts),
+                workers=int(opts.get('--render-workers', 0)),
+                max_points=(int(opts['--max-plot-points']) if '--max-plot-points' in opts else None),
+                dpi_scale=(1 if '--headless' in opts else 5))
+
+def InitRenderWorker(max_points, dpi_scale):
+  global HEADLESS, DPI_SCALE, MAX_POINTS, RENDER_WORKERS
+
+  # workers only ever write files
+  HEADLESS, DPI_SCALE, MAX_POINTS, RENDER_WORKERS = True, dpi_scale, max_points, 0
+  plt.switch_backend('Agg')
+
+# draw right away, or hand it to a worker process if we have any
+def Render(draw_function, *args):
+  global render_pool
+
+  if RENDER_WORKERS <= 0:
+    draw_function(*args)
+    return
+
+  if not render_pool:
+    render_pool = concurrent.futures.ProcessPoolExecutor(max_workers=RENDER_WORKERS,
+                                                         initializer=InitRenderWorker,
+                                                         initargs=(MAX_POINTS, DPI_SCALE))
+  pending_renders.append(render_pool.submit(draw_function, *args))
+
+# block till every figure handed to a worker has been written
+def WaitForRenders():
+  global render_pool, pending_renders
+
+  for future in pending_renders:
+    future.result() # re-raises anything that went wrong while drawing
+  pending_renders = []
+
+  if render_pool:
+    render_pool.shutdown()
+    render_pool = None
+
+def FinishFigure(filename, dpi, show=True):
+  plt.savefig(filename, bbox_inches='tight', dpi=dpi)
+  if not HEADLESS:
+    mng = plt.get_current_fig_manager()
+    mng.full_screen_toggle()
+    if show:
+      plt.show()
+  plt.close('all') # free memory
+
+"""
+Largest triangle three buckets: pick num_points indices out of the series
+which preserve its visual shape, first and last points are always kept.
+"""
+def LTTBIndices(x, y, num_points):
+  num_entries = len(x)
+  if not num_points or num_points >= num_entries or num_points < 3:
+    return numpy.arange(num_entries)
+
+  x, y = numpy.asarray(x, dtype=float), numpy.asarray(y, dtype=float)
+
+  # num_points - 2 buckets between the first and last point
+  edges = numpy.linspace(1, num_entries - 1, num_points - 1).astype(int)
+  edges = numpy.append(edges, num_entries)
+
+  indices = numpy.empty(num_points, dtype=int)
+  indices[0], indices[-1] = 0, num_entries - 1
+  selected = 0
+  for bucket in range(num_points - 2):
+    start, end = edges[bucket], edges[bucket + 1]
+    next_start, next_end = edges[bucket + 1], edges[bucket + 2]
+
+    # the point making the largest triangle with the last selected point
+    # and the average of the next bucket wins
+    avg_x, avg_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+    area = numpy.abs((x[selected] - avg_x) * (y[start:end] - y[selected])
+                     - (x[selected] - x[start:end]) * (avg_y - y[selected]))
+    selected = start + int(numpy.argmax(area))
+    indices[bucket + 1] = selected
+
+  return indices
+
+def Downsample(dates, values):
+  if not MAX_POINTS or len(dates) <= MAX_POINTS:
+    return dates, values
+
+  x = numpy.asarray(dates).astype('datetime64[D]').astype(float)
+  indices = LTTBIndices(x, values, MAX_POINTS)
+  return numpy.asarray(dates)[indices], numpy.asarray(values)[indices]
+
 def MergeAndPlotTradesAndAlloc(strategy, contract_results, contract_allocs, contracts_db):
-  # it would be very hard to have a worse solution than what i'm using here
-  # i suck at python :(
-
-  # date to contract to pnl - dict of dicts
-  date_contract_pnls, date_contract_allocs = {}, {}
-
-  # list of dates in chrono order
-  max_days_key = ('ZC' if 'ZC' in contract_results else list(contract_results.keys())[0])
-  date_list = list(trades[0] for trades in list(contract_results[max_days_key]))
-
-  for key in contract_results.keys():
-    for i in range(0, len(contract_results[key])):
-      trades = contract_results[key][i]
-      alloc = contract_allocs[key][i]
-
-      date, pnl = trades[0], trades[5]
-      if date not in date_contract_pnls:
-        date_contract_pnls[date], date_contract_allocs[date] = {}, {}
-      date_contract_pnls[date][key] = pnl
-      date_contract_allocs[date][key] = alloc
-
-  # contract to date to pnl - dict of dicts
-  contract_date_pnls, contract_date_allocs = {}, {}
-
-  for key in contract_results.keys():
-    if key not in contract_date_pnls:
-      contract_date_pnls[key], contract_date_allocs[key] = {}, {}
-    last_pnl, last_alloc = 0, 0
-    for date in date_list:
-      # idea is to fill in pnls for days where specific contracts don't have an entry
-      last_pnl = (date_contract_pnls[date][key] if key in date_contract_pnls[date] else last_pnl)
-      last_alloc = (date_contract_allocs[date][key] if key in date_contract_allocs[date] else last_alloc)
-      contract_date_pnls[key][date] = last_pnl
-      contract_date_allocs[key][date] = last_alloc
-
-  # date to pnl across all contracts
-  date_total_pnls = {}
-
-  for date in date_list:
-    date_total_pnls[date] = 0
-    for key in contract_results.keys():
-      date_total_pnls[date] += contract_date_pnls[key][date]
-
-  pnl_list = list(date_total_pnls[date]/1000.0 for date in date_list)
+  # all the number crunching happens in pnl_util, this only draws the aligned series
+  keys, dates, pnl_matrix, alloc_matrix = pu.AlignTradesAndAllocs(contract_results, contract_allocs)
+  PlotTradesAndAlloc(strategy, keys, dates, pnl_matrix, alloc_matrix)
+
+  pnl_list = pu.EquityCurve(pnl_matrix)/1000.0
+  return mdt.date2num(dates), pnl_list
+
+def PlotTradesAndAlloc(strategy, keys, dates, pnl_matrix, alloc_matrix):
+  Render(DrawTradesAndAlloc, strategy, keys, dates, pnl_matrix, alloc_matrix)
 
+def DrawTradesAndAlloc(strategy, keys, dates, pnl_matrix, alloc_matrix):
   fig, axarr = plt.subplots(2, sharex=True)
   fig.tight_layout() # use as much space as you can
 
-  for key in contract_results.keys():
-    trades = contract_results[key]
-    allocs = contract_allocs[key]
-    t_date_list = list(entry[0] for entry in trades)
-    dt_objs = []
-    for dt in t_date_list:  # create date objects for matlibplot
-      dt_objs.append(datetime.strptime(dt, '%m-%d-%y'))
-    dates = mdt.date2num (dt_objs)
-
-    pnl = []
-    last_pnl = 0
-    for entry in trades:
-      try:
-        # pnl.append(math.log10(entry[5]/1000.0))
-        pnl.append((entry[5]/1000.0))
-      except ValueError:
-        pnl.append(last_pnl)
-      last_pnl = pnl[-1]
-
-    alloc = list(entry/1000.0 for entry in allocs)
-
-    axarr[0].plot_date(dates, pnl, linestyle='solid', linewidth=0.5, markersize=0.5, label='pnl-log$Ks-' + key)
-    axarr[1].plot_date(dates, alloc, linestyle='solid', linewidth=0.5, markersize=0.5, label='alloc-$Ks' + key)
+  for index, key in enumerate(keys):
+    axarr[0].plot(*Downsample(dates, pnl_matrix[:, index]/1000.0), linestyle='solid', linewidth=0.5, marker='o', markersize=0.5, label='pnl-log$Ks-' + key)
+    axarr[1].plot(*Downsample(dates, alloc_matrix[:, index]/1000.0), linestyle='solid', linewidth=0.5, marker='o', markersize=0.5, label='alloc-$Ks' + key)
 
   axarr[0].set_title(strategy + ' - strategy pnls')
   axarr[0].legend(loc='upper left', fontsize=4, title=strategy)
@@ -85,68 +157,103 @@ def MergeAndPlotTradesAndAlloc(strategy, contract_results, contract_allocs, cont
   axarr[1].legend(loc='upper left', fontsize=4, title=strategy)
   axarr[1].axhline(y=0, color='black', linestyle='-')
 
-  all_dt_objs = []
-  for dt in date_list: # create date objects for matlibplot
-    all_dt_objs.append(datetime.strptime(dt, '%m-%d-%y'))
-  all_dates = mdt.date2num(all_dt_objs)
+  plt.xlabel('date')
+  FinishFigure(strategy + '.png', DPI*DPI_SCALE)
+
+# price, moving average & pnl of a single strategy run from Strategies/
+def PlotTrades(strategy, trades, contract, start_index, end_index):
+  trades = trades[start_index:end_index]
+  dates = dt.ToDatetime64(list(row[0] for row in trades))
+  columns = numpy.array(list(row[3] for row in trades)), numpy.array(list(row[7] for row in trades)),\
+            numpy.array(list(row[5] for row in trades))/1000.0
+
+  Render(DrawTrades, strategy, contract.Name, dates, columns, ['price', 'ma'])
+
+# same as PlotTrades, with the projected price stat arb trades on
+def PlotStatArbTrades(strategy, trades, contract, start_index, end_index):
+  trades = trades[start_index:end_index]
+  dates = dt.ToDatetime64(list(row[0] for row in trades))
+  columns = numpy.array(list(row[3] for row in trades)), numpy.array(list(row[9] for row in trades)),\
+            numpy.array(list(row[5] for row in trades))/1000.0
+
+  Render(DrawTrades, strategy, contract.Name, dates, columns, ['price', 'projected-price'])
+
+def DrawTrades(strategy, name, dates, columns, price_labels):
+  fig, axarr = plt.subplots(2, sharex=True)
+  fig.tight_layout() # use as much space as you can
+
+  for column, label in zip(columns[:-1], price_labels):
+    axarr[0].plot(*Downsample(dates, column), linestyle='solid', linewidth=0.5, label=label)
+  axarr[1].plot(*Downsample(dates, columns[-1]), linestyle='solid', linewidth=0.5, label='pnl-$Ks')
 
-  total_pnl = pnl_list[-1]
-  # print('\t', strategy, 'STATS', 'total-pnl($ billions):', total_pnl/1000000.0)
+  axarr[0].set_title(strategy + ' - ' + name)
+  axarr[0].legend(loc='upper left', fontsize=4)
+  axarr[1].legend(loc='upper left', fontsize=4)
+  axarr[1].axhline(y=0, color='black', linestyle='-')
 
   plt.xlabel('date')
-  plt.savefig(strategy + '.png', bbox_inches='tight', dpi=DPI*5)
-  mng = plt.get_current_fig_manager()
-  mng.full_screen_toggle()
-  plt.show()
-  plt.close('all') # free memory
+  FinishFigure(strategy + '-' + name + '.png', DPI*DPI_SCALE)
+
+# pnl of every contract a strategy ran on, lined up on the same dates
+def MergeAndPlotTrades(strategy, contract_results, contracts_db):
+  keys = list(contract_results.keys())
+  dates, (pnl_matrix,) = pu.AlignSeries(list(list(row[0] for row in contract_results[key]) for key in keys),
+                                        list(list(row[5] for row in contract_results[key]) for key in keys))
 
-  return all_dates, pnl_list
+  Render(DrawMergedTrades, strategy, keys, dates, pnl_matrix)
+  return dates, pu.EquityCurve(pnl_matrix)
+
+def DrawMergedTrades(strategy, keys, dates, pnl_matrix):
+  for index, key in enumerate(keys):
+    plt.plot(*Downsample(dates, pnl_matrix[:, index]/1000.0), linestyle='solid', linewidth=0.5, label='pnl-$Ks-' + key)
+  plt.plot(*Downsample(dates, pu.EquityCurve(pnl_matrix)/1000.0), linestyle='solid', label='total-pnl-$Ks')
+
+  plt.legend(loc='upper left', fontsize=4, title=strategy)
+  plt.xlabel('date')
+  FinishFigure(strategy + '.png', DPI*DPI_SCALE)
 
 def ComparePlots(all_dates, pm_pnl_list):
+  Render(DrawComparePlots, all_dates, pm_pnl_list)
+
+def DrawComparePlots(all_dates, pm_pnl_list):
   for pm in pm_pnl_list:
     pnl_list = list(pnl/1000.0 for pnl in pm_pnl_list[pm])
-    plt.plot_date(all_dates, pnl_list, linestyle='solid', label=str(pm) + '-total-pnl-$millions')
+    plt.plot(*Downsample(all_dates, pnl_list), linestyle='solid', marker='o', label=str(pm) + '-total-pnl-$millions')
 
   plt.legend (loc='upper left')
   plt.xlabel('date')
-  plt.savefig('PMComparePlots.png', bbox_inches='tight', dpi=DPI*5)
-  mng = plt.get_current_fig_manager()
-  mng.full_screen_toggle()
-  plt.show()
-  plt.close('all') # free memory
+  FinishFigure('PMComparePlots.png', DPI*DPI_SCALE)
 
 def PlotEfficientFrontierPlot(std_mean):
   for line in std_mean:
     print('adding ' + str(line))
+  Render(DrawEfficientFrontierPlot, std_mean)
+
+def DrawEfficientFrontierPlot(std_mean):
+  for line in std_mean:
     plt.plot(line[0], line[1], 'o', label=line[2])
 
   plt.legend(loc='lower right')
   plt.xlabel('stdev')
   plt.ylabel('avg-pnl')
-  plt.savefig('EfficientFrontier.png', bbox_inches='tight', dpi=DPI*5)
-  mng = plt.get_current_fig_manager()
-  mng.full_screen_toggle()
-  plt.show()
-  plt.close('all')
+  FinishFigure('EfficientFrontier.png', DPI*DPI_SCALE)
 
 def PlotList(l, title):
+  Render(DrawList, l, title)
+
+def DrawList(l, title):
   plt.xlabel('points')
   plt.ylabel(title)
   plt.scatter(range(0, len(l)), l)
   plt.title(title)
-  plt.savefig(title + '.png', bbox_inches='tight', dpi=DPI)
-  mng = plt.get_current_fig_manager()
-  mng.full_screen_toggle()
-  # plt.show()
-  plt.close('all')
+  FinishFigure(title + '.png', DPI, show=False)
 
 def PlotXY(x, y, title):
+  Render(DrawXY, x, y, title)
+
+def DrawXY(x, y, title):
   plt.xlabel('x')
   plt.ylabel('y')
   plt.scatter(x, y)
   plt.title(title)
-  plt.savefig(title + '.png', bbox_inches='tight', dpi=DPI)
-  mng = plt.get_current_fig_manager()
-  mng.full_screen_toggle()
-  # plt.show()
-  plt.close('all')
+  FinishFigure(title + '.png', DPI, show=False)
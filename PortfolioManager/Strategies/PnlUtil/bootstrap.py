@@ -0,0 +1,147 @@
+import numpy
+
+DEFAULT_RESAMPLES = 1000
+DEFAULT_BLOCK_LENGTH = 20 # about a month of trading days, keeps most of the autocorrelation in daily pnl
+DEFAULT_SEED = 20170821
+DEFAULT_CONFIDENCE = 0.95
+
+# resamples get composed this many at a time for drawdowns, keeps the working set in cache
+DRAWDOWN_CHUNK = 256
+
+# what SummarizePerformance prints intervals with, see SetFromOptions
+resamples = DEFAULT_RESAMPLES
+block_length = DEFAULT_BLOCK_LENGTH
+
+# command line flags for the entry points:
+# --bootstrap-resamples=<n>  resamples behind every confidence interval printed (default 1000), 0 turns them off
+# --bootstrap-block=<days>   days per resampled block (default 20)
+BOOTSTRAP_OPTIONS = ['bootstrap-resamples=', 'bootstrap-block=']
+
+def SetFromOptions(opts):
+  global resamples, block_length
+  opts = dict(opts)
+  resamples = int(opts.get('--bootstrap-resamples', resamples))
+  block_length = int(opts.get('--bootstrap-block', block_length))
+
+"""
+Per block sums & path summaries of [num_series x num_days] daily pnl cut into consecutive
+blocks of block_length days, days past the last whole block are left out. Everything a
+statistic of any concatenation of blocks needs, each [num_blocks x num_series]:
+  sum, sum of squares, sum & sum of squares of the downside (min(pnl, 0))
+  peak & trough of the pnl since the block started, the empty start included, & the
+  deepest drawdown within the block
+"""
+def BlockSummaries(daily_pnl, block_length):
+  num_series, num_days = daily_pnl.shape
+  num_blocks = num_days // block_length
+  blocks = daily_pnl[:, :num_blocks * block_length].reshape(num_series, num_blocks, block_length).transpose(1, 0, 2)
+
+  downside = numpy.minimum(blocks, 0)
+  path = numpy.cumsum(blocks, axis=2)
+  high_water = numpy.maximum.accumulate(numpy.maximum(path, 0), axis=2)
+  return {'sum': blocks.sum(axis=2), 'squares': (blocks * blocks).sum(axis=2),
+          'down_sum': downside.sum(axis=2), 'down_squares': (downside * downside).sum(axis=2),
+          'peak': numpy.maximum(path.max(axis=2), 0), 'trough': numpy.minimum(path.min(axis=2), 0),
+          'drawdown': (high_water - path).max(axis=2)}
+
+"""
+Chain blocks one after the other & track the deepest drawdown, exactly what running the
+concatenated daily pnl through a high water mark would give. Only the gap below the high
+water mark needs carrying from block to block, a block deepens the drawdown by its trough
+below that gap or by its own drawdown, then its peak may set a new high water mark.
+:param summaries: BlockSummaries
+:param order: [num_resamples x num_positions] block indices, every row one resampled history
+:return: [num_series x num_resamples] max drawdowns, positive numbers
+"""
+def ComposeDrawdowns(summaries, order):
+  dtype = summaries['sum'].dtype
+  num_series, num_resamples = summaries['sum'].shape[1], order.shape[0]
+  drawdowns = numpy.empty((num_resamples, num_series), dtype=dtype)
+  gathered = numpy.empty((4, min(DRAWDOWN_CHUNK, num_resamples), num_series), dtype=dtype)
+  for chunk in range(0, num_resamples, DRAWDOWN_CHUNK):
+    rows = order[chunk:chunk + DRAWDOWN_CHUNK]
+    gap = numpy.zeros((len(rows), num_series), dtype=dtype)
+    drawdown = numpy.zeros_like(gap)
+    depth, block_drawdown, peak, total = (buffer[:len(rows)] for buffer in gathered)
+    for position in range(order.shape[1]):
+      blocks = rows[:, position]
+      numpy.take(summaries['trough'], blocks, axis=0, out=depth)
+      numpy.take(summaries['drawdown'], blocks, axis=0, out=block_drawdown)
+      numpy.take(summaries['peak'], blocks, axis=0, out=peak)
+      numpy.take(summaries['sum'], blocks, axis=0, out=total)
+      numpy.subtract(gap, depth, out=depth)
+      numpy.maximum(drawdown, depth, out=drawdown)
+      numpy.maximum(drawdown, block_drawdown, out=drawdown)
+      numpy.maximum(gap, peak, out=gap)
+      gap -= total
+    drawdowns[chunk:chunk + len(rows)] = drawdown
+  return drawdowns.T
+
+"""
+Mean, Sharpe & Sortino of daily pnl from sums, same definitions as Trader's:
+sample standard deviations, downside deviation over every day with upside days as 0.
+Series which never move get 0.
+"""
+def MomentStatistics(count, total, squares, down_total, down_squares):
+  mean = total / count
+  stdev = numpy.sqrt(numpy.maximum(squares - count * mean * mean, 0) / (count - 1))
+  down_mean = down_total / count
+  down_stdev = numpy.sqrt(numpy.maximum(down_squares - count * down_mean * down_mean, 0) / (count - 1))
+  return {'mean': mean,
+          'sharpe': numpy.divide(mean, stdev, out=numpy.zeros_like(mean), where=stdev > 0),
+          'sortino': numpy.divide(mean, down_stdev, out=numpy.zeros_like(mean), where=down_stdev > 0)}
+
+"""
+Block bootstrap confidence intervals for mean daily pnl, Sharpe, Sortino & max drawdown of many
+series at once. Every resample is the same draw of blocks for every series, so series keep their
+correlation. Moments are one matrix product of block sums with how often every resample picked
+every block, drawdowns one pass over block positions, never a [series x resamples x days] array.
+Point estimates come off the whole data, resamples off whole blocks only & in single precision.
+
+  intervals = BootstrapIntervals(numpy.array(list(trader.daily_pnl for trader in traders)))
+  estimate, low, high = intervals['sharpe']
+
+:param daily_pnl: [num_series x num_days] daily pnl, series of different lengths padded with 0s
+:param num_resamples: resampled histories, each as many blocks long as the data
+:param block_length: days per block, consecutive days stay together to keep autocorrelation
+:param seed: fixed so the same data always gets the same intervals
+:param confidence: central probability covered, percentile intervals
+:param drawdowns: also max drawdowns, off by default: composing them exactly takes a pass over
+  num_series x num_resamples per block position, ~10s for 1000 series x 5000 resamples x 4600 days
+  on one core against ~0.6s for the moments, too slow for a recalibration. A summary's 42 series x
+  1000 resamples x 1500 days take ~20ms all in
+:return: map from 'mean', 'sharpe', 'sortino' (& 'max_drawdown') to (estimate, low, high) arrays, one entry per series
+"""
+def BootstrapIntervals(daily_pnl, num_resamples=DEFAULT_RESAMPLES, block_length=DEFAULT_BLOCK_LENGTH,
+                       seed=DEFAULT_SEED, confidence=DEFAULT_CONFIDENCE, drawdowns=False):
+  daily_pnl = numpy.atleast_2d(numpy.asarray(daily_pnl, dtype=float))
+  num_days = daily_pnl.shape[1]
+  block_length = max(1, min(block_length, num_days))
+
+  estimates = MomentStatistics(num_days, daily_pnl.sum(axis=1), (daily_pnl * daily_pnl).sum(axis=1),
+                               numpy.minimum(daily_pnl, 0).sum(axis=1), numpy.square(numpy.minimum(daily_pnl, 0)).sum(axis=1))
+  if drawdowns:
+    high_water = numpy.maximum.accumulate(numpy.maximum(numpy.cumsum(daily_pnl, axis=1), 0), axis=1)
+    estimates['max_drawdown'] = (high_water - numpy.cumsum(daily_pnl, axis=1)).max(axis=1)
+
+  summaries = {key: summary.astype(numpy.float32) for key, summary in BlockSummaries(daily_pnl, block_length).items()}
+  num_blocks = summaries['sum'].shape[0]
+  order = numpy.random.default_rng(seed).integers(0, num_blocks, size=(num_resamples, num_blocks))
+  # how often every resample picked every block, sums of any resample are a matrix product away
+  picks = numpy.bincount((order + numpy.arange(num_resamples)[:, None] * num_blocks).reshape(-1),
+                         minlength=num_resamples * num_blocks).reshape(num_resamples, num_blocks).T.astype(numpy.float32)
+
+  keys = ['sum', 'squares', 'down_sum', 'down_squares']
+  sums = numpy.stack(list(summaries[key].T for key in keys)) @ picks # [4 x num_series x num_resamples]
+  resampled = MomentStatistics(num_blocks * block_length, *sums)
+  if drawdowns:
+    resampled['max_drawdown'] = ComposeDrawdowns(summaries, order)
+
+  # both ends of every interval out of one partition
+  low_index = int(round((1 - confidence) / 2 * (num_resamples - 1)))
+  high_index = num_resamples - 1 - low_index
+  intervals = {}
+  for key, estimate in estimates.items():
+    ends = numpy.partition(resampled[key], [low_index, high_index], axis=1)
+    intervals[key] = (estimate, ends[:, low_index].astype(float), ends[:, high_index].astype(float))
+  return intervals
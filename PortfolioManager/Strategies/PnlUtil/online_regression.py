@@ -0,0 +1,65 @@
+import numpy
+
+DEFAULT_FORGETTING = 0.995 # weight of a sample drops by this every later one, the last 200 or so count
+DEFAULT_REGULARIZATION = 1e-2 # ridge penalty on the coefficients before any sample, fades out with forgetting
+
+"""
+Linear regressions of many series at once, one per series, learnt one sample at a time by
+recursive least squares: every series keeps its coefficients & the inverse of its (exponentially
+forgotten, ridge started) XᵀX, updated with Sherman-Morrison in O(num_features²) per sample.
+A sample costs the same however many came before, no refit on history.
+The coefficients are those of the ridge regression on every sample so far, each weighed down by
+forgetting for every sample after it.
+
+  learner = RecursiveLeastSquares(3)
+  learner.Grow(2)
+  learner.PartialFit(numpy.array([[1.0, 0.2, 0.1], [1.0, -0.1, 0.0]]), numpy.array([0.3, -0.1]))
+  predictions = learner.Predict(numpy.array([[1.0, 0.1, 0.1], [1.0, 0.0, 0.2]]))
+"""
+class RecursiveLeastSquares:
+  def __init__(self, num_features, forgetting=DEFAULT_FORGETTING, regularization=DEFAULT_REGULARIZATION):
+    self.num_features = num_features
+    self.forgetting = forgetting
+    self.regularization = regularization
+    self.coefficients = numpy.zeros((0, num_features))
+    self.inverse = numpy.zeros((0, num_features, num_features)) # (λ-weighted XᵀX + regularization I)⁻¹ per series
+    self.num_samples = numpy.zeros(0, dtype=int)
+
+  def NumSeries(self):
+    return len(self.coefficients)
+
+  # series added later start with coefficients 0
+  def Grow(self, num_series):
+    num_new = num_series - self.NumSeries()
+    if num_new > 0:
+      self.coefficients = numpy.vstack([self.coefficients, numpy.zeros((num_new, self.num_features))])
+      identity = numpy.eye(self.num_features) / self.regularization
+      self.inverse = numpy.concatenate([self.inverse, numpy.broadcast_to(identity, (num_new,) + identity.shape)])
+      self.num_samples = numpy.concatenate([self.num_samples, numpy.zeros(num_new, dtype=int)])
+
+  """
+  One sample of every series, series with mask False are left as they are.
+  :param features: [num_series x num_features]
+  :param targets: [num_series]
+  :param mask: [num_series] bools, which series the sample is for, all of them if None
+  """
+  def PartialFit(self, features, targets, mask=None):
+    if mask is not None:
+      series = numpy.flatnonzero(mask)
+      features, targets = features[series], targets[series]
+    else:
+      series = slice(None)
+    inverse = self.inverse[series]
+
+    # gain k = P x / (λ + xᵀ P x), P stays symmetric so xᵀ P is (P x)ᵀ
+    projected = numpy.einsum('nij,nj->ni', inverse, features)
+    gain = projected / (self.forgetting + numpy.einsum('ni,ni->n', features, projected))[:, None]
+    errors = targets - numpy.einsum('ni,ni->n', self.coefficients[series], features)
+
+    self.coefficients[series] += gain * errors[:, None]
+    self.inverse[series] = (inverse - gain[:, :, None] * projected[:, None, :]) / self.forgetting
+    self.num_samples[series] += 1
+
+  # :return: [num_series] predictions off [num_series x num_features] features
+  def Predict(self, features):
+    return numpy.einsum('ni,ni->n', self.coefficients, features)
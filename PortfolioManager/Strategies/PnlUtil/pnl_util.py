@@ -0,0 +1,70 @@
+import numpy
+import Strategies.DateDef.date_util as dt
+
+# column of the pnl since inception in every trades row
+TRADE_PNL_COLUMN = 5
+
+# forward fill a [num_dates x num_series] matrix along the date axis,
+# entries which were never set (mask False) carry the last value set,
+# or 0 if nothing has been set yet for that series
+def ForwardFill(matrix, mask):
+  rows = numpy.arange(matrix.shape[0]).reshape(-1, 1)
+  last_set = numpy.maximum.accumulate(numpy.where(mask, rows, -1), axis=0)
+  filled = numpy.take_along_axis(matrix, numpy.maximum(last_set, 0), axis=0)
+  filled[last_set < 0] = 0
+  return filled
+
+"""
+Align a bunch of dated series onto the union of all their dates.
+
+:param date_series: list of date sequences, one per series
+:param value_series: list of value sequences, one per series, same lengths as date_series
+:return: (sorted datetime64 union date index, [num_dates x num_series] forward filled matrices, one per value_series)
+"""
+def AlignSeries(date_series, *value_series):
+  lengths = numpy.array([len(dates) for dates in date_series], dtype=int)
+  all_dates = dt.ToDatetime64([date for dates in date_series for date in dates])
+  union_dates, positions = numpy.unique(all_dates, return_inverse=True)
+  positions = positions.reshape(-1)
+
+  # which column every flattened entry belongs to
+  columns = numpy.repeat(numpy.arange(len(date_series)), lengths)
+
+  mask = numpy.zeros((len(union_dates), len(date_series)), dtype=bool)
+  mask[positions, columns] = True
+
+  matrices = []
+  for values in value_series:
+    flat_values = numpy.fromiter((value for series in values for value in series), dtype=float,
+                                 count=int(lengths.sum()))
+    matrix = numpy.zeros(mask.shape)
+    # for duplicate dates in a series, the later entry wins
+    matrix[positions, columns] = flat_values
+    matrices.append(ForwardFill(matrix, mask))
+
+  return union_dates, matrices
+
+"""
+Align every trader's pnl & allocation history onto the union of all trading dates,
+so portfolio level numbers do not depend on which trader happened to trade the longest.
+
+:param contract_results: map from trader name to list of trades rows
+:param contract_allocs: map from trader name to list of allocations, one per trades row
+:return: (trader names in column order, sorted datetime64 dates, pnl matrix, alloc matrix)
+"""
+def AlignTradesAndAllocs(contract_results, contract_allocs):
+  keys = list(contract_results.keys())
+  date_series = [[row[0] for row in contract_results[key]] for key in keys]
+  pnl_series = [[row[TRADE_PNL_COLUMN] for row in contract_results[key]] for key in keys]
+  alloc_series = [contract_allocs[key][:len(contract_results[key])] for key in keys]
+
+  dates, (pnl_matrix, alloc_matrix) = AlignSeries(date_series, pnl_series, alloc_series)
+  return keys, dates, pnl_matrix, alloc_matrix
+
+# total pnl since inception across all traders for every date
+def EquityCurve(pnl_matrix):
+  return pnl_matrix.sum(axis=1)
+
+# day over day changes in an equity curve, first day counts in full
+def DailyPnl(equity_curve):
+  return numpy.diff(equity_curve, prepend=0)
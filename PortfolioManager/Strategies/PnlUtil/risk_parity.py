@@ -0,0 +1,200 @@
+import numpy
+
+DEFAULT_WINDOW = 63 # days of returns behind the covariance, about a quarter of trading days
+DEFAULT_SHRINKAGE = 0.1 # weight of the diagonal in the covariance, keeps it invertible on windows shorter than the traders
+DEFAULT_TOLERANCE = 1e-10 # risk contributions all within this fraction of their mean
+MAX_NEWTON_STEPS = 50
+
+"""
+The last window days of returns of many series in a ring buffer, a new day costs O(num_series).
+The covariance never gets formed, Factors hands out centered returns F with FᵀF the sample
+covariance, which is all products with it need & costs O(num_series x window) instead of
+O(num_series²) once there are more series than days. Factors come in the same buffer every
+time, they're good until the next call.
+
+  returns = RollingCovariance(63)
+  returns.Add(numpy.array([0.01, -0.02, 0.0]))
+  factors, variances = returns.Factors([0, 2])
+"""
+class RollingCovariance:
+  def __init__(self, window=DEFAULT_WINDOW):
+    self.window = window
+    self.rows = numpy.zeros((window, 0))
+    self.count = 0 # days added so far, only the last window of them are kept
+    self.factors = numpy.zeros(0) # what Factors hands out, reshaped to fit
+
+  def NumSeries(self):
+    return self.rows.shape[1]
+
+  def NumRows(self):
+    return min(self.count, self.window)
+
+  # series added later had 0 returns on the days before
+  def Grow(self, num_series):
+    if num_series > self.NumSeries():
+      self.rows = numpy.hstack([self.rows, numpy.zeros((self.window, num_series - self.NumSeries()))])
+
+  # one day of returns, series past the end of returns had 0
+  def Add(self, returns):
+    slot = self.count % self.window
+    self.rows[slot] = 0
+    self.rows[slot, :len(returns)] = returns
+    self.count += 1
+
+  # [min(num_days, NumRows()) x num_series] returns of the last num_days days, oldest first
+  def Recent(self, num_days):
+    num_days = min(num_days, self.NumRows())
+    return self.rows[(self.count - num_days + numpy.arange(num_days)) % self.window]
+
+  """
+  :param series: indices of the series wanted
+  :return: ([num_rows x len(series)] centered returns over sqrt(num_rows - 1), sample variances)
+  """
+  def Factors(self, series):
+    series = numpy.asarray(series, dtype=int)
+    num_rows = self.NumRows()
+    # in place, fresh arrays this size cost more in page faults than the arithmetic
+    if len(self.factors) < num_rows * len(series):
+      self.factors = numpy.empty(self.rows.size)
+    factors = self.factors[:num_rows * len(series)].reshape(num_rows, len(series))
+
+    # every series in order, as recalibrations mostly ask for, centers straight off the rows
+    if len(series) == self.NumSeries() and (series == numpy.arange(len(series))).all():
+      rows = self.rows[:num_rows]
+    else:
+      rows = numpy.take(self.rows[:num_rows], series, axis=1, out=factors)
+    numpy.subtract(rows, rows.mean(axis=0), out=factors)
+    factors *= 1 / numpy.sqrt(max(num_rows - 1, 1))
+    return factors, numpy.einsum('ij,ij->j', factors, factors)
+
+# an array of shape out of workspace, the same one as last time if it fits, a fresh one without a workspace
+def Buffer(workspace, name, shape):
+  if workspace is None:
+    return numpy.empty(shape)
+  if name not in workspace or workspace[name].shape != shape:
+    workspace[name] = numpy.empty(shape)
+  return workspace[name]
+
+# 1 / volatility, series which never moved get 0
+def InverseVolatilityWeights(variances):
+  return numpy.divide(1, numpy.sqrt(variances), out=numpy.zeros_like(variances), where=variances > 0)
+
+"""
+Weights w with every series contributing the same w_i (Σw)_i to the variance of the weighted sum,
+Σ = (1 - shrinkage) FᵀF + shrinkage diag(variances). Newton's method on the convex
+  min ½ yᵀΣy - Σ log y
+whose minimum has y_i (Σy)_i = 1 for every i, i.e. equal risk contributions [Spinu 2013], with a
+backtracking line search keeping y positive. Steps are exact, through a [num_rows x num_rows] system
+(Woodbury) when there are more series than days, so a step costs O(n min(n, num_rows)²) & a warm start
+off the last solution after a day's worth of new returns takes 3 or 4 of them.
+Traders size entries in whole contracts, so allocations a tolerance apart can trade differently from
+then on: a tolerance of 0 converges as far as floating point goes, for runs which have to agree with a
+replay that got its returns rounded differently, e.g. policy_backtest's.
+Series which never moved get 0.
+
+  weights = EqualRiskContributionWeights(*returns.Factors(series), start=last_weights, workspace=buffers)
+
+:param factors: RollingCovariance.Factors
+:param start: weights to start from, e.g. the last solution, any scale, entries <= 0 or nan start off inverse volatility
+:param workspace: dict the Newton steps keep their buffers in from one call to the next, see Buffer
+:return: weights, the scale is the solver's, pass them back as start next time
+"""
+def EqualRiskContributionWeights(factors, variances, shrinkage=DEFAULT_SHRINKAGE, start=None, tolerance=DEFAULT_TOLERANCE,
+                                 workspace=None):
+  weights = numpy.zeros(len(variances))
+  moving = variances > 0
+  if not moving.any():
+    return weights
+  if not moving.all():
+    factors, variances = factors[:, moving], variances[moving]
+  num_rows, n = factors.shape
+  scale, diagonal = 1 - shrinkage, shrinkage * variances
+
+  # small enough to keep the covariance itself around
+  gram = factors.T @ factors if n <= num_rows else None
+  if gram is not None:
+    Product = lambda y: scale * (gram @ y) + diagonal * y
+  else:
+    Product = lambda y: scale * (factors.T @ (factors @ y)) + diagonal * y
+
+  y = 1 / numpy.sqrt(variances)
+  if start is not None:
+    start = numpy.asarray(start, dtype=float)[moving]
+    known = start > 0 # nan compares False
+    y[known] = start[known]
+  # rescaled so risk contributions average 1, where the solution has every one of them
+  product = Product(y)
+  scaling = 1 / numpy.sqrt((y * product).mean())
+  y, product = y * scaling, product * scaling
+  objective = 0.5 * (y @ product) - numpy.log(y).sum()
+
+  if gram is None:
+    scaled, inner = Buffer(workspace, 'scaled', factors.shape), Buffer(workspace, 'inner', (num_rows, num_rows))
+  else:
+    hessian = Buffer(workspace, 'hessian', gram.shape)
+  error, quadratic = numpy.inf, False
+  for step in range(MAX_NEWTON_STEPS):
+    contributions = y * product
+    last_error, error = error, numpy.abs(contributions / contributions.mean() - 1).max()
+    # once Newton converges quadratically the error only stops falling in rounding noise
+    if error < tolerance or (quadratic and error >= last_error):
+      break
+
+    # Hessian is Σ + diag(1 / y²), the diagonal part of it is what's left of Σ after scale FᵀF
+    gradient = product - 1 / y
+    rest = diagonal + 1 / (y * y)
+    if gram is not None:
+      numpy.multiply(gram, scale, out=hessian)
+      hessian.flat[::n + 1] += rest
+      direction = numpy.linalg.solve(hessian, gradient)
+    else:
+      numpy.divide(factors, numpy.sqrt(rest), out=scaled)
+      numpy.dot(scaled, scaled.T, out=inner) # BLAS does X Xᵀ in half the time of a general product
+      inner.flat[::num_rows + 1] += 1 / scale
+      direction = gradient / rest - (factors.T @ numpy.linalg.solve(inner, factors @ (gradient / rest))) / rest
+
+    # squared Newton decrement, the objective is self-concordant so under 1/16 full steps stay
+    # positive & converge quadratically, no line search needed where its gains are rounding noise
+    size, decrease = 1.0, gradient @ direction
+    quadratic = decrease < 1 / 16
+    while True:
+      candidate = y - size * direction
+      if quadratic or (candidate > 0).all():
+        candidate_product = Product(candidate)
+        candidate_objective = 0.5 * (candidate @ candidate_product) - numpy.log(candidate).sum()
+        if quadratic or candidate_objective <= objective - 1e-4 * size * decrease:
+          break
+      size *= 0.5
+    y, product, objective = candidate, candidate_product, candidate_objective
+
+  weights[moving] = y
+  return weights
+
+"""
+Allocations in proportion to weights as far as low & high let them, adding up to total:
+clip(c * weights, low, high) with c found exactly, in O(n log n), off the sum at every c where
+some allocation hits low or high, it's piecewise linear in between. Weights of 0 get low.
+If even everyone at low is too much, or everyone at high too little, that's what they get.
+"""
+def CappedAllocations(weights, total, low, high):
+  weights = numpy.asarray(weights, dtype=float)
+  positive = numpy.sort(weights[weights > 0])
+  num_zero, num_positive = len(weights) - len(positive), len(positive)
+  if len(weights) * low >= total or not num_positive:
+    return numpy.full(len(weights), float(low))
+  if num_zero * low + num_positive * high <= total:
+    return numpy.where(weights > 0, float(high), float(low))
+
+  # every c an allocation hits low or high, two runs already in order off the sorted weights, merged.
+  # How many of each run come up to c counts those off low & those at high, the sum is continuous
+  # in c so allocations hitting a bound right at c count the same either side of it
+  breaks = numpy.concatenate([low / positive[::-1], high / positive[::-1]])
+  merged = numpy.argsort(breaks, kind='stable')
+  factors = breaks[merged]
+  at_high = numpy.cumsum(merged >= num_positive)
+  at_low = num_positive - (numpy.arange(1, 2 * num_positive + 1) - at_high)
+  prefix = numpy.concatenate([[0.0], numpy.cumsum(positive)])
+  sums = low * (num_zero + at_low) + high * at_high + factors * (prefix[num_positive - at_high] - prefix[at_low])
+
+  factor = numpy.interp(total, sums, factors)
+  return numpy.where(weights > 0, numpy.clip(factor * weights, low, high), float(low))
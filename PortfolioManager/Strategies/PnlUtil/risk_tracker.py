@@ -0,0 +1,156 @@
+import math
+
+DEFAULT_RELATIVE_ACCURACY = 0.01 # quantiles come back within 1% of a value actually seen
+DEFAULT_MAX_BINS = 1024 # per sign, past it the bins closest to 0 get folded together
+DEFAULT_VAR_LEVEL = 0.95
+
+"""
+Streaming quantiles of daily pnl in bounded memory, no history kept: values go into
+logarithmically spaced bins, one set for gains & one for losses, so any quantile is known
+to within relative_accuracy of its value. Sketches with the same accuracy merge exactly by
+adding up bin counts, e.g. sketches of several runs, shards or traders.
+When a sign runs out of bins the ones closest to 0 get folded together, the tails where
+VaR & CVaR live keep their accuracy.
+
+  sketch = QuantileSketch()
+  for pnl in daily_pnl:
+    sketch.Add(pnl)
+  five_percent = sketch.Quantile(0.05)
+  mean_of_worst = sketch.TailMean(0.05)
+"""
+class QuantileSketch:
+  def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY, max_bins=DEFAULT_MAX_BINS):
+    self.relative_accuracy = relative_accuracy
+    self.max_bins = max_bins
+    self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+    self.log_gamma = math.log(self.gamma)
+
+    self.gains = {} # bin to count, bin i holds (gamma^(i-1), gamma^i]
+    self.losses = {} # same for -value
+    self.zeros = 0
+    self.count = 0
+    self.min = math.inf
+    self.max = -math.inf
+
+  def Add(self, value, count=1):
+    self.count += count
+    self.min = min(self.min, value)
+    self.max = max(self.max, value)
+    if value == 0:
+      self.zeros += count
+      return
+
+    bins = self.gains if value > 0 else self.losses
+    index = math.ceil(math.log(abs(value)) / self.log_gamma)
+    bins[index] = bins.get(index, 0) + count
+    if len(bins) > self.max_bins:
+      self.Fold(bins)
+
+  # fold the bins closest to 0 into the next one up until max_bins are left
+  def Fold(self, bins):
+    indices = sorted(bins)
+    folded = sum(bins.pop(index) for index in indices[:len(indices) - self.max_bins])
+    bins[indices[len(indices) - self.max_bins]] += folded
+
+  def Merge(self, other):
+    if other.gamma != self.gamma:
+      raise ValueError('can only merge sketches of the same accuracy: ' + str(self.relative_accuracy)
+                       + ' vs ' + str(other.relative_accuracy))
+    for bins, other_bins in [(self.gains, other.gains), (self.losses, other.losses)]:
+      for index, count in other_bins.items():
+        bins[index] = bins.get(index, 0) + count
+      if len(bins) > self.max_bins:
+        self.Fold(bins)
+    self.zeros += other.zeros
+    self.count += other.count
+    self.min = min(self.min, other.min)
+    self.max = max(self.max, other.max)
+
+  # (value, count) of every bin from the lowest value up, losses first
+  def Bins(self):
+    value = lambda index: 2 * self.gamma ** index / (self.gamma + 1)
+    for index in sorted(self.losses, reverse=True):
+      yield -value(index), self.losses[index]
+    if self.zeros:
+      yield 0.0, self.zeros
+    for index in sorted(self.gains):
+      yield value(index), self.gains[index]
+
+  # value with a q fraction of everything added at or below it, nan if nothing was
+  def Quantile(self, q):
+    if not self.count:
+      return math.nan
+    rank = q * (self.count - 1)
+    seen = 0
+    for value, count in self.Bins():
+      seen += count
+      if seen > rank:
+        return min(max(value, self.min), self.max)
+    return self.max
+
+  # mean of the lowest q fraction of everything added, at least one value's worth
+  def TailMean(self, q):
+    if not self.count:
+      return math.nan
+    wanted = max(q * self.count, 1)
+    total, taken = 0.0, 0
+    for value, count in self.Bins():
+      take = min(count, wanted - taken)
+      total += take * min(max(value, self.min), self.max)
+      taken += take
+      if taken >= wanted:
+        break
+    return total / taken
+
+"""
+Running risk of a daily pnl series, every day costs O(1) & nothing of the history is kept:
+  max_drawdown:          deepest fall of pnl since inception below its high water mark, the start at 0 included
+  drawdown:              how far below the high water mark pnl is now
+  days_under_water:      days since pnl was last at its high water mark
+  max_days_under_water:  longest such stretch
+  ValueAtRisk & ConditionalValueAtRisk off a QuantileSketch of the daily pnl
+Everything in the series' units, losses as positive numbers.
+"""
+class RiskTracker:
+  def __init__(self):
+    self.num_days = 0
+    self.pnl = 0.0
+    self.high_water = 0.0
+    self.drawdown = 0.0
+    self.max_drawdown = 0.0
+    self.days_under_water = 0
+    self.max_days_under_water = 0
+    self.sketch = QuantileSketch()
+
+  def Update(self, daily_pnl):
+    self.num_days += 1
+    self.pnl += daily_pnl
+    if self.pnl >= self.high_water:
+      self.high_water = self.pnl
+      self.days_under_water = 0
+    else:
+      self.days_under_water += 1
+      self.max_days_under_water = max(self.max_days_under_water, self.days_under_water)
+    self.drawdown = self.high_water - self.pnl
+    self.max_drawdown = max(self.max_drawdown, self.drawdown)
+    self.sketch.Add(daily_pnl)
+
+  """
+  Update with whatever a growing daily pnl list got since the last time, days already in are
+  skipped so it's O(new days). A list shorter than what's in got rebuilt, start over.
+  :return: self
+  """
+  def CatchUp(self, daily_pnl):
+    if len(daily_pnl) < self.num_days:
+      self.__init__()
+    for pnl in daily_pnl[self.num_days:]:
+      self.Update(pnl)
+    return self
+
+  # daily loss which only 1 - level of days were worse than
+  def ValueAtRisk(self, level=DEFAULT_VAR_LEVEL):
+    return -self.sketch.Quantile(1 - level)
+
+  # average daily loss over the worst 1 - level of days
+  def ConditionalValueAtRisk(self, level=DEFAULT_VAR_LEVEL):
+    return -self.sketch.TailMean(1 - level)
@@ -0,0 +1,181 @@
+import sys, os, getopt, json
+import numpy
+import Strategies.ContractDef.contract_info as ci
+
+# mm-dd-yy dates only cover 1969 - 2068 without being ambiguous
+FIRST_DATE = numpy.datetime64('1969-01-02')
+LAST_DATE = numpy.datetime64('2068-12-31')
+
+NUM_INDICATORS = 45     # RegimePredictiveAllocPM looks for these many indicator sheets
+NUM_SECTORS = 6         # contracts load on one of these many common factors
+PAIR_CORRELATION = 0.9  # correlation of daily returns between the 2 legs of a pair
+TREASURY_EVERY = 5      # every these many contracts is quoted in 32nds like ZN/ZB
+
+"""
+Write synthetic market data in the same layout as the repo, so pointing the
+working directory at output_dir runs everything on it:
+  output_dir/MarketData/csvs/market_data_<shc>.csv      newest first, Date,Open,High,Low,Close
+  output_dir/IndicatorData/csvs/eco_indicator_sheet_<n>.csv
+  output_dir/manifest.json                              contracts & pairs, see LoadManifest
+
+Contracts 2i and 2i+1 form a correlated pair, both legs also load on the same sector factor.
+
+:param num_contracts: how many contracts to generate
+:param num_days: how many business days of data, starting 01-02-69
+:param write_csv: write the newest first csvs the loaders read
+:param num_indicators: how many economic indicator sheets to write, 0 for none
+:param seed: random seed, same seed same data
+:return: (list of shortcodes, list of [shc_1, shc_2] pairs)
+"""
+def GenerateMarketData(output_dir, num_contracts, num_days, write_csv=True, num_indicators=NUM_INDICATORS, seed=0):
+  rng = numpy.random.RandomState(seed)
+  dates = BusinessDays(num_days)
+
+  shortcodes, pairs, contracts = [], [], []
+  for index in range(0, num_contracts):
+    is_treasury = (index % TREASURY_EVERY == TREASURY_EVERY - 1)
+    shc = ('T' if is_treasury else 'S') + format(index, '04d')
+    min_price_increment = (1/32 if is_treasury else 0.01 * 10**rng.randint(0, 3))
+    tick_value = float(rng.choice([5.0, 6.25, 10.0, 12.5, 25.0, 31.25]))
+
+    shortcodes.append(shc)
+    contracts.append(ci.ContractInfo(shc, min_price_increment, tick_value))
+    if index % 2 == 1:
+      pairs.append([shortcodes[-2], shc])
+
+  if write_csv:
+    os.makedirs(os.path.join(output_dir, 'MarketData', 'csvs'), exist_ok=True)
+
+  # generate a pair at a time so memory doesn't grow with the number of contracts
+  sector_moves = rng.standard_normal((NUM_SECTORS, len(dates)))
+  for first in range(0, num_contracts, 2):
+    legs = contracts[first:first + 2]
+    prices = CorrelatedPrices(rng, legs, sector_moves)
+
+    for index, contract in enumerate(legs):
+      if write_csv:
+        WriteMarketDataCsv(os.path.join(output_dir, 'MarketData', 'csvs', 'market_data_' + contract.Name + '.csv'),
+                           dates, prices[index], contract.MinPriceIncrement == 1/32)
+
+  if num_indicators > 0:
+    os.makedirs(os.path.join(output_dir, 'IndicatorData', 'csvs'), exist_ok=True)
+    WriteIndicatorSheets(os.path.join(output_dir, 'IndicatorData', 'csvs'), rng, dates, num_indicators)
+
+  with open(os.path.join(output_dir, 'manifest.json'), 'w') as manifest:
+    json.dump({'shortcodes': shortcodes, 'pairs': pairs,
+               'contracts': {c.Name: [c.MinPriceIncrement, c.TickValue] for c in contracts}},
+              manifest, indent=1)
+
+  RegisterContracts(contracts)
+  return shortcodes, pairs
+
+def BusinessDays(num_days):
+  # 5 business days every 7 calendar days, with a little slack
+  candidates = numpy.arange(FIRST_DATE, FIRST_DATE + int(num_days * 7 / 5) + 7, dtype='datetime64[D]')
+  dates = candidates[numpy.is_busday(candidates)][:num_days]
+  if len(dates) < num_days or dates[-1] > LAST_DATE:
+    raise ValueError(str(num_days) + ' business days do not fit between ' + str(FIRST_DATE) + ' and ' + str(LAST_DATE))
+  return dates
+
+"""
+Daily returns of the legs of a pair are a mix of the pair's sector factor, a
+factor shared by both legs and noise, prices are rounded to each contract's min price increment.
+
+:param legs: 1 or 2 contracts forming a pair
+:param sector_moves: [num_sectors x num_days] common factor moves
+:return: [num_legs x num_days x 4] open, high, low, close
+"""
+def CorrelatedPrices(rng, legs, sector_moves):
+  num_legs, num_days = len(legs), sector_moves.shape[1]
+  daily_vol = rng.uniform(0.005, 0.02, num_legs).reshape(-1, 1)
+  sector = numpy.repeat(rng.randint(0, NUM_SECTORS), num_legs) # both legs on the same one, or they'd only be 0.81 correlated
+
+  # variances add up to 1: 0.09 sector, PAIR_CORRELATION - 0.09 shared by the pair, rest own noise
+  shocks = (0.3 * sector_moves[sector]
+            + numpy.sqrt(PAIR_CORRELATION - 0.09) * rng.standard_normal(num_days)
+            + numpy.sqrt(1 - PAIR_CORRELATION) * rng.standard_normal((num_legs, num_days)))
+
+  start_price = rng.uniform(50, 2000, num_legs).reshape(-1, 1)
+  close = start_price * numpy.exp(numpy.cumsum(shocks * daily_vol, axis=1))
+  open_price = numpy.concatenate([start_price, close[:, :-1]], axis=1) *\
+               numpy.exp(0.25 * daily_vol * rng.standard_normal((num_legs, num_days)))
+  high = numpy.maximum(open_price, close) * numpy.exp(daily_vol * numpy.abs(rng.standard_normal((num_legs, num_days))))
+  low = numpy.minimum(open_price, close) * numpy.exp(-daily_vol * numpy.abs(rng.standard_normal((num_legs, num_days))))
+
+  prices = numpy.stack([open_price, high, low, close], axis=2)
+  increments = numpy.array([leg.MinPriceIncrement for leg in legs]).reshape(-1, 1, 1)
+  prices = numpy.maximum(numpy.round(prices / increments), 1) * increments
+
+  # rounding can't be allowed to push open/close outside of high/low
+  prices[:, :, 1] = prices.max(axis=2)
+  prices[:, :, 2] = prices.min(axis=2)
+  return prices
+
+def FormatDate(date):
+  return date.astype(object).strftime('%m-%d-%y')
+
+# treasuries are quoted as <handle>-<32nds>, e.g. 155-24
+def FormatPrice(price, in_32nds):
+  if not in_32nds:
+    return repr(round(float(price), 6))
+
+  handle = int(price)
+  return str(handle) + '-' + format(int(round((price - handle) * 32)), '02d')
+
+# newest first with the header on top, which is what every loader expects
+def WriteMarketDataCsv(filename, dates, prices, in_32nds):
+  with open(filename, 'w') as out:
+    out.write('Date,Open,High,Low,Close\n')
+    for index in range(len(dates) - 1, -1, -1):
+      out.write(FormatDate(dates[index]) + ',' + ','.join(FormatPrice(p, in_32nds) for p in prices[index]) + '\n')
+
+# monthly random walks, newest first like the downloaded sheets
+def WriteIndicatorSheets(directory, rng, dates, num_indicators):
+  month_ends = numpy.unique(dates.astype('datetime64[M]')) + 1
+  month_ends = month_ends.astype('datetime64[D]') - 1
+
+  for index in range(1, num_indicators + 1):
+    values = 100 + numpy.cumsum(rng.standard_normal(len(month_ends)))
+    with open(os.path.join(directory, 'eco_indicator_sheet_' + str(index) + '.csv'), 'w') as out:
+      out.write('Date,Value\n')
+      for row in range(len(month_ends) - 1, -1, -1):
+        out.write(FormatDate(month_ends[row]) + ',' + repr(round(float(values[row]), 4)) + '\n')
+
+def RegisterContracts(contracts):
+  for contract in contracts:
+    ci.ContractInfoDatabase[contract.Name] = contract
+
+"""
+Register the contracts of a previously generated data set.
+:return: (list of shortcodes, list of [shc_1, shc_2] pairs)
+"""
+def LoadManifest(output_dir):
+  with open(os.path.join(output_dir, 'manifest.json'), 'r') as manifest:
+    manifest = json.load(manifest)
+
+  RegisterContracts(ci.ContractInfo(shc, info[0], info[1]) for shc, info in manifest['contracts'].items())
+  return manifest['shortcodes'], manifest['pairs']
+
+# --output=<dir>        where to write, required
+# --contracts=<n>       number of contracts (default 12)
+# --days=<n>            number of business days (default 4620)
+# --no-csv              skip the csvs
+# --indicators=<n>      number of indicator sheets (default 45)
+# --seed=<n>            random seed (default 0)
+def main(args):
+  opts, args = getopt.getopt(args, '', ['output=', 'contracts=', 'days=', 'no-csv', 'indicators=', 'seed='])
+  opts = dict(opts)
+  if '--output' not in opts:
+    print('ERROR need --output=<dir>')
+    exit(1)
+
+  shortcodes, pairs = GenerateMarketData(opts['--output'],
+                                         int(opts.get('--contracts', 12)),
+                                         int(opts.get('--days', 4620)),
+                                         write_csv=('--no-csv' not in opts),
+                                         num_indicators=int(opts.get('--indicators', NUM_INDICATORS)),
+                                         seed=int(opts.get('--seed', 0)))
+  print('Generated ' + str(len(shortcodes)) + ' contracts, ' + str(len(pairs)) + ' pairs in ' + opts['--output'])
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
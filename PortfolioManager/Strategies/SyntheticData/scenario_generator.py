@@ -0,0 +1,133 @@
+import numpy
+import Strategies.ContractDef.contract_info as ci
+import Strategies.FileUtil.file_parser as fp
+import Strategies.FileUtil.shared_data as shd
+
+# what a scenario does to the historical path, see ScenarioGenerator
+SCENARIO_KINDS = ['history', 'bootstrap', 'vol', 'gaps']
+
+DEFAULT_SEED = 20170821
+DEFAULT_BLOCK_LENGTH = 20          # calendar days moved together by the bootstrap
+DEFAULT_VOL_RANGE = (0.5, 2.0)     # volatility scales are log uniform in here
+DEFAULT_VOL_REGIME_LENGTH = 30     # calendar days a volatility scale holds for, about as long as traders look back
+DEFAULT_GAP_PROBABILITY = 0.01     # chance of a gap on any bar
+DEFAULT_GAP_SIZE = 10.0            # gaps are this many typical daily moves, either way
+CHUNK_BARS = 256                   # bars per contract generated at a time
+
+# chrono order bars of every contract as shared_data.ParseContract has them, off MarketData/csvs
+def LoadHistory(shortcodes):
+  return {shc: shd.ParseContract(ci.ContractInfoDatabase[shc], fp.ReadLinesOldestFirst('MarketData/csvs/market_data_' + shc + '.csv'))
+          for shc in shortcodes}
+
+"""
+Perturbed OHLC paths of every contract off its historical bars, all scenarios at once.
+Scenarios keep every contract's bar dates, only prices change, so they all replay in step.
+Bars get taken apart into close to close moves & open/high/low offsets from the close, perturbed,
+and summed back up from the first close:
+  history:    the bars as they are
+  bootstrap:  moves & offsets of blocks of block_length calendar days in random order, every
+              contract takes the same days so contracts stay correlated
+  vol:        moves & offsets scaled by a factor log uniform in vol_range, a new one every
+              vol_regime_length calendar days, so traders' rolling vol estimates lag every change.
+              One factor for a whole path would change nothing, traders size & set thresholds off vol
+  gaps:       moves get a jump of gap_size typical (median) daily moves up or down on a
+              gap_probability fraction of bars, at random
+Scenario s is kinds[s % len(kinds)]. Bars come out in ticks like TokenizeToPriceInfo's, in chunks,
+so memory stays at num_scenarios x CHUNK_BARS per contract however long the history is.
+
+  generator = ScenarioGenerator(LoadHistory(['ES', 'NQ']), 1000)
+  bars = generator.Bars('ES', 0, 256) # [1000 x 256 x 4] open, high, low, close
+  bars = generator.Bars('ES', 256, 512) # has to pick up where the last call stopped
+
+:param history: map from contract to shared_data.ParseContract arrays
+"""
+class ScenarioGenerator:
+  def __init__(self, history, num_scenarios, kinds=SCENARIO_KINDS, seed=DEFAULT_SEED, block_length=DEFAULT_BLOCK_LENGTH,
+               vol_range=DEFAULT_VOL_RANGE, vol_regime_length=DEFAULT_VOL_REGIME_LENGTH,
+               gap_probability=DEFAULT_GAP_PROBABILITY, gap_size=DEFAULT_GAP_SIZE):
+    for kind in kinds:
+      if kind not in SCENARIO_KINDS:
+        raise ValueError('unknown scenario kind ' + kind + ', pick from ' + str(SCENARIO_KINDS))
+    self.history = history
+    self.num_scenarios = num_scenarios
+    self.kinds = list(kinds[scenario % len(kinds)] for scenario in range(num_scenarios))
+    self.seed = seed
+    self.gap_probability = gap_probability
+    self.gap_size = gap_size
+    rng = numpy.random.default_rng(seed)
+
+    is_kind = lambda kind: numpy.array(list(scenario_kind == kind for scenario_kind in self.kinds))
+    self.is_history = is_kind('history')
+    self.is_gaps = is_kind('gaps')
+
+    # bootstrap: the calendar day every calendar day takes its bars from, itself unless bootstrapped
+    self.calendar = numpy.unique(numpy.concatenate(list(arrays['ordinals'] for arrays in history.values())))
+    num_days, block_length = len(self.calendar), max(1, min(block_length, len(self.calendar)))
+    starts = rng.integers(0, num_days - block_length + 1, size=(num_scenarios, -(-num_days // block_length)))
+    shuffled = (starts[:, :, None] + numpy.arange(block_length)).reshape(num_scenarios, -1)[:, :num_days]
+    self.source_day = numpy.where(is_kind('bootstrap')[:, None], shuffled, numpy.arange(num_days)).astype(numpy.int32)
+
+    # vol: scale of every scenario on every calendar day
+    low, high = numpy.log(vol_range)
+    regimes = numpy.arange(num_days) // max(1, vol_regime_length)
+    levels = numpy.exp(rng.uniform(low, high, (num_scenarios, regimes[-1] + 1 if num_days else 0)))
+    self.scale = numpy.where(is_kind('vol')[:, None], levels[:, regimes], 1.0)
+
+    # per contract: calendar day of every bar, close to close moves & offsets, nan bars stay flat
+    self.contracts = {}
+    for order, (shc, arrays) in enumerate(history.items()):
+      ticks = arrays['ticks']
+      valid = ~numpy.isnan(ticks).any(axis=1)
+      closes = ticks[:, 3].copy()
+      if valid.any():
+        closes[~valid] = numpy.nan
+        last_valid = numpy.maximum.accumulate(numpy.where(valid, numpy.arange(len(closes)), 0))
+        closes = closes[last_valid]
+        closes[numpy.isnan(closes)] = closes[valid][0]
+      moves = numpy.diff(closes, prepend=closes[:1])
+      offsets = numpy.where(valid[:, None], ticks[:, :3] - ticks[:, 3:], 0.0)
+      typical_move = numpy.median(numpy.abs(moves[moves != 0])) if (moves != 0).any() else 0.0
+      self.contracts[shc] = {'order': order, 'days': numpy.searchsorted(self.calendar, arrays['ordinals']),
+                             'moves': moves, 'offsets': offsets, 'typical_move': typical_move,
+                             'first_close': (closes[0] if len(closes) else 0.0)}
+    self.next_bar = {shc: 0 for shc in history}
+    self.last_close = {shc: numpy.full(num_scenarios, contract['first_close']) for shc, contract in self.contracts.items()}
+
+  def NumBars(self, shc):
+    return len(self.contracts[shc]['moves'])
+
+  """
+  Bars [start, end) of a contract in every scenario, contracts go chunk after chunk from bar 0.
+  :return: [num_scenarios x (end - start) x 4] open, high, low, close
+  """
+  def Bars(self, shc, start, end):
+    if start != self.next_bar[shc]:
+      raise ValueError(shc + ' bars have to be asked for in order, next is ' + str(self.next_bar[shc]) + ' not ' + str(start))
+    contract = self.contracts[shc]
+
+    # source bar of every scenario's bar, the contract's last bar on or before the source day
+    days = contract['days'][start:end]
+    sources = numpy.searchsorted(contract['days'], self.source_day[:, days], side='right') - 1
+    sources = numpy.clip(sources, 0, self.NumBars(shc) - 1)
+
+    scale = self.scale[:, days]
+    moves = contract['moves'][sources] * scale
+    offsets = contract['offsets'][sources] * scale[:, :, None]
+    if start == 0 and end > 0:
+      moves[:, 0] = 0 # paths start off the first close
+
+    if self.is_gaps.any():
+      # a generator per chunk, so bars come out the same however contracts get interleaved
+      rng = numpy.random.default_rng([self.seed, contract['order'], start])
+      gaps = rng.random((self.num_scenarios, end - start)) < self.gap_probability
+      signs = numpy.where(rng.random((self.num_scenarios, end - start)) < 0.5, -1.0, 1.0)
+      moves += numpy.where(gaps & self.is_gaps[:, None], signs * self.gap_size * contract['typical_move'], 0.0)
+
+    closes = self.last_close[shc][:, None] + numpy.cumsum(moves, axis=1)
+    bars = numpy.concatenate([closes[:, :, None] + offsets, closes[:, :, None]], axis=2)
+    bars[self.is_history] = self.history[shc]['ticks'][start:end]
+
+    if end > start:
+      self.last_close[shc] = closes[:, -1]
+    self.next_bar[shc] = end
+    return bars
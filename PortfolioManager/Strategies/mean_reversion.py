@@ -4,10 +4,10 @@ import FileUtil.file_parser as fp
 import Plots.plots as plots
 import matplotlib.pyplot as plt
 
-def MeanReversionStrategy(contract, data_csv='', data_list=[], **strategy_params):
+def MeanReversionStrategy(contract, data_csv='', data_list=[], data_stream=None, **strategy_params):
   """
-  Run a mean reversion strategy on either the data_csv file
-  or the data_list list, if both are passed, I will return error.
+  Run a mean reversion strategy on either the data_csv file, the data_list
+  list or the data_stream iterable, if more than one is passed, I will return error.
 
   Trading parameters:
   net_change:         how much does today's price have to deviate from
@@ -17,24 +17,26 @@ def MeanReversionStrategy(contract, data_csv='', data_list=[], **strategy_params
 
   :param data_csv: csv filename to load data from
   :param data_list: list to load data from
+  :param data_stream: lines already in chrono order to load data from, e.g. fp.ReadLinesOldestFirst(filename)
   :param strategy_params: dictionary of trading parameters
   :return: (error/success code, list of trade information)
   """
   trades = []
   log_level = strategy_params.pop('log_level', 0)
 
-  if not data_csv and not data_list:
+  num_sources = bool(data_csv) + bool(data_list) + (data_stream is not None)
+  if num_sources == 0:
     if log_level > 0:
-      print('ERROR neither have datafile nor datalist')
+      print('ERROR neither have datafile, datalist nor datastream')
     return -1, None
 
-  if data_csv and data_list:
+  if num_sources > 1:
     if log_level > 0:
-      print('ERROR cant have both datafile and datalist')
+      print('ERROR cant have more than one of datafile, datalist and datastream')
     return -1, None
 
-  # get an iterable based on arguments passed
-  market_data = data_list or open(data_csv, 'r')
+  # get an iterable based on arguments passed, oldest line first
+  market_data = fp.LinesOldestFirst(data_csv, data_list, data_stream)
   if log_level > 0:
     print('INFO opened data file/list ', market_data)
 
@@ -52,7 +54,7 @@ def MeanReversionStrategy(contract, data_csv='', data_list=[], **strategy_params
   lookback_prices = [] # maintain, update ma
   my_position, my_vwap, my_pnl = 0, 0, 0 # position, position vwap, pnl
 
-  for line in reversed(list(market_data)): # file is backwards
+  for line in market_data:
     try:
       # unpack list
       date, open_price, high_price, low_price, close_price =\
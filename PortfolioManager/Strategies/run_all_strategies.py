@@ -1,6 +1,9 @@
 import sys, getopt, statistics
 import ContractDef.contract_info as ci
 import Plots.plots as plots
+import PerfUtil.perf_util as pf
+import PerfUtil.profiler as prof
+import CacheUtil.run_cache as rc
 import matplotlib.pyplot as plt
 
 import trend_following as tfs
@@ -56,108 +59,134 @@ shortcode_relative = [
                   ['ZC', 'ZW'], # corn using wheat
                   ['ZW', 'ZC'] # wheat using corn
                   ]
+
+# run a strategy, or with a run cache hand back what an identical earlier run returned
+def RunStrategy(run_cache, strategy, contracts, data_csv, **strategy_params):
+  run = lambda: strategy(contracts, data_csv=data_csv, data_list=[], **dict(strategy_params))
+  if not run_cache:
+    return run()
+
+  data_files = (data_csv if isinstance(data_csv, list) else [data_csv])
+  return run_cache.Call(strategy, data_files, {'contracts': contracts, 'params': strategy_params}, run)
+
 def main(args):
+  opts, args = getopt.getopt(args, '', plots.RENDER_OPTIONS + prof.PROFILE_OPTIONS + rc.CACHE_OPTIONS)
+  plots.SetRenderModeFromOptions(opts)
+  profiler = prof.StartFromOptions(opts, pf.phase_listeners)
+  run_cache = rc.CacheFromOptions(opts)
+
   print('========== CME Futures Contract descriptions ==========')
   for shc in indep_shortcode_list:
     print('\t', shc, '=>', SHORTCODE_DESCRIPTION[shc], end='')
     ci.ContractInfoDatabase[shc].ToString()
 
-  shortcode_results = {}
-  print('\nRunning TrendFollowing strategy, close plot window to proceed to next contract. Ctrl-C to quit.')
-  for shortcode in indep_shortcode_list:
-    print('\tRunning TrendFollowing on', shortcode, SHORTCODE_DESCRIPTION[shortcode])
-
-    filename = 'MarketData/csvs/market_data_' + shortcode + '.csv'
-    ret_code, trades = tfs.TrendFollowStrategy(
-      ci.ContractInfoDatabase[shortcode],
-      data_csv=filename,
-      data_list=[],
-      net_change=0.25, # trend starting, so need to get in early
-      ma_lookback_days=40,
-      loss_ticks=0.1, # losses will be smaller but frequent
-      risk_dollars=1000,
-      log_level=0)
-
-    if ret_code == 0:
-      shortcode_results[shortcode] = list(trades)
-      plots.PlotTrades('TrendFollowing', trades, ci.ContractInfoDatabase[shortcode], 0, len(trades))
-
-  plots.MergeAndPlotTrades('TrendFollowing', shortcode_results, ci.ContractInfoDatabase)
-
-  shortcode_results = {}
-  print('\nRunning MeanReversion strategy, close plot window to proceed to next contract. Ctrl-C to quit.')
-  for shortcode in indep_shortcode_list:
-    print('\tRunning MeanReversion on', shortcode, SHORTCODE_DESCRIPTION[shortcode])
-
-    filename = 'MarketData/csvs/market_data_' + shortcode + '.csv'
-    ret_code, trades = mrs.MeanReversionStrategy(
-      ci.ContractInfoDatabase[shortcode],
-      data_csv=filename,
-      data_list=[],
-      net_change=0.75, # mean reversion, so bet till blown out significantly
-      ma_lookback_days=40,
-      loss_ticks=0.2, # losses will be bigger but infrequent
-      risk_dollars=1000,
-      log_level=0)
-
-    if ret_code == 0:
-      shortcode_results[shortcode] = list(trades)
-      plots.PlotTrades('MeanReversion', trades, ci.ContractInfoDatabase[shortcode], 0, len(trades))
-
-  plots.MergeAndPlotTrades('MeanReversion', shortcode_results, ci.ContractInfoDatabase)
-
-  shortcode_results = {}
-  print('\nRunning PairsTrading strategy, close plot window to proceed to next contract. Ctrl-C to quit.')
-  for shortcode_1, shortcode_2 in shortcode_pairs:
-    print('\tRunning PairsTrading on', shortcode_1, SHORTCODE_DESCRIPTION[shortcode_1], 'VS.', shortcode_2, SHORTCODE_DESCRIPTION[shortcode_2])
-
-    filename_1 = 'MarketData/csvs/market_data_' + shortcode_1 + '.csv'
-    filename_2 = 'MarketData/csvs/market_data_' + shortcode_2 + '.csv'
-    ret_code, synthetic_contract, trades = prs.PairsReversionStrategy (
-      [ci.ContractInfoDatabase [shortcode_1],
-       ci.ContractInfoDatabase [shortcode_2]],
-      data_csv=[filename_1, filename_2],
-      data_list=[],
-      net_change=0.75,  # mean reversion, so bet till blown out significantly
-      ma_lookback_days=40,
-      loss_ticks=0.2,  # losses will be bigger but infrequent
-      risk_dollars=1000,
-      log_level=0)
-
-    if ret_code == 0:
-      shortcode_results [synthetic_contract.Name] = list (trades)
-      plots.PlotTrades ('PairsTrading', trades, synthetic_contract, 0, len (trades))
-
-  plots.MergeAndPlotTrades ('PairsTrading', shortcode_results, ci.ContractInfoDatabase)
-
-  shortcode_results = {}
-  print('\nRunning StatArb strategy, close plot window to proceed to next contract. Ctrl-C to quit.')
-  for shortcode_1, shortcode_2 in shortcode_relative:
-    print('\tRunning StatArb on', shortcode_1, SHORTCODE_DESCRIPTION[shortcode_1], 'using', shortcode_2, SHORTCODE_DESCRIPTION[shortcode_2])
-
-    filename_1 = 'MarketData/csvs/market_data_' + shortcode_1 + '.csv'
-    filename_2 = 'MarketData/csvs/market_data_' + shortcode_2 + '.csv'
-    ret_code, trades = sas.StatArbStrategy (
-      [ci.ContractInfoDatabase [shortcode_1],
-       ci.ContractInfoDatabase [shortcode_2]],
-      data_csv=[filename_1, filename_2],
-      data_list=[],
-      net_change=0.75,  # mean reversion, so bet till blown out significantly
-      ma_lookback_days=40,
-      loss_ticks=0.2,  # losses will be bigger but infrequent
-      risk_dollars=1000,
-      min_correlation=0.65,
-      log_level=0)
-
-    if ret_code == 0:
-      shortcode_results [shortcode_1] = list (trades)
-
-      # I would like to see additional columns for this strategy
-      contract = ci.ContractInfoDatabase [shortcode_1]
-      contract.Name = shortcode_1 + ' using ' + shortcode_2
-      plots.PlotStatArbTrades ('StatArb', trades, contract, 0, len (trades))
-
-  plots.MergeAndPlotTrades ('StatArb', shortcode_results, ci.ContractInfoDatabase)
+  with pf.Phase('trend-following'):
+    shortcode_results = {}
+    print('\nRunning TrendFollowing strategy, close plot window to proceed to next contract. Ctrl-C to quit.')
+    for shortcode in indep_shortcode_list:
+      print('\tRunning TrendFollowing on', shortcode, SHORTCODE_DESCRIPTION[shortcode])
+
+      filename = 'MarketData/csvs/market_data_' + shortcode + '.csv'
+      ret_code, trades = RunStrategy(
+        run_cache, tfs.TrendFollowStrategy,
+        ci.ContractInfoDatabase[shortcode],
+        data_csv=filename,
+        net_change=0.25, # trend starting, so need to get in early
+        ma_lookback_days=40,
+        loss_ticks=0.1, # losses will be smaller but frequent
+        risk_dollars=1000,
+        log_level=0)
+
+      if ret_code == 0:
+        shortcode_results[shortcode] = list(trades)
+        plots.PlotTrades('TrendFollowing', trades, ci.ContractInfoDatabase[shortcode], 0, len(trades))
+
+    plots.MergeAndPlotTrades('TrendFollowing', shortcode_results, ci.ContractInfoDatabase)
+
+  with pf.Phase('mean-reversion'):
+    shortcode_results = {}
+    print('\nRunning MeanReversion strategy, close plot window to proceed to next contract. Ctrl-C to quit.')
+    for shortcode in indep_shortcode_list:
+      print('\tRunning MeanReversion on', shortcode, SHORTCODE_DESCRIPTION[shortcode])
+
+      filename = 'MarketData/csvs/market_data_' + shortcode + '.csv'
+      ret_code, trades = RunStrategy(
+        run_cache, mrs.MeanReversionStrategy,
+        ci.ContractInfoDatabase[shortcode],
+        data_csv=filename,
+        net_change=0.75, # mean reversion, so bet till blown out significantly
+        ma_lookback_days=40,
+        loss_ticks=0.2, # losses will be bigger but infrequent
+        risk_dollars=1000,
+        log_level=0)
+
+      if ret_code == 0:
+        shortcode_results[shortcode] = list(trades)
+        plots.PlotTrades('MeanReversion', trades, ci.ContractInfoDatabase[shortcode], 0, len(trades))
+
+    plots.MergeAndPlotTrades('MeanReversion', shortcode_results, ci.ContractInfoDatabase)
+
+  with pf.Phase('pairs-trading'):
+    shortcode_results = {}
+    print('\nRunning PairsTrading strategy, close plot window to proceed to next contract. Ctrl-C to quit.')
+    for shortcode_1, shortcode_2 in shortcode_pairs:
+      print('\tRunning PairsTrading on', shortcode_1, SHORTCODE_DESCRIPTION[shortcode_1], 'VS.', shortcode_2, SHORTCODE_DESCRIPTION[shortcode_2])
+
+      filename_1 = 'MarketData/csvs/market_data_' + shortcode_1 + '.csv'
+      filename_2 = 'MarketData/csvs/market_data_' + shortcode_2 + '.csv'
+      ret_code, synthetic_contract, trades = RunStrategy (
+        run_cache, prs.PairsReversionStrategy,
+        [ci.ContractInfoDatabase [shortcode_1],
+         ci.ContractInfoDatabase [shortcode_2]],
+        data_csv=[filename_1, filename_2],
+        net_change=0.75,  # mean reversion, so bet till blown out significantly
+        ma_lookback_days=40,
+        loss_ticks=0.2,  # losses will be bigger but infrequent
+        risk_dollars=1000,
+        log_level=0)
+
+      if ret_code == 0:
+        shortcode_results [synthetic_contract.Name] = list (trades)
+        plots.PlotTrades ('PairsTrading', trades, synthetic_contract, 0, len (trades))
+
+    plots.MergeAndPlotTrades ('PairsTrading', shortcode_results, ci.ContractInfoDatabase)
+
+  with pf.Phase('stat-arb'):
+    shortcode_results = {}
+    print('\nRunning StatArb strategy, close plot window to proceed to next contract. Ctrl-C to quit.')
+    for shortcode_1, shortcode_2 in shortcode_relative:
+      print('\tRunning StatArb on', shortcode_1, SHORTCODE_DESCRIPTION[shortcode_1], 'using', shortcode_2, SHORTCODE_DESCRIPTION[shortcode_2])
+
+      filename_1 = 'MarketData/csvs/market_data_' + shortcode_1 + '.csv'
+      filename_2 = 'MarketData/csvs/market_data_' + shortcode_2 + '.csv'
+      ret_code, trades = RunStrategy (
+        run_cache, sas.StatArbStrategy,
+        [ci.ContractInfoDatabase [shortcode_1],
+         ci.ContractInfoDatabase [shortcode_2]],
+        data_csv=[filename_1, filename_2],
+        net_change=0.75,  # mean reversion, so bet till blown out significantly
+        ma_lookback_days=40,
+        loss_ticks=0.2,  # losses will be bigger but infrequent
+        risk_dollars=1000,
+        min_correlation=0.65,
+        log_level=0)
+
+      if ret_code == 0:
+        shortcode_results [shortcode_1] = list (trades)
+
+        # I would like to see additional columns for this strategy
+        contract = ci.ContractInfoDatabase [shortcode_1]
+        contract.Name = shortcode_1 + ' using ' + shortcode_2
+        plots.PlotStatArbTrades ('StatArb', trades, contract, 0, len (trades))
+
+    plots.MergeAndPlotTrades ('StatArb', shortcode_results, ci.ContractInfoDatabase)
+  with pf.Phase('plots'):
+    plots.WaitForRenders()
+
+  if run_cache:
+    print('\nRun cache: ' + str(run_cache.hits) + ' hits, ' + str(run_cache.misses) + ' misses')
+
+  prof.FinishFromOptions(profiler)
 
 if __name__ == '__main__':
   main(sys.argv[1:])
@@ -7,7 +7,7 @@ import Plots.plots as plots
 import matplotlib.pyplot as plt
 import DateDef.date_util as du
 
-def StatArbStrategy(contracts, data_csv=[], data_list=[], **strategy_params):
+def StatArbStrategy(contracts, data_csv=[], data_list=[], data_stream=None, **strategy_params):
   """
   Trade contract[0] using contract[1] as leading indicator
 
@@ -19,27 +19,30 @@ def StatArbStrategy(contracts, data_csv=[], data_list=[], **strategy_params):
 
   :param data_csv: csv filename to load data from
   :param data_list: list to load data from
+  :param data_stream: one iterable per contract over lines already in chrono order, e.g. fp.ReadLinesOldestFirst(filename)
   :param strategy_params: dictionary of trading parameters
   :return: (error/success code, list of trade information)
   """
   trades = []
   log_level = strategy_params.pop('log_level', 0)
 
-  if not data_csv and not data_list:
+  num_sources = bool(data_csv) + bool(data_list) + (data_stream is not None)
+  if num_sources == 0:
     if log_level > 0:
-      print('ERROR neither have datafile nor datalist')
+      print('ERROR neither have datafile, datalist nor datastream')
     return -1, None, None
 
-  if data_csv and data_list:
+  if num_sources > 1:
     if log_level > 0:
-      print('ERROR cant have both datafile and datalist')
+      print('ERROR cant have more than one of datafile, datalist and datastream')
     return -1, None, None
 
-  # get an iterable based on arguments passed
-  market_data_1 = data_list or open(data_csv[0], 'r')
-  market_data_2 = data_list or open (data_csv[1], 'r')
+  # get an iterable per contract based on arguments passed, oldest line first
+  market_data = [fp.LinesOldestFirst((data_csv[index] if data_csv else ''), data_list,
+                                     (data_stream[index] if data_stream is not None else None))
+                 for index in [0, 1]]
   if log_level > 0:
-    print('INFO opened data file/list ', market_data_1, ' and ', market_data_2)
+    print('INFO opened data file/list ', market_data[0], ' and ', market_data[1])
 
   # dump out trading parameters
   if log_level > 0:
@@ -58,37 +61,36 @@ def StatArbStrategy(contracts, data_csv=[], data_list=[], **strategy_params):
   lookback_dev_from_projection = []
   my_position, my_vwap, my_pnl = 0, 0, 0 # position, position vwap, pnl
 
-  market_data = [list(reversed(list(market_data_1))), list(reversed(list(market_data_2)))]
-  market_data_index = [0, 0]
+  # current line of each contract, we only ever look one line ahead
+  lines = [next(market_data[0], None), next(market_data[1], None)]
 
-  while market_data_index[0] < len(market_data[0]) and market_data_index[1] < len(market_data[1]):
+  while lines[0] is not None and lines[1] is not None:
     date, open_price, high_price, low_price, close_price = [0, 0], [0, 0], [0, 0], [0, 0], [0, 0]
     try:
       if log_level > 0:
-        print('INFO looking at index: ', market_data_index[0], '/', len(market_data[0]),
-              ' ', market_data_index[1], '/', len(market_data[1]))
+        print('INFO looking at lines: ', lines[0].strip(), ' ', lines[1].strip())
 
       # unpack list
       for index in [0, 1]:
         date[index], open_price[index], high_price[index], low_price[index], close_price[index] =\
-          fp.TokenizeToPriceInfo(contracts[index], market_data[index][market_data_index[index]])
+          fp.TokenizeToPriceInfo(contracts[index], lines[index])
     except ValueError or TypeError:
-      # need to update indices or you'll get stuck in an infinite loop
+      # need to move on or you'll get stuck in an infinite loop
       for index in [0, 1]:
-        market_data_index[index] += 1
+        lines[index] = next(market_data[index], None)
       continue
 
     # sanity check to make sure we are looking at same day on both contracts
     if date[0] != date[1]:
       # need to figure out which contract is lagging and bring that upto speed
       if du.CompareDates(date[0], date[1]) < 0:
-        market_data_index[0] += 1
+        lines[0] = next(market_data[0], None)
       else:
-        market_data_index[1] += 1
+        lines[1] = next(market_data[1], None)
       continue
 
     for index in [0, 1]:
-      market_data_index[index] += 1
+      lines[index] = next(market_data[index], None)
       lookback_prices[index].append([high_price[index], low_price[index], close_price[index]])
 
     if len(lookback_prices[0]) < ma_lookback_days + 1:
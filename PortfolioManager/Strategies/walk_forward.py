@@ -0,0 +1,252 @@
+import sys, getopt, itertools, concurrent.futures
+from datetime import datetime
+import numpy
+import ContractDef.contract_info as ci
+import DateDef.date_util as du
+import FileUtil.file_parser as fp
+import Plots.plots as plots
+import PerfUtil.perf_util as pf
+import PerfUtil.profiler as prof
+import CacheUtil.run_cache as rc
+
+import run_all_strategies as ras
+import trend_following as tfs
+import mean_reversion as mrs
+import pairs_reversion as prs
+import stat_arb as sas
+
+# column of the pnl since inception in every trades row
+TRADE_PNL_COLUMN = 5
+
+DEFAULT_TRAIN_BARS = 500
+DEFAULT_TEST_BARS = 125
+
+# every strategy walked forward: what it runs on, parameters it always gets & the grid searched on top
+WALK_FORWARD_STRATEGIES = {
+  'TrendFollowing': (tfs.TrendFollowStrategy, ras.indep_shortcode_list, {'risk_dollars': 1000},
+                     {'net_change': [0.25, 0.5, 1.0], 'ma_lookback_days': [20, 40, 80], 'loss_ticks': [0.1, 0.2]}),
+  'MeanReversion': (mrs.MeanReversionStrategy, ras.indep_shortcode_list, {'risk_dollars': 1000},
+                    {'net_change': [0.5, 0.75, 1.0], 'ma_lookback_days': [20, 40, 80], 'loss_ticks': [0.2, 0.4]}),
+  'PairsTrading': (prs.PairsReversionStrategy, ras.shortcode_pairs, {'risk_dollars': 1000},
+                   {'net_change': [0.5, 0.75, 1.0], 'ma_lookback_days': [20, 40, 80], 'loss_ticks': [0.2, 0.4]}),
+  'StatArb': (sas.StatArbStrategy, ras.shortcode_relative, {'risk_dollars': 1000},
+              {'net_change': [0.5, 0.75, 1.0], 'ma_lookback_days': [20, 40, 80], 'min_correlation': [0.5, 0.65, 0.8]})
+}
+
+# command line flags:
+# --strategies=<a,b>         only walk these forward, e.g. TrendFollowing,StatArb (default all)
+# --train-bars=<n>           bars every in sample window spans (default 500)
+# --test-bars=<n>            bars every out of sample window spans, windows step forward by as much (default 125)
+# --objective=<name>         what picks the winning parameters in sample, pnl or sharpe (default sharpe)
+# --workers=<n>              processes running grid points (default one per cpu)
+WALK_FORWARD_OPTIONS = ['strategies=', 'train-bars=', 'test-bars=', 'objective=', 'workers=']
+
+# every combination of a grid, in grid order
+def GridPoints(grid):
+  keys = list(grid.keys())
+  return list(dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys)))
+
+def DataFiles(shortcodes):
+  if isinstance(shortcodes, str):
+    return 'MarketData/csvs/market_data_' + shortcodes + '.csv'
+  return list(DataFiles(shc) for shc in shortcodes)
+
+def Contracts(shortcodes):
+  if isinstance(shortcodes, str):
+    return ci.ContractInfoDatabase[shortcodes]
+  return list(ci.ContractInfoDatabase[shc] for shc in shortcodes)
+
+"""
+Train & test windows over the bars of the contract traded, each test window
+starts right where its train window ends & the next train window starts test_bars later.
+:return: list of (train start, test start, test end) date ordinals, ends exclusive,
+         the last test window ends past the last bar
+"""
+def Windows(shc, train_bars, test_bars):
+  contract = ci.ContractInfoDatabase[shc]
+  dates = list(date for date in (fp.TokenizeToDate(contract, line) for line in fp.ReadLinesOldestFirst(DataFiles(shc)))
+               if date)
+  ordinals = list(du.DateOrdinal(date) for date in dates) + [du.DateOrdinal(dates[-1]) + 1]
+
+  windows = []
+  for start in range(0, len(dates) - train_bars, test_bars):
+    windows.append((ordinals[start], ordinals[start + train_bars],
+                    ordinals[min(start + train_bars + test_bars, len(dates))]))
+  return windows
+
+"""
+One full history run, in whatever form window statistics come off cheapest: every window
+of every walk is a slice of it, so rolling state (moving averages, positions) gets built
+once per grid point instead of once per window.
+"""
+class GridRun:
+  def __init__(self, trades):
+    self.trades = trades
+    self.ordinals = numpy.array(list(du.DateOrdinal(row[0]) for row in trades), dtype=numpy.int64)
+    self.pnl = numpy.array(list(row[TRADE_PNL_COLUMN] for row in trades), dtype=float)
+    daily_pnl = numpy.diff(self.pnl, prepend=0)
+    # prefix sums, any window's mean & variance of daily pnl in O(1)
+    self.sums = numpy.concatenate([[0], numpy.cumsum(daily_pnl)])
+    self.squares = numpy.concatenate([[0], numpy.cumsum(daily_pnl * daily_pnl)])
+
+  # rows dated within [start, end) for arrays of starts & ends
+  def Rows(self, starts, ends):
+    return numpy.searchsorted(self.ordinals, starts), numpy.searchsorted(self.ordinals, ends)
+
+  # pnl made within [start, end), positions carried in count from where they were marked
+  def WindowPnl(self, starts, ends):
+    first, last = self.Rows(starts, ends)
+    return self.sums[last] - self.sums[first]
+
+  def WindowSharpe(self, starts, ends):
+    first, last = self.Rows(starts, ends)
+    count = numpy.maximum(last - first, 1)
+    mean = (self.sums[last] - self.sums[first]) / count
+    variance = (self.squares[last] - self.squares[first]) / count - mean * mean
+    stdev = numpy.sqrt(numpy.maximum(variance, 0))
+    return numpy.divide(mean, stdev, out=numpy.zeros(len(first)), where=(stdev > 0) & (last - first > 1))
+
+OBJECTIVES = {'pnl': GridRun.WindowPnl, 'sharpe': GridRun.WindowSharpe}
+
+# run cache kind of a grid point's run, its own so entries never get mixed up with run_all_strategies'
+# even though the call is the same, they're keyed on different params. --kind=<strategy> still finds them
+def CacheKind(strategy):
+  return 'walk_forward.' + strategy.__name__
+
+# worker side, the strategy run as RunStrategy would run it
+def RunGridPoint(strategy, shortcodes, params):
+  return strategy(Contracts(shortcodes), data_csv=DataFiles(shortcodes), data_list=[], **dict(params))
+
+"""
+Every grid point of a strategy on every contract (or pair) it trades, fanned out across processes,
+whatever an identical earlier run left in the run cache doesn't get run again.
+:return: map from (shortcodes, grid point index) to GridRun, failed runs left out
+"""
+def RunGrid(executor, run_cache, strategy, instruments, fixed_params, points):
+  results, futures = {}, {}
+  for shortcodes in instruments:
+    for index, point in enumerate(points):
+      params = dict(fixed_params, **point)
+      if run_cache:
+        data_files = DataFiles(shortcodes)
+        description = run_cache.Description(CacheKind(strategy), (data_files if isinstance(data_files, list) else [data_files]),
+                                             {'contracts': Contracts(shortcodes), 'params': params})
+        hit, result = run_cache.Get(rc.DescriptionKey(description))
+        if hit:
+          results[(str(shortcodes), index)] = result
+          continue
+      else:
+        description = None
+      futures[executor.submit(RunGridPoint, strategy, shortcodes, params)] = (shortcodes, index, description)
+
+  for future in concurrent.futures.as_completed(futures):
+    shortcodes, index, description = futures[future]
+    results[(str(shortcodes), index)] = future.result()
+    if run_cache:
+      run_cache.Put(rc.DescriptionKey(description), results[(str(shortcodes), index)], description)
+
+  # error code first, trades last, pairs hand back their synthetic contract in between
+  return {key: GridRun(result[-1]) for key, result in results.items() if result[0] == 0 and result[-1]}
+
+"""
+Walk one contract (or pair) forward: for every window pick the grid point which did best
+in sample & take what it did out of sample. Out of sample rows get stitched together with
+pnl carried over from one window to the next, so they read like one continuous run.
+Switching parameters means taking over the book of a run which traded them all along,
+positions it carries into the window included, the same way every window's statistics
+come off one full history run per grid point.
+:return: (stitched trades rows, list of (window, winning grid point index, in sample score, out of sample pnl))
+"""
+def WalkForward(runs, num_points, windows, objective):
+  starts, test_starts, test_ends = (numpy.array(column, dtype=numpy.int64) for column in zip(*windows))
+
+  # [num_points x num_windows] in sample scores, grid points which failed never win
+  scores = numpy.full((num_points, len(windows)), -numpy.inf)
+  for index, run in runs.items():
+    scores[index] = OBJECTIVES[objective](run, starts, test_starts)
+  winners = scores.argmax(axis=0) # first grid point wins ties
+
+  stitched, report, carried_pnl = [], [], 0.0
+  for window, winner in zip(range(len(windows)), winners):
+    if winner not in runs:
+      continue
+    run = runs[winner]
+    first, last = run.Rows(test_starts[window:window + 1], test_ends[window:window + 1])
+    first, last = int(first[0]), int(last[0])
+    base_pnl = run.pnl[first - 1] if first > 0 else 0.0
+    for row in run.trades[first:last]:
+      row = list(row)
+      row[TRADE_PNL_COLUMN] = carried_pnl + row[TRADE_PNL_COLUMN] - base_pnl
+      stitched.append(row)
+    out_of_sample_pnl = (run.pnl[last - 1] - base_pnl) if last > first else 0.0
+    carried_pnl += out_of_sample_pnl
+    report.append((windows[window], int(winner), float(scores[winner, window]), float(out_of_sample_pnl)))
+
+  return stitched, report
+
+def PrintReport(name, points, report):
+  print('\t' + name)
+  for (start, test_start, test_end), winner, score, out_of_sample_pnl in report:
+    print('\t\ttrain ' + DateString(start) + ' test ' + DateString(test_start) + '..' + DateString(test_end - 1)
+          + ' in-sample ' + format(score, '12.4f') + ' out-of-sample-pnl ' + format(out_of_sample_pnl, '12.2f')
+          + ' ' + str(points[winner]))
+
+def DateString(ordinal):
+  return datetime.fromordinal(int(ordinal)).strftime('%m-%d-%y')
+
+def main(args):
+  opts, args = getopt.getopt(args, '', plots.RENDER_OPTIONS + prof.PROFILE_OPTIONS + rc.CACHE_OPTIONS
+                                       + WALK_FORWARD_OPTIONS)
+  plots.SetRenderModeFromOptions(opts)
+  profiler = prof.StartFromOptions(opts, pf.phase_listeners)
+  run_cache = rc.CacheFromOptions(opts)
+  opts = dict(opts)
+
+  names = opts['--strategies'].split(',') if '--strategies' in opts else list(WALK_FORWARD_STRATEGIES.keys())
+  train_bars = int(opts.get('--train-bars', DEFAULT_TRAIN_BARS))
+  test_bars = int(opts.get('--test-bars', DEFAULT_TEST_BARS))
+  objective = opts.get('--objective', 'sharpe')
+  if objective not in OBJECTIVES:
+    print('ERROR unknown objective ' + objective + ', pick one of ' + str(list(OBJECTIVES.keys())))
+    return
+
+  with concurrent.futures.ProcessPoolExecutor(max_workers=(int(opts['--workers']) if '--workers' in opts else None))\
+      as executor:
+    for name in names:
+      strategy, instruments, fixed_params, grid = WALK_FORWARD_STRATEGIES[name]
+      points = GridPoints(grid)
+      with pf.Phase(name + '-grid'):
+        print('\nRunning ' + str(len(points)) + ' ' + name + ' grid points on ' + str(len(instruments)) + ' contracts...')
+        runs = RunGrid(executor, run_cache, strategy, instruments, fixed_params, points)
+
+      with pf.Phase(name + '-walk-forward'):
+        print('Walking ' + name + ' forward, ' + str(train_bars) + ' bars in sample, ' + str(test_bars)
+              + ' out of sample, best ' + objective + ' wins')
+        shortcode_results = {}
+        for shortcodes in instruments:
+          key = shortcodes if isinstance(shortcodes, str) else '-'.join(shortcodes)
+          instrument_runs = {index: runs[(str(shortcodes), index)] for index in range(len(points))
+                             if (str(shortcodes), index) in runs}
+          windows = Windows(shortcodes if isinstance(shortcodes, str) else shortcodes[0], train_bars, test_bars)
+          if not instrument_runs or not windows:
+            print('\t' + key + ' not enough data to walk forward')
+            continue
+
+          stitched, report = WalkForward(instrument_runs, len(points), windows, objective)
+          PrintReport(key, points, report)
+          if stitched:
+            shortcode_results[key] = stitched
+
+        if shortcode_results:
+          plots.MergeAndPlotTrades('WalkForward-' + name, shortcode_results, ci.ContractInfoDatabase)
+
+  with pf.Phase('plots'):
+    plots.WaitForRenders()
+
+  if run_cache:
+    print('\nRun cache: ' + str(run_cache.hits) + ' hits, ' + str(run_cache.misses) + ' misses')
+
+  prof.FinishFromOptions(profiler)
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
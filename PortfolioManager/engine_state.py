@@ -0,0 +1,94 @@
+import os, pickle
+import Strategies.PerfUtil.perf_util as pf
+
+# bump whenever PM/trader attributes change in a way old state files can't be resumed from
+STATE_VERSION = 6
+
+# command line flags for run_portfolios:
+# --save-state=<file>        after replaying, save every PM, trader & the replay cursor
+# --load-state=<file>        resume from a saved state, only replay bars newer than its cursor
+# --verify-state             with --load-state, also replay everything from scratch and
+#                            check both runs ended up with the same trades & allocations
+STATE_OPTIONS = ['save-state=', 'load-state=', 'verify-state']
+
+"""
+Save everything a later run needs to carry on from where this one stopped:
+every PM with its allocations & last recalibration date, every trader's
+rolling windows, position, vwap, pnl & history (PMs recalibrate off full
+histories), the regime PM with its settings & last coefficients, and the
+replay cursor. The regime PM is kept for its settings only, resuming sets up a
+new one off the new uniform history, see run_portfolios.ReplayNewBars.
+
+:param cursor: map from contract to dt.DateOrdinal of the last bar replayed
+"""
+def SaveState(filename, pm_list, regime_pm, cursor):
+  data = DumpState(pm_list, regime_pm, cursor)
+  # write next to it and rename, so a crash never leaves half a state behind
+  with open(filename + '.tmp', 'wb') as out:
+    out.write(data)
+  os.replace(filename + '.tmp', filename)
+
+  print('Saved state to ' + filename + ' (' + format(len(data) / 1e6, '.1f') + 'MB)')
+
+# SaveState without the file, e.g. for the run cache
+def DumpState(pm_list, regime_pm, cursor):
+  # timing wrappers can't be pickled & counters belong to this run only
+  counters = []
+  for pm in pm_list + regime_pm:
+    pf.UninstrumentPM(pm)
+    counters.append(pm.perf_counters)
+    pm.perf_counters = None
+
+  state = {'version': STATE_VERSION, 'pm_list': pm_list, 'regime_pm': regime_pm, 'cursor': dict(cursor)}
+  data = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+
+  for pm, pm_counters in zip(pm_list + regime_pm, counters):
+    pm.perf_counters = pm_counters
+    pf.InstrumentPM(pm)
+
+  return data
+
+"""
+:return: (pm_list, regime_pm, cursor) like SaveState got them, None if the file can't be resumed from
+"""
+def LoadState(filename):
+  with open(filename, 'rb') as data:
+    state = RestoreState(data.read(), filename)
+
+  if state:
+    print('Loaded state from ' + filename + ' cursor: ' + str(len(state[2])) + ' contracts')
+  return state
+
+# LoadState from what DumpState returned, source only goes into error messages
+def RestoreState(data, source):
+  state = pickle.loads(data)
+  if state.get('version') != STATE_VERSION:
+    print('ERROR ' + source + ' is state version ' + str(state.get('version')) + ', expecting ' + str(STATE_VERSION))
+    return None
+
+  for pm in state['pm_list'] + state['regime_pm']:
+    pf.InstrumentPM(pm)
+
+  return state['pm_list'], state['regime_pm'], state['cursor']
+
+"""
+Check two sets of PMs, e.g. resumed vs replayed from scratch, made the same decisions.
+:return: list of 'pm|trader' which differ in trades or allocations, empty if identical
+"""
+def CompareEngines(pm_list, reference_pm_list):
+  mismatches = []
+  reference = {str(pm.style): pm for pm in reference_pm_list}
+  for pm in pm_list:
+    other = reference.get(str(pm.style))
+    if not other:
+      mismatches.append(str(pm.style) + '|missing')
+      continue
+
+    if pm.alloc != other.alloc:
+      mismatches.append(str(pm.style) + '|alloc')
+    for name, trader in pm.traders.items():
+      if name not in other.traders or trader.trades != other.traders[name].trades \
+          or trader.alloc != other.traders[name].alloc:
+        mismatches.append(str(pm.style) + '|' + trader.ShortName())
+
+  return mismatches
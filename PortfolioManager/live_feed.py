@@ -0,0 +1,358 @@
+import os, time, heapq, asyncio
+import numpy
+import Strategies.ContractDef.contract_info as ci
+import Strategies.FileUtil.file_parser as fp
+import Strategies.DateDef.date_util as dt
+
+# wire format of every feed, one bar per line:
+#   <shc>,<market data line>    e.g. ES,08-21-17,2428.75,2431.5,2415.75,2428
+#   <shc>,END                   no more bars for this contract
+#   END                         end of the whole feed
+END_OF_FEED = 'END'
+
+# bars buffered between the feed & the sequencer, and per PM between the sequencer & the PM,
+# a full queue makes its producer wait, which for sockets pushes back on the sender
+MAX_QUEUED_BARS = 4096
+
+# bars held back waiting for every contract to reach their date, past this the oldest is let go
+MAX_PENDING_BARS = 4096
+
+# seconds a bar waits for lagging contracts before it goes out anyway, None waits forever
+FLUSH_AFTER = None
+
+def FormatBar(shc, line):
+  return shc + ',' + line.rstrip('\n') + '\n'
+
+# :return: (shc, line) or (shc, None) for the end of a contract, None for the end of the feed
+def ParseBar(message):
+  message = message.strip()
+  if message == END_OF_FEED:
+    return None
+
+  shc, line = message.split(',', 1)
+  return shc, (None if line == END_OF_FEED else line + '\n')
+
+"""
+Sources are async iterators of (shc, line, received_ns), line is None once a contract
+has no more bars, they stop at the end of the feed.
+"""
+# in-process feed, for tests & the simulator: put (shc, line) tuples, (shc, None) & finally None
+async def QueueSource(bar_queue):
+  while True:
+    bar = await bar_queue.get()
+    if bar is None:
+      return
+    yield bar[0], bar[1], time.perf_counter_ns()
+
+async def StreamSource(reader):
+  while True:
+    message = await reader.readline()
+    received = time.perf_counter_ns()
+    if not message:
+      return
+    bar = ParseBar(message.decode())
+    if bar is None:
+      return
+    yield bar[0], bar[1], received
+
+# connect to a feed server, e.g. FeedSimulator.Serve
+async def TcpSource(host, port):
+  reader, writer = await asyncio.open_connection(host, port)
+  try:
+    async for bar in StreamSource(reader):
+      yield bar
+  finally:
+    writer.close()
+
+async def UnixSource(path):
+  reader, writer = await asyncio.open_unix_connection(path)
+  try:
+    async for bar in StreamSource(reader):
+      yield bar
+  finally:
+    writer.close()
+
+# follow a file something else appends bars to, like tail -f
+async def TailSource(filename, poll_interval=0.05):
+  with open(filename, 'r') as data:
+    partial = ''
+    while True:
+      message = data.readline()
+      if not message or not message.endswith('\n'):
+        partial += message
+        await asyncio.sleep(poll_interval)
+        continue
+
+      received = time.perf_counter_ns()
+      bar = ParseBar(partial + message)
+      partial = ''
+      if bar is None:
+        return
+      yield bar[0], bar[1], received
+
+"""
+Source from an address on the command line:
+  tcp:<host>:<port>, unix:<path>, tail:<file>
+"""
+def OpenSource(address):
+  kind, target = address.split(':', 1)
+  if kind == 'tcp':
+    host, port = target.rsplit(':', 1)
+    return TcpSource(host, int(port))
+  if kind == 'unix':
+    return UnixSource(target)
+  if kind == 'tail':
+    return TailSource(target)
+  raise ValueError('unknown feed address ' + address)
+
+# end to end latency of one PM, from a bar being received till the PM is done with it
+class LatencyStats:
+  def __init__(self, name):
+    self.name = name
+    self.latencies_ns = []
+
+  def Add(self, elapsed_ns):
+    self.latencies_ns.append(elapsed_ns)
+
+  def Summary(self):
+    latencies = numpy.asarray(self.latencies_ns, dtype=float)
+    if not len(latencies):
+      return {'bars': 0, 'p50_us': 0, 'p99_us': 0, 'max_us': 0}
+    return {'bars': len(latencies),
+            'p50_us': float(numpy.percentile(latencies, 50)) / 1e3,
+            'p99_us': float(numpy.percentile(latencies, 99)) / 1e3,
+            'max_us': float(latencies.max()) / 1e3}
+
+"""
+Dispatch bars from a live source to PMs as they arrive, in the same order
+ReplayMarketData would have replayed them:
+
+  - bars of a contract have to come in date order, repeats & older dates get dropped
+  - a bar is only let go once every contract still in the feed has reached its date,
+    so pairs & relative value traders see both legs of a date together, and bars of
+    the same date go out in contract order. A contract which never catches up holds
+    everything back until flush_after seconds or max_pending bars
+  - every PM runs on its own task off its own bounded queue. Recalibration runs in
+    the executor, the PM's bars queue up meanwhile while ingestion & other PMs carry on
+
+:param pm_list: PMs to drive, already set up like InitializePMs does
+:param shortcodes: every contract in the feed, in the same order as the batch replay
+:param executor: concurrent.futures executor for recalibrations, None for asyncio's default
+"""
+class LiveFeed:
+  def __init__(self, pm_list, shortcodes, executor=None, max_queued=MAX_QUEUED_BARS,
+               max_pending=MAX_PENDING_BARS, flush_after=FLUSH_AFTER):
+    self.pm_list = pm_list
+    self.order = {shc: order for order, shc in enumerate(shortcodes)}
+    self.executor = executor
+    self.max_queued = max_queued
+    self.max_pending = max_pending
+    self.flush_after = flush_after
+
+    self.active = set(shortcodes) # contracts which haven't ended yet
+    self.last_seen = {}           # contract -> date ordinal of its newest bar
+    self.released = 0             # date ordinal of the last bar handed to the PMs
+    self.pending = []             # heap of (ordinal, order, received_ns, shc, date, line)
+
+    self.latency = {str(pm): LatencyStats(str(pm)) for pm in pm_list}
+    self.dropped = {'out_of_order': 0, 'late': 0, 'unknown': 0}
+    self.forced = 0               # bars let go before every contract reached their date
+
+  async def Run(self, source):
+    incoming = asyncio.Queue(maxsize=self.max_queued)
+    pm_queues = list(asyncio.Queue(maxsize=self.max_queued) for pm in self.pm_list)
+
+    workers = list(asyncio.ensure_future(self.RunPM(pm, pm_queue)) for pm, pm_queue in zip(self.pm_list, pm_queues))
+    ingest = asyncio.ensure_future(self.Ingest(source, incoming))
+    try:
+      await self.Sequence(incoming, pm_queues)
+      await ingest
+      await asyncio.gather(*workers)
+    finally:
+      for task in workers + [ingest]:
+        task.cancel()
+
+  async def Ingest(self, source, incoming):
+    async for bar in source:
+      await incoming.put(bar)
+    await incoming.put(None)
+
+  async def Sequence(self, incoming, pm_queues):
+    while True:
+      try:
+        bar = await asyncio.wait_for(incoming.get(), self.TimeToFlush())
+      except asyncio.TimeoutError:
+        await self.Release(pm_queues, force=True)
+        continue
+
+      if bar is None:
+        break
+      self.Accept(*bar)
+      await self.Release(pm_queues)
+
+    # nothing more can come in, let everything go in order
+    self.active.clear()
+    await self.Release(pm_queues)
+    for pm_queue in pm_queues:
+      await pm_queue.put(None)
+
+  def Accept(self, shc, line, received_ns):
+    if shc not in self.order:
+      self.dropped['unknown'] += 1
+      return
+
+    if line is None:
+      self.active.discard(shc)
+      return
+
+    date = fp.TokenizeToDate(ci.ContractInfoDatabase[shc], line)
+    if not date:
+      return
+
+    ordinal = dt.DateOrdinal(date)
+    if ordinal <= self.last_seen.get(shc, 0):
+      self.dropped['out_of_order'] += 1
+      return
+    self.last_seen[shc] = ordinal
+
+    if ordinal < self.released:
+      # its date already went out without it
+      self.dropped['late'] += 1
+      return
+
+    heapq.heappush(self.pending, (ordinal, self.order[shc], received_ns, shc, date, line))
+
+  # date ordinal every contract still in the feed has reached
+  def Watermark(self):
+    if not self.active:
+      return float('inf')
+    return min(self.last_seen.get(shc, 0) for shc in self.active)
+
+  def TimeToFlush(self):
+    if self.flush_after is None or not self.pending:
+      return None
+    waited = (time.perf_counter_ns() - self.pending[0][2]) / 1e9
+    return max(0, self.flush_after - waited)
+
+  async def Release(self, pm_queues, force=False):
+    watermark = self.Watermark()
+    while self.pending:
+      if self.pending[0][0] > watermark:
+        if not force and len(self.pending) <= self.max_pending:
+          return
+        force = False # one bar per timeout or overflow
+        self.forced += 1
+
+      ordinal, order, received_ns, shc, date, line = heapq.heappop(self.pending)
+      self.released = ordinal
+      for pm_queue in pm_queues:
+        await pm_queue.put((received_ns, shc, date, line))
+
+  async def RunPM(self, pm, pm_queue):
+    loop = asyncio.get_event_loop()
+    latency = self.latency[str(pm)]
+    while True:
+      bar = await pm_queue.get()
+      if bar is None:
+        return
+
+      received_ns, shc, date, line = bar
+      recalibrate = pm.DispatchUpdate(shc, date, line)
+      latency.Add(time.perf_counter_ns() - received_ns)
+      if recalibrate:
+        await loop.run_in_executor(self.executor, pm.Recalibrate, date)
+
+  def PrintStats(self):
+    print('    ' + format('Portfolio manager', '60s')
+          + ' ' + format('bars', '>8s')
+          + ' ' + format('p50(us)', '>10s')
+          + ' ' + format('p99(us)', '>10s')
+          + ' ' + format('max(us)', '>10s'))
+    for pm in self.pm_list:
+      summary = self.latency[str(pm)].Summary()
+      print('    ' + format(str(pm), '60s')
+            + ' ' + format(summary['bars'], '8d')
+            + ' ' + format(summary['p50_us'], '10.1f')
+            + ' ' + format(summary['p99_us'], '10.1f')
+            + ' ' + format(summary['max_us'], '10.1f'))
+    print('    dropped: ' + str(self.dropped) + ' let go early: ' + str(self.forced))
+
+"""
+Plays market data files as a live feed, oldest bar first, every contract
+interleaved by date like a real end of day feed would send them.
+
+:param shortcodes: contracts to play, files come from MarketData/csvs
+:param rate: bars per second, None sends as fast as the receiver takes them
+:param num_bars: only play the oldest num_bars of every contract
+"""
+class FeedSimulator:
+  def __init__(self, shortcodes, rate=None, num_bars=None):
+    self.shortcodes = shortcodes
+    self.rate = rate
+    self.num_bars = num_bars
+
+  # (shc, line) in date then contract order, (shc, None) when a contract runs out
+  def Bars(self):
+    streams = list(self.DatedBars(order, shc) for order, shc in enumerate(self.shortcodes))
+    for ordinal, order, shc, line in heapq.merge(*streams):
+      yield shc, line
+
+    for shc in self.shortcodes:
+      yield shc, None
+
+  def DatedBars(self, order, shc):
+    contract = ci.ContractInfoDatabase[shc]
+    lines = fp.ReadLinesOldestFirst(os.path.join('MarketData', 'csvs', 'market_data_' + shc + '.csv'))
+    num_bars = 0
+    for line in lines:
+      date = fp.TokenizeToDate(contract, line)
+      if not date:
+        continue
+      if self.num_bars is not None and num_bars >= self.num_bars:
+        return
+      num_bars += 1
+      yield dt.DateOrdinal(date), order, shc, line
+
+  async def Pace(self, sent, start):
+    if self.rate:
+      delay = start + sent / self.rate - time.perf_counter()
+      if delay > 0:
+        await asyncio.sleep(delay)
+    elif sent % 256 == 0:
+      await asyncio.sleep(0) # let the receiver run
+
+  # feed an in-process QueueSource
+  async def Play(self, bar_queue):
+    start = time.perf_counter()
+    for sent, bar in enumerate(self.Bars()):
+      await bar_queue.put(bar)
+      await self.Pace(sent, start)
+    await bar_queue.put(None)
+
+  # feed whoever connects, one full playback per connection
+  async def ServeClient(self, reader, writer):
+    start = time.perf_counter()
+    for sent, (shc, line) in enumerate(self.Bars()):
+      writer.write(FormatBar(shc, END_OF_FEED if line is None else line).encode())
+      await writer.drain() # honours the receiver's backpressure
+      await self.Pace(sent, start)
+    writer.write((END_OF_FEED + '\n').encode())
+    await writer.drain()
+    writer.close()
+
+  """
+  Serve the feed at tcp:<host>:<port> or unix:<path> until cancelled.
+  """
+  async def Serve(self, address):
+    kind, target = address.split(':', 1)
+    if kind == 'tcp':
+      host, port = target.rsplit(':', 1)
+      server = await asyncio.start_server(self.ServeClient, host, int(port))
+    elif kind == 'unix':
+      server = await asyncio.start_unix_server(self.ServeClient, target)
+    else:
+      raise ValueError('can only serve tcp: & unix: addresses, not ' + address)
+
+    print('Serving market data feed at ' + address)
+    async with server:
+      await server.serve_forever()
@@ -0,0 +1,183 @@
+import os, sys, copy, multiprocessing
+import Strategies.PerfUtil.perf_util as pf
+import Strategies.FileUtil.shared_data as shd
+import run_portfolios as rp
+from portfolio_manager import *
+
+# command line flags for run_portfolios:
+# --workers=<n>              replay in n processes, each running the traders of some contract groups,
+#                            allocations still get recalibrated by the PMs in this process
+PARALLEL_OPTIONS = ['workers=']
+
+def WorkersFromOptions(opts):
+  opts = dict(opts)
+  return int(opts['--workers']) if '--workers' in opts else None
+
+"""
+Split traders into num_shards groups which share no contract: traders trading a common
+contract, even as one leg of a pair, end up in the same shard. Biggest contract groups
+go first, each to whichever shard has the fewest traders so far.
+:return: list of shards, every shard a list of trader names
+"""
+def ShardTraders(traders, num_shards):
+  # contract groups, union find over contracts traded together
+  parent = {}
+  def Root(shc):
+    while parent.setdefault(shc, shc) != shc:
+      shc = parent[shc]
+    return shc
+
+  for trader in traders:
+    contracts = [trader.contracts] if isinstance(trader.contracts, str) else list(trader.contracts)
+    for shc in contracts[1:]:
+      parent[Root(shc)] = Root(contracts[0])
+
+  groups = {}
+  for trader in traders:
+    contracts = [trader.contracts] if isinstance(trader.contracts, str) else list(trader.contracts)
+    groups.setdefault(Root(contracts[0]), []).append(trader.Name())
+
+  shards = [[] for shard in range(min(num_shards, len(groups)))]
+  for group in sorted(groups.values(), key=len, reverse=True):
+    min(shards, key=len).extend(group)
+  return shards
+
+"""
+Stands in for a PM in a worker, its traders are one shard of the real PM's.
+Recalibrating means shipping what the traders did since the last time to the real PM
+and waiting for the allocations it comes up with, see ParallelReplay.
+"""
+class ShardPM(PortfolioManager):
+  def __init__(self, connection, pm_index):
+    PortfolioManager.__init__(self)
+    self.connection = connection
+    self.pm_index = pm_index
+    self.shipped = {} # trader name to (trades, daily_pnl, pct_pnl_change, alloc) lengths already shipped
+
+  def Recalibrate(self, date):
+    self.connection.send(('recal', self.pm_index, date, self.NewRows()))
+    self.alloc.update(self.connection.recv())
+    self.last_recal_date = date
+
+  def NewRows(self):
+    rows = {}
+    for name, trader in self.traders.items():
+      shipped = self.shipped.get(name, (0, 0, 0, 0))
+      rows[name] = (trader.trades[shipped[0]:], trader.daily_pnl[shipped[1]:], trader.pct_pnl_change[shipped[2]:],
+                    trader.alloc[shipped[3]:], copy.copy(trader.my_pnl))
+      self.shipped[name] = (len(trader.trades), len(trader.daily_pnl), len(trader.pct_pnl_change), len(trader.alloc))
+    return rows
+
+# worker side: replay everything, only this shard's traders of every PM trade
+# :param data_handle: shd.SharedMarketData.Handle() of the market data to replay
+# :param recal_days: every real PM's recal_days, shards recalibrate when it does
+def RunShard(connection, shards, banks, data_handle, recal_days):
+  # progress & counters come from the main process
+  sys.stdout = open(os.devnull, 'w')
+  pf.ENABLED = False
+
+  shard_pms = []
+  for pm_index, names in enumerate(shards):
+    pm = ShardPM(connection, pm_index)
+    pm.recal_days = recal_days[pm_index]
+    for trader in rp.NewTraders():
+      if trader.Name() in names:
+        pm.AddTrader(trader)
+    if banks:
+      pm.BankTraders()
+    shard_pms.append(pm)
+
+  shc_market_data_lines, cursor = {}, {}
+  with shd.SharedMarketData.Attach(data_handle) as shared_data:
+    rp.OpenMarketDataStreams(shc_market_data_lines, shared_data=shared_data)
+    rp.ReplayMarketData(shc_market_data_lines, None, shard_pms, cursor)
+
+  # traders & banks go back in one piece so banks still point at their traders
+  connection.send(('done', cursor, list({'traders': pm.traders, 'banks': pm.banks, 'num_updates': pm.num_updates,
+                                         'last_date': pm.last_date} for pm in shard_pms)))
+  connection.close()
+
+# append a shard's rows to the real PM's traders
+def AddRows(pm, rows):
+  for name, (trades, daily_pnl, pct_pnl_change, alloc, my_pnl) in rows.items():
+    trader = pm.traders[name]
+    trader.trades += trades
+    trader.daily_pnl += daily_pnl
+    trader.pct_pnl_change += pct_pnl_change
+    trader.alloc += alloc
+    trader.my_pnl = my_pnl
+
+"""
+Same replay as ReplayMarketData(pm_list) from scratch, with the traders split across workers.
+Traders only hear from their PM through allocations, which only change on recalibration
+dates & those only depend on market data dates, so workers run on their own between them.
+On every recalibration all workers stop at the same update, the PMs here get every trader's
+rows since the last one, recalibrate off them like they always do and hand the allocations back.
+Results are bit for bit what a serial replay gets, at the end the PMs take over the workers'
+traders & banks so they can be saved & replayed on from.
+Market data gets read once, here, workers attach to it in shared memory.
+:param shared_data: shd.SharedMarketData to replay, published & unlinked here if not given
+:return: replay cursor, see ReplayMarketData
+"""
+def ParallelReplay(pm_list, num_workers, banks=True, shared_data=None):
+  if shared_data is None:
+    with shd.SharedMarketData.Publish(rp.indep_shortcode_list) as shared_data:
+      return ParallelReplay(pm_list, num_workers, banks, shared_data)
+
+  shards = ShardTraders(list(pm_list[0].traders.values()), num_workers)
+  print('Replaying on ' + str(len(shards)) + ' workers, traders per worker: ' + str(list(len(shard) for shard in shards)))
+
+  connections, workers = [], []
+  for shard in shards:
+    connection, worker_connection = multiprocessing.Pipe()
+    worker = multiprocessing.Process(target=RunShard, daemon=True,
+                                     args=(worker_connection, [shard] * len(pm_list), banks, shared_data.Handle(),
+                                           list(pm.recal_days for pm in pm_list)))
+    worker.start()
+    worker_connection.close()
+    connections.append(connection)
+    workers.append(worker)
+
+  num_recals, done = 0, False
+  try:
+    while not done:
+      # every worker stops at the same barrier, one PM at a time in pm_list order
+      messages = list(connection.recv() for connection in connections)
+      done = messages[0][0] == 'done'
+      if done:
+        continue
+
+      kind, pm_index, date, rows = messages[0]
+      pm = pm_list[pm_index]
+      for message in messages:
+        if message[:3] != (kind, pm_index, date):
+          raise RuntimeError('workers out of step: ' + str(message[:3]) + ' vs ' + str((kind, pm_index, date)))
+        AddRows(pm, message[3])
+
+      pm.Recalibrate(date)
+      for connection in connections:
+        connection.send(dict(pm.alloc))
+      num_recals += 1
+  except EOFError:
+    raise RuntimeError('a replay worker died, see its traceback above')
+  finally:
+    for worker in workers:
+      worker.join(timeout=(None if done else 1))
+      if worker.is_alive():
+        worker.terminate()
+
+  for pm_index, pm in enumerate(pm_list):
+    shard_pms = list(message[2][pm_index] for message in messages)
+    pf.UninstrumentPM(pm)
+    traders = {}
+    for shard_pm in shard_pms:
+      traders.update(shard_pm['traders'])
+    pm.traders = {name: traders[name] for name in pm.traders}
+    pm.banks = list(bank for shard_pm in shard_pms for bank in shard_pm['banks'])
+    banked = set(name for bank in pm.banks for name in bank.names)
+    pm.unbanked = list(name for name in pm.traders if name not in banked)
+    pm.num_updates, pm.last_date = shard_pms[0]['num_updates'], shard_pms[0]['last_date']
+    pf.InstrumentPM(pm)
+
+  print('Synchronized ' + str(len(shards)) + ' workers ' + str(num_recals) + ' times')
+  return messages[0][1]
@@ -0,0 +1,205 @@
+import sys, getopt, itertools, concurrent.futures
+import numpy
+import Strategies.PerfUtil.perf_util as pf
+import Strategies.FileUtil.shared_data as shd
+import run_portfolios as rp
+from trader import *
+
+DEFAULT_ETA = 3
+DEFAULT_MIN_BARS = 250
+DEFAULT_RISK_DOLLARS = 10000 # what every trader gets under a uniform PM
+
+# parameter grids searched for every trader style, on top of run_portfolios.trader_params
+SEARCH_GRIDS = {
+  TrendFollowTrader: {'ma_lookback_days': [10, 20, 40, 80], 'loss_ticks': [0.05, 0.1, 0.2, 0.4],
+                      'net_change': [0.25, 0.5, 0.75, 1.0]},
+  MeanReversionTrader: {'ma_lookback_days': [10, 20, 40, 80], 'loss_ticks': [0.1, 0.2, 0.4, 0.8],
+                        'net_change': [0.5, 0.75, 1.0, 1.5]},
+  RelativeValueTrader: {'ma_lookback_days': [20, 40, 80], 'loss_ticks': [0.1, 0.2, 0.4],
+                        'net_change': [0.5, 0.75, 1.0], 'min_correlation': [0.5, 0.65, 0.8]},
+  PairsTrader: {'ma_lookback_days': [20, 40, 80], 'loss_ticks': [0.1, 0.2, 0.4], 'net_change': [0.5, 0.75, 1.0]}
+}
+
+# command line flags:
+# --trader=<name>            trader style to search, e.g. TrendFollowTrader (default TrendFollowTrader)
+# --contracts=<a,b>          only these contracts, pairs as ES:NQ (default every one the style trades in run_portfolios)
+# --eta=<n>                  keep the best 1/eta of every rung, the next one runs eta times longer (default 3)
+# --min-bars=<n>             bars every configuration gets before the first cut (default 250)
+# --risk-dollars=<n>         risk every trader runs with (default 10000)
+# --workers=<n>              processes advancing traders (default one per cpu)
+SEARCH_OPTIONS = ['trader=', 'contracts=', 'eta=', 'min-bars=', 'risk-dollars=', 'workers=']
+
+# every combination of a grid, in grid order
+def GridPoints(grid):
+  keys = list(grid.keys())
+  return list(dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys)))
+
+# market data every worker replays from, see AttachSharedData
+shared_data = None
+
+def AttachSharedData(handle):
+  global shared_data
+  shared_data = shd.SharedMarketData.Attach(handle)
+
+"""
+Worker side: hand a trader every bar of its contracts dated within [start, end), the same
+updates in the same order ReplayMarketData would, & send it back to be advanced further
+later on. Traders pick up exactly where they stopped, nothing gets replayed twice.
+"""
+def Advance(trader, start, end, risk_dollars):
+  contracts = ([trader.contracts] if isinstance(trader.contracts, str) else trader.contracts)
+  updates = []
+  for shc in contracts:
+    ordinals = shared_data.Array(shc, 'ordinals')
+    num_bars = int(numpy.searchsorted(ordinals, end) - numpy.searchsorted(ordinals, start))
+    order = rp.indep_shortcode_list.index(shc)
+    for ordinal, (date, line) in zip(ordinals[numpy.searchsorted(ordinals, start):].tolist(),
+                                     itertools.islice(shared_data.Stream(shc, start - 1), num_bars)):
+      updates.append((ordinal, order, shc, date, line))
+
+  for ordinal, order, shc, date, line in sorted(updates):
+    trader.OnMarketDataUpdate(shc, date, line, risk_dollars)
+  return trader
+
+# partial Sharpe of whatever a trader did so far, too little to go on ranks last
+def Score(trader):
+  if len(trader.daily_pnl) < 2:
+    return -numpy.inf
+  return trader.Sharpe()
+
+"""
+Successive halving of one grid on one contract (or pair): every configuration trades the
+first min_bars bars, the best 1/eta by partial Sharpe go on eta times as long, and so on
+until the survivors have seen everything. All brackets run in the same rungs so the pool
+stays busy, survivors' trader objects travel back and forth between rungs & only ever
+trade bars they haven't seen yet.
+:param brackets: map from contract (or pair) to (list of params, rung end ordinals, last one past the last bar)
+:return: map from contract to (winning params, its trader, trajectory), the trajectory is one
+         (rung end ordinal, bars in, survivors, best score, cutoff score) per rung
+"""
+def SuccessiveHalving(executor, trader_type, brackets, eta, risk_dollars):
+  # contract to list of (params, trader) still in the running
+  alive = {key: list((params, trader_type(contracts, params)) for params in points)
+           for key, (contracts, points, rungs) in brackets.items()}
+  trajectories = {key: [] for key in brackets}
+
+  for rung in range(max(len(rungs) for contracts, points, rungs in brackets.values())):
+    futures = {}
+    for key, (contracts, points, rungs) in brackets.items():
+      if rung >= len(rungs):
+        continue
+      start = rungs[rung - 1] if rung > 0 else 0
+      for index, (params, trader) in enumerate(alive[key]):
+        futures[executor.submit(Advance, trader, start, rungs[rung], risk_dollars)] = (key, index)
+
+    for future in concurrent.futures.as_completed(futures):
+      key, index = futures[future]
+      alive[key][index] = (alive[key][index][0], future.result())
+
+    for key, (contracts, points, rungs) in brackets.items():
+      if rung >= len(rungs):
+        continue
+      ranked = sorted(alive[key], key=lambda entry: Score(entry[1]), reverse=True)
+      keep = len(ranked) if rung + 1 >= len(rungs) else max(1, len(ranked) // eta)
+      trajectories[key].append((rungs[rung], len(ranked), keep, Score(ranked[0][1]), Score(ranked[keep - 1][1])))
+      alive[key] = ranked[:keep]
+
+  return {key: (alive[key][0][0], alive[key][0][1], trajectories[key]) for key in brackets}
+
+"""
+Rung ends for a contract: min_bars, then eta times as many each rung, the last one takes everything.
+:return: list of end date ordinals, exclusive
+"""
+def Rungs(shc, num_points, eta, min_bars):
+  ordinals = shared_data.Array(shc, 'ordinals')
+  rungs, bars, survivors = [], min_bars, num_points
+  while bars < len(ordinals) and survivors > 1:
+    rungs.append(int(ordinals[bars]))
+    bars, survivors = bars * eta, max(1, survivors // eta)
+  rungs.append(int(ordinals[-1]) + 1)
+  return rungs
+
+# trader x bars every rung advanced, from its trajectory
+def Steps(trajectory, ordinals):
+  steps, previous = 0, 0
+  for end, configs, kept, best, cutoff in trajectory:
+    bars = int(numpy.searchsorted(ordinals, end))
+    steps += configs * (bars - previous)
+    previous = bars
+  return steps
+
+# :param ordinals: bar dates of the contract the rungs were cut on
+def PrintTrajectory(key, trajectory, num_points, ordinals):
+  print('\t' + key)
+  previous = 0
+  for end, configs, kept, best, cutoff in trajectory:
+    bars = int(numpy.searchsorted(ordinals, end))
+    print('\t\t' + format(configs, '4d') + ' configs through bar ' + format(bars, '6d')
+          + ' (+' + str(bars - previous) + '), best sharpe ' + format(best, '9.5f')
+          + ', kept ' + format(kept, '3d') + ' at or above ' + format(cutoff, '9.5f'))
+    previous = bars
+  steps, full_grid = Steps(trajectory, ordinals), num_points * len(ordinals)
+  print('\t\t' + str(steps) + ' trader-bars vs ' + str(full_grid) + ' for the full grid, '
+        + format(full_grid / max(steps, 1), '.1f') + 'x less')
+
+def main(args):
+  global shared_data
+  opts, args = getopt.getopt(args, '', pf.PERF_OPTIONS + SEARCH_OPTIONS)
+  pf.SetEnabledFromOptions(opts)
+  opts = dict(opts)
+
+  trader_type = getattr(sys.modules[__name__], opts.get('--trader', 'TrendFollowTrader'))
+  if trader_type not in SEARCH_GRIDS:
+    print('ERROR no search grid for ' + trader_type.__name__ + ', pick one of '
+          + str(list(style.__name__ for style in SEARCH_GRIDS)))
+    exit(1)
+  eta = int(opts.get('--eta', DEFAULT_ETA))
+  if eta < 2:
+    print('ERROR --eta has to be at least 2, nothing would ever get cut')
+    exit(1)
+  min_bars = int(opts.get('--min-bars', DEFAULT_MIN_BARS))
+  risk_dollars = float(opts.get('--risk-dollars', DEFAULT_RISK_DOLLARS))
+
+  contracts_list = rp.trader_contracts[trader_type]
+  if '--contracts' in opts:
+    contracts_list = list((contracts.split(':') if ':' in contracts else contracts)
+                          for contracts in opts['--contracts'].split(','))
+  # pair traders take two contracts, the rest one, all of them ones shared data has bars of
+  pairs = not isinstance(rp.trader_contracts[trader_type][0], str)
+  for contracts in contracts_list:
+    if pairs != (not isinstance(contracts, str)) or (pairs and len(contracts) != 2):
+      print('ERROR ' + trader_type.__name__ + ' trades ' + ('pairs of contracts, e.g. ES:NQ' if pairs else 'one contract, e.g. ES')
+            + ', not ' + (contracts if isinstance(contracts, str) else ':'.join(contracts)))
+      exit(1)
+    for shc in ([contracts] if isinstance(contracts, str) else contracts):
+      if shc not in rp.indep_shortcode_list:
+        print('ERROR no market data for ' + shc + ', pick from ' + str(rp.indep_shortcode_list))
+        exit(1)
+  points = list(dict(rp.trader_params[trader_type], **point) for point in GridPoints(SEARCH_GRIDS[trader_type]))
+
+  with pf.Phase('load'):
+    shared_data = shd.SharedMarketData.Publish(rp.indep_shortcode_list)
+
+  workers = int(opts['--workers']) if '--workers' in opts else None
+  with shared_data, concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=AttachSharedData,
+                                                         initargs=(shared_data.Handle(),)) as executor:
+    brackets = {}
+    for contracts in contracts_list:
+      shc = contracts if isinstance(contracts, str) else contracts[0]
+      brackets[shc if isinstance(contracts, str) else ':'.join(contracts)] = (contracts, points,
+                                                                            Rungs(shc, len(points), eta, min_bars))
+
+    with pf.Phase('search'):
+      print('\nSearching ' + str(len(points)) + ' ' + trader_type.__name__ + ' configurations on '
+            + str(len(brackets)) + ' contracts, keeping 1/' + str(eta) + ' per rung...')
+      results = SuccessiveHalving(executor, trader_type, brackets, eta, risk_dollars)
+
+    with pf.Phase('summary'):
+      print('\nSearch trajectories & winners...')
+      for key, (params, trader, trajectory) in results.items():
+        PrintTrajectory(key, trajectory, len(points), shared_data.Array(key.split(':')[0], 'ordinals'))
+        print('\t\twinner ' + str({name: params[name] for name in SEARCH_GRIDS[trader_type]}) + ' sharpe '
+              + format(Score(trader), '.5f') + ' pnl ' + format(trader.trades[-1][5] if trader.trades else 0, '.2f'))
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
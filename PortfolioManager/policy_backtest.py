@@ -0,0 +1,323 @@
+import sys, copy, getopt
+import numpy
+import Strategies.Plots.plots as plt
+import Strategies.PerfUtil.perf_util as pf
+import Strategies.CacheUtil.run_cache as rc
+import Strategies.PnlUtil.bootstrap as bs
+import Strategies.PnlUtil.risk_tracker as rt
+import run_portfolios as rp
+from portfolio_manager import *
+
+# regime PMs also need indicator data & the uniform PM's returns, those only run through run_portfolios
+DEFAULT_POLICIES = [UniformAllocPM, IndividualPnlAllocPM, IndividualSharpeAllocPM, IndividualSortinoAllocPM, MarkowitzAllocPM,
+                    MLPredictiveAllocPM]
+
+# command line flags:
+# --policies=<PM>,<PM>,..   PM classes to evaluate (default every PM but the regime one)
+POLICY_OPTIONS = ['policies=']
+
+"""
+A position or pnl as a linear combination of trade sizes, amounts[i] is how much
+of it scales with the size of the trader's i-th entry. Trader pnl is linear in the
+size of every entry, so a trader running with these as trade sizes records its pnl
+for every possible sizing at once. Comparisons go off a 1 contract sizing, traders
+only ever decide on whether they are flat, long or short.
+"""
+class Units:
+  __slots__ = ['amounts']
+
+  def __init__(self, amounts):
+    self.amounts = amounts
+
+  def Value(self):
+    return float(self.amounts.sum())
+
+  def __add__(self, other):
+    if not isinstance(other, Units):
+      return self if other == 0 else NotImplemented # a flat trader's 0 pnl
+
+    shorter, longer = sorted([self.amounts, other.amounts], key=len)
+    amounts = longer.copy()
+    amounts[:len(shorter)] += shorter
+    return Units(amounts)
+
+  __radd__ = __add__
+
+  def __neg__(self):
+    return Units(-self.amounts)
+
+  def __sub__(self, other):
+    return self + (-other)
+
+  def __rsub__(self, other):
+    return (-self) + other
+
+  def __mul__(self, other):
+    if isinstance(other, Units):
+      return NotImplemented
+    return Units(self.amounts * other)
+
+  __rmul__ = __mul__
+
+  # only % pnl changes divide by pnl, those get worked out again for every sizing, see TraderRecording.Replay
+  def __truediv__(self, other):
+    return self.Value() / (other.Value() if isinstance(other, Units) else other)
+
+  def __abs__(self):
+    return self if self.Value() >= 0 else -self
+
+  def __eq__(self, other):
+    return self.Value() == other
+
+  def __ne__(self, other):
+    return self.Value() != other
+
+  def __lt__(self, other):
+    return self.Value() < other
+
+  def __gt__(self, other):
+    return self.Value() > other
+
+  __hash__ = None
+
+# what a recorded pnl comes to with these entry sizes
+def Evaluate(value, sizes):
+  if isinstance(value, Units):
+    return float(value.amounts @ sizes[:len(value.amounts)])
+  if isinstance(value, list):
+    return list(Evaluate(item, sizes) for item in value)
+  return value
+
+"""
+One trader's run at unit risk: the sizing inputs of every entry it made, the date of
+every trades row & every row's pnl change as amounts per entry size.
+While recording the trader only keeps its newest row, the older ones are in here.
+"""
+class TraderRecording:
+  def __init__(self, trader):
+    self.trader = trader
+    self.name = trader.Name()
+    self.entry_rows, self.tick_values, self.loss_ticks = [], [], []
+    self.dates = []
+    self.term_rows, self.term_entries, self.term_amounts = [], [], []
+    # every entry the trader makes goes through here instead of getting sized off risk dollars
+    trader.TradeSize = self.TradeSize
+
+  def TradeSize(self, risk_dollars, tick_value, loss_ticks):
+    self.entry_rows.append(self.trader.NumTradeRows()) # the row it's about to append
+    self.tick_values.append(tick_value)
+    self.loss_ticks.append(loss_ticks)
+
+    amounts = numpy.zeros(len(self.entry_rows))
+    amounts[-1] = 1
+    return Units(amounts)
+
+  # pick up the row the trader appended on this update, if any
+  def Collect(self):
+    trader = self.trader
+    if trader.NumTradeRows() <= len(self.dates):
+      return
+
+    self.dates.append(trader.trades[-1][0])
+    daily_pnl = trader.daily_pnl[-1]
+    if isinstance(daily_pnl, Units):
+      entries = numpy.flatnonzero(daily_pnl.amounts)
+      self.term_rows.extend([len(self.dates) - 1] * len(entries))
+      self.term_entries.extend(entries.tolist())
+      self.term_amounts.extend(daily_pnl.amounts[entries].tolist())
+
+    # tomorrow's pnl change only needs today's row
+    trader.spilled_rows += len(trader.trades) - 1
+    del trader.trades[:-1]
+    trader.daily_pnl.clear()
+    trader.pct_pnl_change.clear()
+    trader.alloc.clear()
+
+  def Finish(self):
+    del self.trader.TradeSize
+    self.term_rows = numpy.array(self.term_rows, dtype=numpy.int64)
+    self.term_entries = numpy.array(self.term_entries, dtype=numpy.int64)
+    self.term_amounts = numpy.array(self.term_amounts)
+
+    # keep the trader around without its positions or histories, policies get copies of it
+    trader = copy.copy(self.trader)
+    trader.trades, trader.daily_pnl, trader.pct_pnl_change, trader.alloc = [], [], [], []
+    trader.spilled_rows = 0
+    for attribute in ['my_position', 'my_pnl']:
+      value = getattr(trader, attribute)
+      setattr(trader, attribute, [0] * len(value) if isinstance(value, list) else 0)
+    self.trader = trader
+
+  # a trader with no history to run a policy with
+  def Trader(self):
+    trader = copy.copy(self.trader)
+    trader.trades, trader.daily_pnl, trader.pct_pnl_change, trader.alloc = [], [], [], []
+    trader.risk = rt.RiskTracker()
+    return trader
+
+  """
+  Bring a policy's trader up to num_rows trades rows, every entry in between gets sized off
+  risk_dollars the same way the trader would have sized it. Rows only hold date & pnl.
+  :param sizes: this policy's entry sizes, filled in here
+  :param my_pnl: the trader's recorded my_pnl at num_rows
+  """
+  def Replay(self, trader, sizes, num_rows, risk_dollars, my_pnl):
+    start = len(trader.trades)
+    first, last = numpy.searchsorted(self.entry_rows, [start, num_rows])
+    for entry in range(first, last):
+      sizes[entry] = trader.TradeSize(risk_dollars, self.tick_values[entry], self.loss_ticks[entry])
+
+    first, last = numpy.searchsorted(self.term_rows, [start, num_rows])
+    daily_pnl = numpy.bincount(self.term_rows[first:last] - start,
+                               weights=self.term_amounts[first:last] * sizes[self.term_entries[first:last]],
+                               minlength=num_rows - start)
+    last_pnl = trader.trades[-1][5] if trader.trades else 0.0
+    pnl = last_pnl + numpy.cumsum(daily_pnl)
+    previous_pnl = numpy.concatenate([[last_pnl], pnl])[:-1]
+    changed = previous_pnl != 0 # same as the traders, no % change off a flat 0 pnl
+
+    trader.trades.extend([date, None, None, None, None, row_pnl] for date, row_pnl in zip(self.dates[start:num_rows], pnl.tolist()))
+    trader.daily_pnl.extend(daily_pnl.tolist())
+    trader.pct_pnl_change.extend((100 * daily_pnl[changed] / numpy.abs(previous_pnl[changed])).tolist())
+    trader.alloc.extend([risk_dollars] * (num_rows - start))
+    trader.my_pnl = Evaluate(my_pnl, sizes)
+
+"""
+Runs every trader once with unit trade sizes, then any allocation policy can be
+evaluated off the recording without running a trader again, see EvaluatePolicy.
+Recalibration dates only depend on market data dates, so they get recorded too, every
+pm.recal_days, policies which recalibrate less often pick the points they'd have recalibrated at.
+Goes into ReplayMarketData as a PM.
+"""
+class UnitRiskRecorder:
+  def __init__(self, pm):
+    self.pm = pm
+    self.traders = {name: TraderRecording(trader) for name, trader in pm.traders.items()}
+    # (date, trades rows of every trader, my_pnl of every trader) on every recalibration
+    self.recal_points = []
+    self.start_date = None # where recal_days start counting from
+
+  def OnMarketDataUpdate(self, shc, date, line):
+    recalibrate = self.pm.DispatchUpdate(shc, date, line)
+    self.start_date = self.start_date or date
+    for recording in self.traders.values():
+      if shc in recording.trader.ContractList():
+        recording.Collect()
+
+    if recalibrate:
+      self.recal_points.append(self.Checkpoint(date))
+      self.pm.last_recal_date = date
+
+  def Checkpoint(self, date):
+    return (date, {name: len(recording.dates) for name, recording in self.traders.items()},
+            {name: copy.copy(recording.trader.my_pnl) for name, recording in self.traders.items()})
+
+  # where the run ended up, the last checkpoint without a recalibration
+  def Finish(self):
+    self.end = self.Checkpoint(None)
+    for recording in self.traders.values():
+      recording.Finish()
+    self.pm = None
+
+"""
+Replay every trader at unit risk.
+:return: the finished UnitRiskRecorder
+"""
+def RecordUnitRisk(prefetcher=None, recal_days=NUM_DAYS_TO_RECALIBRATE):
+  # sizes get recorded per trader, banks size all of theirs at once
+  pm_list, regime_pm = rp.InitializePMs([PortfolioManager], banks=False)
+  pm_list[0].recal_days = recal_days
+  recorder = UnitRiskRecorder(pm_list[0])
+
+  shc_market_data_lines = {}
+  rp.OpenMarketDataStreams(shc_market_data_lines, prefetcher=prefetcher)
+  rp.ReplayMarketData(shc_market_data_lines, None, [recorder])
+  print(end='\n')
+
+  recorder.Finish()
+  return recorder
+
+# RecordUnitRisk, or the recording it made the last time it ran on the same data, setup & code
+def CachedRecordUnitRisk(run_cache, prefetcher=None, recal_days=NUM_DAYS_TO_RECALIBRATE):
+  data_files = list('MarketData/csvs/market_data_' + shc + '.csv' for shc in rp.indep_shortcode_list)
+  setup = {'traders': rp.trader_list,
+           'contracts': {trader_type.__name__: rp.trader_contracts[trader_type] for trader_type in rp.trader_list},
+           'params': {trader_type.__name__: rp.trader_params[trader_type] for trader_type in rp.trader_list},
+           'recal_days': recal_days}
+  return run_cache.Call(RecordUnitRisk, data_files, setup, lambda: RecordUnitRisk(prefetcher, recal_days))
+
+"""
+Run an allocation policy off a recording: between recalibrations the allocations are fixed,
+so every trader's entries in there get sized & its pnl rows summed up in one go, then the
+PM recalibrates off its traders like it would have in a full replay, on the recorded points
+recal_days or more after its last recalibration.
+:return: the PM, with traders holding date & pnl rows only
+"""
+def EvaluatePolicy(recorder, pm_type):
+  pm = pm_type()
+  sizes = {}
+  for name, recording in recorder.traders.items():
+    pm.AddTrader(recording.Trader())
+    sizes[name] = numpy.zeros(len(recording.entry_rows))
+
+  pm.last_recal_date = recorder.start_date
+  for date, num_rows, my_pnl in recorder.recal_points + [recorder.end]:
+    for name, recording in recorder.traders.items():
+      recording.Replay(pm.traders[name], sizes[name], num_rows[name], pm.alloc[name], my_pnl[name])
+    if date and pm.RecalibrationDue(date):
+      pm.Recalibrate(date)
+
+  return pm
+
+# compare allocation policies off one run of the traders
+#
+# --policies=<PM>,<PM>,..   PM classes to evaluate, e.g. IndividualPnlAllocPM,MarkowitzAllocPM
+# --cache                   reuse the recording of an identical earlier run, see run_cache
+# --bootstrap-resamples=<n> resamples behind the confidence intervals in every summary, 0 turns them off
+def main(args):
+  options = plt.RENDER_OPTIONS + pf.PERF_OPTIONS + rc.CACHE_OPTIONS + POLICY_OPTIONS + bs.BOOTSTRAP_OPTIONS
+  opts, args = getopt.getopt(args, '', options)
+  plt.SetRenderModeFromOptions(opts)
+  pf.SetEnabledFromOptions(opts)
+  run_cache = rc.CacheFromOptions(opts)
+  bs.SetFromOptions(opts)
+  opts = dict(opts)
+
+  policies = DEFAULT_POLICIES
+  if '--policies' in opts:
+    policies = list(getattr(sys.modules[__name__], name) for name in opts['--policies'].split(','))
+  for policy in policies:
+    if policy().style == AllocationStyle.RegimePredictiveAlloc:
+      print('ERROR ' + policy.__name__ + ' needs indicator data, run it through run_portfolios')
+      exit(1)
+  # record as often as the policy recalibrating most often needs
+  recal_days = min(policy().recal_days for policy in policies)
+
+  with pf.Phase('record'):
+    print('\nRecording every trader at unit risk...')
+    recorder = CachedRecordUnitRisk(run_cache, recal_days=recal_days) if run_cache else RecordUnitRisk(recal_days=recal_days)
+
+  with pf.Phase('policies'):
+    print('\nEvaluating ' + str(len(policies)) + ' allocation policies off the recording...')
+    pm_list = list(EvaluatePolicy(recorder, policy) for policy in policies)
+
+  with pf.Phase('summary'):
+    print('\nSummarizing portfolio manager stats...')
+    all_dates, pm_pnl_list, std_mean = [], {}, []
+    for pm in pm_list:
+      pm.SummarizePerformance(plot=False)
+      if len(all_dates) <= 0:
+        all_dates = pm.all_dates
+
+      std_mean.append([pm.stdev_pnl, pm.avg_pnl, str(pm)])
+      pm_pnl_list[str(pm)] = pm.pnl_list
+    pf.PrintGlobalCounters()
+
+  with pf.Phase('plots'):
+    print('\nComparing portfolio managers...')
+    plt.ComparePlots(all_dates, pm_pnl_list)
+    plt.PlotEfficientFrontierPlot(std_mean)
+    plt.WaitForRenders()
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
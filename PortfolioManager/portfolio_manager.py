@@ -1,9 +1,15 @@
 import sys, statistics, numpy, cvxopt, functools
 from cvxopt import blas, solvers
 from enum import Enum
-import Strategies.Plots.plots as plt
 import Strategies.ContractDef.contract_info as ci
 import Strategies.DateDef.date_util as dt
+import Strategies.PnlUtil.pnl_util as pu
+import Strategies.PerfUtil.perf_util as pf
+import Strategies.PnlUtil.bootstrap as bs
+import Strategies.PnlUtil.risk_tracker as rt
+import Strategies.PnlUtil.risk_parity as rpar
+import Strategies.PnlUtil.online_regression as orr
+import trader_bank as tb
 
 # this is how much a trader gets as starting allocation
 FIRST_ALLOCATION = 10000
@@ -17,6 +23,15 @@ TOTAL_ALLOCATION = 420000
 
 # reallocate risk every these many days
 NUM_DAYS_TO_RECALIBRATE = 28 # once a month
+# same on every new date, date_util.NumDaysBetween takes 8 days off so the next date is at least -7 away
+RECALIBRATE_DAILY = -7
+
+# how RegimePredictiveAllocPM shrinks its indicator & lagged return features before fitting:
+# None (fit on all of them), 'pca' (incremental PCA) or 'random' (gaussian random projection)
+REGIME_REDUCTION = None
+REGIME_COMPONENTS = 32
+REGIME_REDUCTIONS = [None, 'pca', 'random']
+REDUCTION_SEED = 20170821 # the random projection's, same seed same projection
 
 class AllocationStyle(Enum):
   NoAlloc = -1
@@ -28,6 +43,8 @@ class AllocationStyle(Enum):
   MLPredictiveAlloc = 6     # learn from past return patterns
   RegimePredictiveAlloc = 7 # use economic indicators to predict future returns
                             # of each strategy and then find a combination accordingly
+  InverseVolatilityAlloc = 8# everyone gets risk in inverse proportion to how much their returns move
+  RiskParityAlloc = 9       # everyone contributes the same to overall portfolio risk
 
 class PortfolioManager:
   def __init__(self):
@@ -38,11 +55,16 @@ class PortfolioManager:
     self.traders = {}
     self.alloc = {} # this will overtime with trader performance
 
+    # traders stepped together in banks, see BankTraders, the rest get updates one by one
+    self.banks = []
+    self.unbanked = []
+
     self.num_updates = 0
 
     # when was the last time we judged trader performance?
     # we re-assess allocations every 10 days
     self.last_recal_date = None
+    self.recal_days = NUM_DAYS_TO_RECALIBRATE # PMs which recalibrate cheaply can do it more often, see RECALIBRATE_DAILY
 
     # this will get updated after market update,
     # so we know how much data we can retrain model on and make predictions from.
@@ -51,36 +73,102 @@ class PortfolioManager:
     self.last_date_index = 0
     self.last_date = None
 
+    # hot path timings, only set when instrumentation is enabled, see perf_util.InstrumentPM
+    self.perf_counters = None
+
+    # running risk of the PM's daily pnl across all traders, see UpdateRisk
+    self.risk = rt.RiskTracker()
+    self.risk_rows = {} # trader name to ledger rows already summed into risk_days
+    self.risk_days = {} # date to PM pnl of the days which can still get rows
+
   def AddTrader(self, trader):
     self.traders[trader.Name()] = trader
     self.alloc[trader.Name()] = FIRST_ALLOCATION # initial alloc for all PM
+    if trader.Name() not in self.unbanked:
+      self.unbanked.append(trader.Name())
+
+  # step trend following & mean reversion traders in banks from now on, see trader_bank
+  def BankTraders(self):
+    self.banks += tb.MakeBanks(self.traders[name] for name in self.unbanked)
+    banked = set(name for bank in self.banks for name in bank.names)
+    self.unbanked = list(name for name in self.unbanked if name not in banked)
 
   def RecalibrateAllocations(self):
     raise NotImplementedError
 
   def OnMarketDataUpdate(self, shc, date, line):
+    if self.DispatchUpdate(shc, date, line):
+      self.Recalibrate(date)
+
+  # OnMarketDataUpdate for every update of one day, in order, so banks can take them in one step
+  # :param updates: list of (shc, date, line) on the same date
+  def OnMarketDataDay(self, updates):
+    date = updates[0][1]
+    # only the day's first update can be due for a recalibration, the rest have to see its allocations
+    if self.RecalibrationDue(date):
+      self.OnMarketDataUpdate(*updates[0])
+      updates = updates[1:]
+
+    if updates and self.DispatchUpdates(date, list((shc, line) for shc, date, line in updates)):
+      self.Recalibrate(date)
+
+  # notify every trader which cares about this contract,
+  # return True once allocations are due for recalibration, see Recalibrate
+  def DispatchUpdate(self, shc, date, line):
+    return self.DispatchUpdates(date, [(shc, line)])
+
+  # DispatchUpdate for updates of several contracts on the same date
+  def DispatchUpdates(self, date, updates):
     self.last_date = date
 
-    self.num_updates += 1
-    if self.num_updates % 1000 == 0:
-      print('|', end='')
-      sys.stdout.flush()
+    self.num_updates += len(updates)
 
-    # cycle through every trader under management
-    for name in self.traders.keys():
-      # check if trader cares about this contract
-      if shc in self.traders[name].ContractList():
-        # notify them of market update
-        self.traders[name].OnMarketDataUpdate(shc, date, line, self.alloc[name])
+    for shc, line in updates:
+      # cycle through every trader under management
+      for name in self.unbanked:
+        # check if trader cares about this contract
+        if shc in self.traders[name].ContractList():
+          # notify them of market update
+          self.traders[name].OnMarketDataUpdate(shc, date, line, self.alloc[name])
 
-    if not self.last_recal_date:
-      self.last_recal_date = date
-      return
+    for bank in self.banks:
+      bank.OnMarketDataUpdates(updates, self.alloc)
 
-    if dt.NumDaysBetween(self.last_recal_date, date) >= NUM_DAYS_TO_RECALIBRATE:
-      self.RecalibrateAllocations()
+    if not self.last_recal_date:
       self.last_recal_date = date
-      self.CheckAllocations()
+      return False
+
+    return self.RecalibrationDue(date)
+
+  # recal_days or more since the last recalibration as date_util.NumDaysBetween counts them,
+  # the first update is where they count from
+  def RecalibrationDue(self, date):
+    return bool(self.last_recal_date) and dt.NumDaysBetween(self.last_recal_date, date) >= self.recal_days
+
+  def Recalibrate(self, date):
+    self.UpdateRisk()
+    self.RecalibrateAllocations()
+    self.last_recal_date = date
+    self.CheckAllocations()
+
+  """
+  Bring self.risk up to date with the ledger rows traders added since the last time, it costs
+  O(new rows) so it's cheap on every recalibration, allocators can use self.risk & trader.Risk().
+  The PM's daily pnl is every trader's pnl change summed up by date, same as AggregatePnls.
+  Replay is in date order, so a day is over once a later one shows up, unless final.
+  """
+  def UpdateRisk(self, final=False):
+    for name, trader in self.traders.items():
+      first, last = self.risk_rows.get(name, 0), len(trader.daily_pnl)
+      for row in range(first, last):
+        date = trader.trades[row - trader.spilled_rows][0]
+        self.risk_days[date] = self.risk_days.get(date, 0) + trader.daily_pnl[row]
+      self.risk_rows[name] = last
+
+    dates = sorted(self.risk_days, key=dt.DateOrdinal)
+    for date in (dates if final else dates[:-1]):
+      self.risk.Update(self.risk_days.pop(date))
+    return self.risk
 
   def CheckAllocations(self):
     total_alloc = sum(self.alloc.values())
@@ -95,7 +183,7 @@ class PortfolioManager:
   def __str__(self):
     return 'Portfolio manager: ' + str(self.style) + '|' + str(len(self.traders))
 
-  def SummarizePerformance(self):
+  def SummarizePerformance(self, plot=True):
     print('  Summarizing: ' + str(self))
     print('    ' + format('Trader', '35s')
           + ' ' + format('FinalPnl(mil$)', '10s')
@@ -115,14 +203,14 @@ class PortfolioManager:
             + ' ' + str(format(self.traders[trader].DailyDownsidePnlStdev()/1000.0, '10.3f'))
             + ' ' + str(format(self.traders[trader].alloc[-1]/1000.0, '10.3f')))
 
-    self.PlotAllocationsAndPnls()
+    self.AggregatePnls()
+    if plot:
+      self.PlotAllocationsAndPnls()
 
-    daily_pnl_list = [self.pnl_list[0]] # initial is first day of pnl
-    for i in range(1, len(self.pnl_list)):
-      daily_pnl_list.append(self.pnl_list[i] - self.pnl_list[i-1])
-    self.avg_pnl = statistics.mean(daily_pnl_list)
-    self.stdev_pnl = statistics.stdev(daily_pnl_list)
-    down_stdev_pnl = statistics.stdev(min(0, pnl) for pnl in daily_pnl_list)
+    daily_pnl_list = pu.DailyPnl(self.pnl_list)
+    self.avg_pnl = numpy.mean(daily_pnl_list)
+    self.stdev_pnl = numpy.std(daily_pnl_list, ddof=1)
+    down_stdev_pnl = numpy.std(numpy.minimum(daily_pnl_list, 0), ddof=1)
 
     print('    ' + format('PM', '35s')
           + ' ' + format('FinalPnl(mil$)', '10s')
@@ -139,13 +227,65 @@ class PortfolioManager:
           + ' ' + str(format(self.stdev_pnl/1000.0, '10.3f'))
           + ' ' + str(format(down_stdev_pnl/1000.0, '10.3f')))
 
+    self.PrintRisk()
+    if bs.resamples > 0:
+      self.PrintConfidenceIntervals()
+
+    pf.PrintPMCounters(self)
+
+  # running drawdowns & tail risk of every trader & the PM, see UpdateRisk
+  def PrintRisk(self):
+    level = str(int(rt.DEFAULT_VAR_LEVEL * 100))
+    print('    ' + format('Risk', '35s')
+          + ' ' + format('MaxDrawdown(K$)', '10s')
+          + ' ' + format('Drawdown(K$)', '10s')
+          + ' ' + format('MaxDaysUnderWater', '10s')
+          + ' ' + format('DaysUnderWater', '10s')
+          + ' ' + format('VaR' + level + '(K$)', '10s')
+          + ' ' + format('CVaR' + level + '(K$)', '10s'))
+    rows = list((trader.ShortName(), trader.Risk()) for trader in self.traders.values())
+    for name, risk in rows + [(str(self.style), self.UpdateRisk(final=True))]:
+      print('    ' + format(name, '35s')
+            + ' ' + str(format(risk.max_drawdown/1000.0, '15.3f'))
+            + ' ' + str(format(risk.drawdown/1000.0, '12.3f'))
+            + ' ' + str(format(risk.max_days_under_water, '17d'))
+            + ' ' + str(format(risk.days_under_water, '14d'))
+            + ' ' + str(format(risk.ValueAtRisk()/1000.0, '10.3f'))
+            + ' ' + str(format(risk.ConditionalValueAtRisk()/1000.0, '10.3f')))
+
+  # block bootstrap intervals of every trader & the PM off the aligned daily pnl, one resampling for all
+  # of them, see bs.BootstrapIntervals; needs AggregatePnls
+  def PrintConfidenceIntervals(self):
+    daily_pnl = pu.DailyPnl(numpy.column_stack([self.pnl_matrix, pu.EquityCurve(self.pnl_matrix)]).T)
+    intervals = bs.BootstrapIntervals(daily_pnl, bs.resamples, bs.block_length, drawdowns=True)
+    print('    ' + format('Bootstrap ' + str(int(bs.DEFAULT_CONFIDENCE * 100)) + '% (' + str(bs.resamples)
+                          + ' x ' + str(bs.block_length) + ' day blocks)', '35s')
+          + ' ' + format('AvgPnl(K$)', '23s')
+          + ' ' + format('Sharpe', '23s')
+          + ' ' + format('Sortino', '23s')
+          + ' ' + format('MaxDrawdown(K$)', '23s'))
+    names = list(self.traders[name].ShortName() for name in self.trader_names) + [str(self.style)]
+    for index, name in enumerate(names):
+      line = '    ' + format(name, '35s')
+      for key, scale in [('mean', 1000.0), ('sharpe', 1), ('sortino', 1), ('max_drawdown', 1000.0)]:
+        estimate, low, high = (value[index] / scale for value in intervals[key])
+        line += ' ' + format(estimate, '7.3f') + ' [' + format(low, '6.3f') + ',' + format(high, '7.3f') + ']'
+      print(line)
+
+  # line up every trader's pnl & allocations on the same dates,
+  # pnl_list is the PM equity curve in K$ across all_dates
+  def AggregatePnls(self):
+    trades = {name: trader.trades for name, trader in self.traders.items()}
+    allocs = {name: trader.alloc for name, trader in self.traders.items()}
+
+    self.trader_names, self.all_dates, self.pnl_matrix, self.alloc_matrix =\
+      pu.AlignTradesAndAllocs(trades, allocs)
+    self.pnl_list = pu.EquityCurve(self.pnl_matrix)/1000.0
+
   def PlotAllocationsAndPnls(self):
-    self.shortcode_results, self.shortcode_allocs = {}, {}
-    for trader in self.traders.keys():
-      self.shortcode_results[(self.traders[trader]).Name()] = list(self.traders[trader].trades)
-      self.shortcode_allocs[(self.traders[trader]).Name()] = list(self.traders[trader].alloc)
+    import Strategies.Plots.plots as plt
 
-    self.all_dates, self.pnl_list = plt.MergeAndPlotTradesAndAlloc(str(self.style), self.shortcode_results, self.shortcode_allocs, ci.ContractInfoDatabase)
+    plt.PlotTradesAndAlloc(str(self.style), self.trader_names, self.all_dates, self.pnl_matrix, self.alloc_matrix)
 
 class UniformAllocPM(PortfolioManager):
   def __init__(self):
@@ -170,7 +310,7 @@ class IndividualPnlAllocPM(PortfolioManager):
     total_allocation = TOTAL_ALLOCATION
 
     for trader in self.alloc:
-      if len(self.traders[trader].trades) >= 2 * NUM_DAYS_TO_RECALIBRATE:
+      if self.traders[trader].NumTradeRows() >= 2 * NUM_DAYS_TO_RECALIBRATE:
         if self.traders[trader].DailyAvgPnl() < 0:
           # losing, cut risk
           new_alloc = max(int(self.alloc[trader] * 0.9), MIN_ALLOCATION)
@@ -200,7 +340,7 @@ class IndividualSharpeAllocPM(PortfolioManager):
     total_allocation = TOTAL_ALLOCATION
 
     for trader in self.alloc:
-      if len(self.traders[trader].trades) >= 2 * NUM_DAYS_TO_RECALIBRATE:
+      if self.traders[trader].NumTradeRows() >= 2 * NUM_DAYS_TO_RECALIBRATE:
         if self.traders[trader].Sharpe() < 0:
           # losing, cut risk
           new_alloc = max(int(self.alloc[trader] * 0.9), MIN_ALLOCATION)
@@ -230,7 +370,7 @@ class IndividualSortinoAllocPM(PortfolioManager):
     total_allocation = TOTAL_ALLOCATION
 
     for trader in self.alloc:
-      if len(self.traders[trader].trades) >= 2 * NUM_DAYS_TO_RECALIBRATE:
+      if self.traders[trader].NumTradeRows() >= 2 * NUM_DAYS_TO_RECALIBRATE:
         if self.traders[trader].Sortino() < 0:
           # losing, cut risk
           new_alloc = max(int(self.alloc[trader] * 0.9), MIN_ALLOCATION)
@@ -258,7 +398,7 @@ class MarkowitzAllocPM(PortfolioManager):
     total_allocation = TOTAL_ALLOCATION
 
     for trader in self.alloc:
-      if len(self.traders[trader].trades) >= 2 * NUM_DAYS_TO_RECALIBRATE:
+      if self.traders[trader].NumTradeRows() >= 2 * NUM_DAYS_TO_RECALIBRATE:
         traders_to_alloc.append(trader)
       else:
         # trader has traded for inadequate amount of time, too soon to gauge performance
@@ -336,12 +476,176 @@ class MarkowitzAllocPM(PortfolioManager):
       wt[index] = wt[index][0]
     return wt
 
+"""
+Hands out risk in inverse proportion to the volatility of every trader's daily return on the
+risk it was given (pnl per allocated dollar), over the last window days, see risk_parity.
+Returns come off the traders' ledgers along with the PM's pnl in UpdateRisk, O(new rows),
+& allocations get clipped into [MIN_ALLOCATION, MAX_ALLOCATION] still adding up to what's left
+of TOTAL_ALLOCATION, so recalibrating is cheap enough to do every recal_days, daily by default.
+"""
+class InverseVolatilityAllocPM(PortfolioManager):
+  def __init__(self, recal_days=RECALIBRATE_DAILY, window=rpar.DEFAULT_WINDOW):
+    PortfolioManager.__init__(self)
+    self.style = AllocationStyle.InverseVolatilityAlloc
+    self.recal_days = recal_days
+
+    self.returns = rpar.RollingCovariance(window)
+    self.return_index = {} # trader name to its series in returns
+    self.return_rows = {} # trader name to ledger rows already summed into return_days
+    self.return_days = {} # date to every trader's return of the days which can still get rows
+
+  # returns need the dates & allocations of new rows too, before a result sink trims them
+  def UpdateRisk(self, final=False):
+    self.UpdateReturns()
+    return PortfolioManager.UpdateRisk(self, final)
+
+  # like UpdateRisk, a day goes into returns once a later one shows up
+  def UpdateReturns(self):
+    for name in self.traders:
+      self.return_index.setdefault(name, len(self.return_index))
+    self.returns.Grow(len(self.return_index))
+
+    for name, trader in self.traders.items():
+      index = self.return_index[name]
+      first, last = self.return_rows.get(name, 0), len(trader.daily_pnl)
+      for row in range(first, last):
+        date, alloc = trader.trades[row - trader.spilled_rows][0], trader.alloc[row - trader.spilled_rows]
+        if date not in self.return_days:
+          self.return_days[date] = numpy.zeros(len(self.return_index))
+        if alloc:
+          self.return_days[date][index] += trader.daily_pnl[row] / alloc
+      self.return_rows[name] = last
+
+    dates = sorted(self.return_days, key=dt.DateOrdinal)
+    for date in dates[:-1]:
+      self.AddReturns(self.return_days.pop(date))
+
+  # every trader's return of a day which is over, in order of return_index
+  def AddReturns(self, returns):
+    self.returns.Add(returns)
+
+  # :return: weights to allocate in proportion to, one per trader
+  def Weights(self, traders, factors, variances):
+    return rpar.InverseVolatilityWeights(variances)
+
+  # Recalibrate has brought returns up to date, see UpdateRisk
+  def RecalibrateAllocations(self):
+    traders_to_alloc = []
+    total_allocation = TOTAL_ALLOCATION
+
+    for trader in self.alloc:
+      if self.traders[trader].NumTradeRows() >= 2 * NUM_DAYS_TO_RECALIBRATE:
+        traders_to_alloc.append(trader)
+      else:
+        # trader has traded for inadequate amount of time, too soon to gauge performance
+        total_allocation -= self.alloc[trader]
+
+    if len(traders_to_alloc) <= 0 or self.returns.NumRows() < 2:
+      return
+
+    factors, variances = self.returns.Factors(list(self.return_index[trader] for trader in traders_to_alloc))
+    weights = self.Weights(traders_to_alloc, factors, variances)
+    allocations = rpar.CappedAllocations(weights, total_allocation, MIN_ALLOCATION, MAX_ALLOCATION)
+    self.alloc.update(zip(traders_to_alloc, allocations.tolist()))
+
+"""
+Equal risk contributions: every trader adds the same to the variance of the PM's daily pnl,
+off the shrunk covariance of the last window days of returns, see risk_parity. Newton's method
+starts off the last recalibration's solution, so a daily recalibration only takes a few steps.
+Clipping into [MIN_ALLOCATION, MAX_ALLOCATION] can leave contributions off equal for the clipped.
+With 500 traders a day takes about 1.0ms median & 1.3ms p90 on one core (bench_portfolio's
+RiskParityDaily500), not yet under 1ms: 3 to 5 Newton steps, each forming & solving a
+[window x window] system off every trader's returns.
+"""
+class RiskParityAllocPM(InverseVolatilityAllocPM):
+  def __init__(self, recal_days=RECALIBRATE_DAILY, window=rpar.DEFAULT_WINDOW, tolerance=rpar.DEFAULT_TOLERANCE):
+    InverseVolatilityAllocPM.__init__(self, recal_days, window)
+    self.style = AllocationStyle.RiskParityAlloc
+    self.tolerance = tolerance
+    self.erc_weights = {} # trader name to its weight the last time, to start the solver off
+    self.erc_workspace = {} # solver buffers, reused every day
+
+  def Weights(self, traders, factors, variances):
+    start = list(self.erc_weights.get(trader, 0.0) for trader in traders)
+    weights = rpar.EqualRiskContributionWeights(factors, variances, start=start, tolerance=self.tolerance,
+                                                workspace=self.erc_workspace)
+    self.erc_weights.update(zip(traders, weights.tolist()))
+    return weights
+
+"""
+Every trader's return over the next horizon days predicted off its own returns over the last 1, 5,
+20 & 60 days, by a linear regression per trader learnt as days close (recursive least squares, see
+online_regression), no refit on history: a recalibration costs the same on the first year as on
+the tenth. Allocations go in proportion to positive predictions over the variance of returns,
+mean variance sizing so the most volatile traders don't take everything, the rest get MIN_ALLOCATION.
+Returns are pnl per allocated dollar as InverseVolatilityAllocPM keeps them, its window is only
+as long as the features & targets need.
+"""
+class MLPredictiveAllocPM(InverseVolatilityAllocPM):
+  LOOKBACKS = [1, 5, 20, 60] # days of returns summed into each feature
+  HORIZON = 20 # days of returns predicted, about as many as there are between recalibrations
+  MIN_SAMPLES = 60 # days learnt before the predictions get used
+
+  def __init__(self, recal_days=NUM_DAYS_TO_RECALIBRATE, forgetting=orr.DEFAULT_FORGETTING, regularization=orr.DEFAULT_REGULARIZATION):
+    InverseVolatilityAllocPM.__init__(self, recal_days, window=max(self.LOOKBACKS) + self.HORIZON)
+    self.style = AllocationStyle.MLPredictiveAlloc
+    self.learner = orr.RecursiveLeastSquares(len(self.LOOKBACKS) + 1, forgetting, regularization)
+    self.days_seen = numpy.zeros(0, dtype=int) # days of returns every series has had, series added later missed some
+
+  # [num_series x num_features] features off days of returns, oldest first, the last one the newest
+  def Features(self, days):
+    sums = list(days[-lookback:].sum(axis=0) for lookback in self.LOOKBACKS)
+    return numpy.column_stack([numpy.ones(days.shape[1])] + sums)
+
+  # once a day closes the features of HORIZON days ago get their target
+  def AddReturns(self, returns):
+    InverseVolatilityAllocPM.AddReturns(self, returns)
+    self.learner.Grow(self.returns.NumSeries())
+    self.days_seen = numpy.concatenate([self.days_seen, numpy.zeros(self.returns.NumSeries() - len(self.days_seen), dtype=int)]) + 1
+
+    if self.returns.NumRows() >= self.returns.window:
+      days = self.returns.Recent(self.returns.window)
+      features, targets = self.Features(days[:-self.HORIZON]), days[-self.HORIZON:].sum(axis=0)
+      self.learner.PartialFit(features, targets, self.days_seen >= self.returns.window)
+
+  def RecalibrateAllocations(self):
+    if self.learner.NumSeries() <= 0 or self.learner.num_samples.max() < self.MIN_SAMPLES:
+      return
+    InverseVolatilityAllocPM.RecalibrateAllocations(self)
+
+  # predicted returns over variances, traders the learner hasn't seen enough of yet get 0
+  def Weights(self, traders, factors, variances):
+    self.learner.Grow(self.returns.NumSeries())
+    series = numpy.array(list(self.return_index[trader] for trader in traders))
+    predictions = self.learner.Predict(self.Features(self.returns.Recent(max(self.LOOKBACKS))))[series]
+    predictions = numpy.where(self.learner.num_samples[series] >= self.MIN_SAMPLES, numpy.maximum(predictions, 0), 0)
+    return predictions * rpar.InverseVolatilityWeights(variances) ** 2
+
+"""
+Every trader's return over the next NUM_DAYS_TO_RECALIBRATE days predicted off economic indicators &
+the last NUM_DAYS_TO_RECALIBRATE days of every trader's returns, a Lasso per trader refit at every
+recalibration on every row before it, see RecalibrateAllocations.
+Rows are 45 indicators + 28 lags of every trader's returns wide, well over a thousand columns, a
+reduction shrinks them to num_components before fitting, each trader's fit gets its own 28 lags
+back next to them since that's where most of what it can predict comes from:
+  pca:     standardized, then incremental PCA
+  random:  standardized, then a gaussian random projection (fixed, only the scaling learns)
+Both only ever learn from rows the fits can see, each recalibration feeds them the rows added since
+the last one, so nothing gets looked ahead at & keeping them up to date costs the same every time.
+"""
 class RegimePredictiveAllocPM(PortfolioManager):
-  def __init__(self):
+  def __init__(self, reduction=REGIME_REDUCTION, num_components=REGIME_COMPONENTS):
     PortfolioManager.__init__(self)
     self.style = AllocationStyle.RegimePredictiveAlloc
     self.trader_pnl_series = {}
     self.LoadIndicatorData()
+    if reduction not in REGIME_REDUCTIONS:
+      raise ValueError('unknown reduction ' + str(reduction) + ', pick from ' + str(REGIME_REDUCTIONS))
+    self.reduction = reduction
+    self.num_components = num_components
+    self.scaler, self.reducer = None, None
+    self.reduced_rows = 0 # rows of x the scaler & reducer have learnt from
+    self.x_matrix = None # x as one array, x doesn't change once it's set up
 
     # x [m x n] matrix
     # [ [d1, I11, I12, I13, I14....I1n],
@@ -358,6 +662,7 @@ class RegimePredictiveAllocPM(PortfolioManager):
     self.y = [] # one row for each date, length of row is how many strategy returns we predict
     self.y_legend = {} # trader -> index
     self.y_rev_legend = {} # index -> trader
+    self.coefficients = {} # trader -> (coefficients, intercept) of its last fit, kept with saved state
 
   def LoadIndicatorData(self):
     NUM_INDICATORS = 45
@@ -602,21 +907,33 @@ class RegimePredictiveAllocPM(PortfolioManager):
       if self.last_date_index >= len(self.all_dates):
         return
 
+    # fit on all data before today, a reduction needs as many rows as it has components to start off
+    num_rows = self.last_date_index - 1
+    if num_rows < (self.num_components if self.reduction else 2):
+      return
+
     from sklearn import linear_model
 
     print('fitting ' + str(self.last_date) + ' index: ' + str(self.last_date_index))
+    x, x_today = self.Features(num_rows)
 
     y_preds = [] # projected returns for each strategy
     # train giant model
     for reg in [linear_model.Lasso()]:
-      # fit on all data before today
       for col in range(0, len(self.y[0])):
-        x = self.x[0:self.last_date_index - 1]
-        y = list(row[col] for row in self.y[0:self.last_date_index - 1])
+        y = list(row[col] for row in self.y[0:num_rows])
+
+        trader_x, trader_x_today = x, x_today
+        if self.reduction:
+          lags = self.LagColumns(col)
+          trader_x = numpy.hstack([x, self.x_matrix[0:num_rows, lags]])
+          trader_x_today = numpy.hstack([x_today, self.x_matrix[self.last_date_index:self.last_date_index + 1, lags]])
 
-        reg.fit(x, y)
+        reg.fit(trader_x, y)
+        # with a reduction coefficients are on its components, then the trader's own lags
+        self.coefficients[self.y_rev_legend[col]] = (list(reg.coef_), reg.intercept_)
 
-        y_pred = reg.predict([self.x[self.last_date_index]])
+        y_pred = reg.predict(trader_x_today)
         y_preds.append(y_pred[0])
 
     from sklearn.metrics import explained_variance_score, mean_squared_error, r2_score
@@ -643,6 +960,42 @@ class RegimePredictiveAllocPM(PortfolioManager):
 
     print(str(self.last_date) + ' allocs: ' + str(self.alloc))
 
+  """
+  Rows to fit on & the row to predict off, reduced when there's a reduction.
+  :param num_rows: rows of x before today, the only ones the scaler & reducer get to learn from
+  :return: ([num_rows x num_features], [1 x num_features]) of x, or of its components
+  """
+  def Features(self, num_rows):
+    if self.x_matrix is None:
+      self.x_matrix = numpy.array(self.x, dtype=float)
+    if not self.reduction:
+      return self.x_matrix[0:num_rows], self.x_matrix[self.last_date_index:self.last_date_index + 1]
+
+    from sklearn import preprocessing, decomposition, random_projection
+    if self.reducer is None:
+      self.scaler = preprocessing.StandardScaler()
+      if self.reduction == 'pca':
+        self.reducer = decomposition.IncrementalPCA(self.num_components)
+      else:
+        self.reducer = random_projection.GaussianRandomProjection(self.num_components, random_state=REDUCTION_SEED)
+
+    new_rows = self.x_matrix[self.reduced_rows:num_rows]
+    if len(new_rows):
+      self.scaler.partial_fit(new_rows)
+      if self.reduction == 'pca':
+        self.reducer.partial_fit(self.scaler.transform(new_rows))
+      elif self.reduced_rows == 0:
+        self.reducer.fit(new_rows) # only takes the number of columns off them
+      self.reduced_rows = num_rows
+
+    reduced = self.reducer.transform(self.scaler.transform(self.x_matrix[0:self.last_date_index + 1]))
+    return reduced[0:num_rows], reduced[self.last_date_index:]
+
+  # columns of x with a trader's own lagged returns, every trader's come after the indicators in y's order
+  def LagColumns(self, col):
+    first = len(self.x[0]) - NUM_DAYS_TO_RECALIBRATE * (len(self.y[0]) - col)
+    return slice(first, first + NUM_DAYS_TO_RECALIBRATE)
+
   def SanityCheckList(self, l):
     import math
     for i in l:
@@ -0,0 +1,277 @@
+import sys, time, json, getopt, sqlite3, datetime
+import numpy
+import Strategies.DateDef.date_util as dt
+
+# rows handed to sqlite per executemany
+BATCH_ROWS = 50000
+
+# command line flags for run_portfolios:
+# --results=<file>           stream every trader's ledger & every PM's equity curve into a sqlite store
+# --run-name=<name>          name the run in the store (default the time it started)
+# --results-max-rows=<n>     bounded memory, traders only keep their newest n ledger rows in memory,
+#                            older ones live in the store only
+RESULT_OPTIONS = ['results=', 'run-name=', 'results-max-rows=']
+
+# every trades row is [date, side, size, price, position, pnl since inception, ...] with
+# 5 strategy specific columns on the end, e.g. vol, ma, deviation from ma, high, low for trend following
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (run_id INTEGER PRIMARY KEY, name TEXT, started TEXT, config TEXT);
+CREATE TABLE IF NOT EXISTS series (series_id INTEGER PRIMARY KEY, run_id INTEGER, pm TEXT, trader TEXT);
+CREATE INDEX IF NOT EXISTS series_by_trader ON series (run_id, trader, pm);
+CREATE TABLE IF NOT EXISTS trades (series_id INTEGER, seq INTEGER, date_ordinal INTEGER, date TEXT,
+                                   side TEXT, size REAL, price REAL, position REAL, pnl REAL, alloc REAL,
+                                   extra_1 REAL, extra_2 REAL, extra_3 REAL, extra_4 REAL, extra_5 REAL,
+                                   PRIMARY KEY (series_id, seq)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS trades_by_date ON trades (series_id, date_ordinal);
+CREATE TABLE IF NOT EXISTS pm_daily (run_id INTEGER, pm TEXT, date_ordinal INTEGER, date TEXT,
+                                     equity REAL, alloc REAL,
+                                     PRIMARY KEY (run_id, pm, date_ordinal)) WITHOUT ROWID;
+"""
+
+TRADE_COLUMNS = ['seq', 'date_ordinal', 'date', 'side', 'size', 'price', 'position', 'pnl', 'alloc',
+                 'extra_1', 'extra_2', 'extra_3', 'extra_4', 'extra_5']
+
+# datetime64[D] counts days from 1970-01-01, date ordinals from 0001-01-01
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+"""
+On-disk store of everything a run produced, one sqlite file can hold many runs.
+Ledgers get written in large batches while the replay is still going, see ResultSink,
+and can be read back by run, PM, trader & date range without rerunning anything.
+"""
+class ResultStore:
+  def __init__(self, filename, batch_rows=BATCH_ROWS):
+    self.filename = filename
+    self.batch_rows = batch_rows
+    self.connection = sqlite3.connect(filename)
+    # results can always be regenerated, trade durability for write speed
+    self.connection.execute('PRAGMA journal_mode=WAL')
+    self.connection.execute('PRAGMA synchronous=OFF')
+    self.connection.executescript(SCHEMA)
+
+    self.run_id = None
+    self.series_ids = {} # (pm, trader) -> series_id of the current run
+    self.pending = []    # trades rows waiting for the next batch
+
+  def StartRun(self, name=None, config=None):
+    started = time.strftime('%Y-%m-%d %H:%M:%S')
+    cursor = self.connection.execute('INSERT INTO runs (name, started, config) VALUES (?, ?, ?)',
+                                     (name or started, started, json.dumps(config)))
+    self.connection.commit()
+    self.run_id = cursor.lastrowid
+    self.series_ids = {}
+    return self.run_id
+
+  def SeriesId(self, pm, trader):
+    key = (pm, trader)
+    if key not in self.series_ids:
+      cursor = self.connection.execute('INSERT INTO series (run_id, pm, trader) VALUES (?, ?, ?)',
+                                       (self.run_id, pm, trader))
+      self.series_ids[key] = cursor.lastrowid
+    return self.series_ids[key]
+
+  """
+  Queue ledger rows of one trader, written once a batch worth has queued up.
+  :param first_seq: position of rows[0] in the trader's whole ledger
+  :param allocs: allocation of every row, same positions as rows
+  """
+  def AddTrades(self, pm, trader, first_seq, rows, allocs):
+    series_id = self.SeriesId(pm, trader)
+    for index, row in enumerate(rows):
+      alloc = allocs[index] if index < len(allocs) else None
+      self.pending.append((series_id, first_seq + index, dt.DateOrdinal(row[0]), row[0]) + tuple(row[1:6])
+                          + (alloc,) + tuple(row[6:11]))
+
+    if len(self.pending) >= self.batch_rows:
+      self.Flush()
+
+  def Flush(self):
+    if self.pending:
+      self.connection.executemany('INSERT OR REPLACE INTO trades VALUES (' + ','.join('?' * 15) + ')', self.pending)
+      self.pending = []
+    self.connection.commit()
+
+  # equity curve & total allocation of a PM across its dates, once AggregatePnls has run
+  def AddPMDaily(self, pm):
+    ordinals = pm.all_dates.astype('datetime64[D]').astype(numpy.int64) + EPOCH_ORDINAL
+    dates = numpy.datetime_as_string(pm.all_dates, unit='D')
+    total_alloc = pm.alloc_matrix.sum(axis=1)
+    self.connection.executemany('INSERT OR REPLACE INTO pm_daily VALUES (?, ?, ?, ?, ?, ?)',
+                                zip([self.run_id] * len(ordinals), [str(pm.style)] * len(ordinals),
+                                    ordinals.tolist(), dates.tolist(),
+                                    numpy.asarray(pm.pnl_list, dtype=float).tolist(), total_alloc.tolist()))
+    self.connection.commit()
+
+  def Close(self):
+    self.Flush()
+    self.connection.close()
+
+  # :return: list of (run_id, name, started)
+  def Runs(self):
+    return self.connection.execute('SELECT run_id, name, started FROM runs ORDER BY run_id').fetchall()
+
+  """
+  Ledger rows of a run, oldest first.
+  :param pm, trader: only these, e.g. 'AllocationStyle.UniformAlloc', 'TradingStyle.PairsTrading|['ES', 'NQ']'
+  :param start, end: dates in either format, inclusive
+  :return: list of (pm, trader) + TRADE_COLUMNS tuples
+  """
+  def Trades(self, run_id, pm=None, trader=None, start=None, end=None):
+    query = 'SELECT s.pm, s.trader, ' + ', '.join('t.' + column for column in TRADE_COLUMNS)\
+            + ' FROM series s JOIN trades t ON t.series_id = s.series_id WHERE s.run_id = ?'
+    args = [run_id]
+    for column, value in [('s.pm', pm), ('s.trader', trader)]:
+      if value is not None:
+        query += ' AND ' + column + ' = ?'
+        args.append(value)
+    query, args = self.DateRange(query, args, 't.date_ordinal', start, end)
+    return self.connection.execute(query + ' ORDER BY s.series_id, t.seq', args).fetchall()
+
+  """
+  Ledger of one trader as columns, the bulk export for analysis.
+  :return: map from column name to numpy array, dates as datetime64[D]
+  """
+  def TradeColumns(self, run_id, pm, trader, start=None, end=None):
+    rows = self.Trades(run_id, pm, trader, start, end)
+    columns = {}
+    for index, column in enumerate(TRADE_COLUMNS):
+      values = list(row[index + 2] for row in rows)
+      if column == 'date':
+        columns[column] = dt.ToDatetime64(values)
+      elif column == 'side':
+        columns[column] = numpy.array(values, dtype=str)
+      else:
+        columns[column] = numpy.array(values, dtype=float)
+    return columns
+
+  # :return: list of (date, equity, alloc) of a PM, oldest first
+  def PMDaily(self, run_id, pm, start=None, end=None):
+    query, args = self.DateRange('SELECT date, equity, alloc FROM pm_daily WHERE run_id = ? AND pm = ?',
+                                 [run_id, pm], 'date_ordinal', start, end)
+    return self.connection.execute(query + ' ORDER BY date_ordinal', args).fetchall()
+
+  def DateRange(self, query, args, column, start, end):
+    if start is not None:
+      query += ' AND ' + column + ' >= ?'
+      args.append(dt.DateOrdinal(start))
+    if end is not None:
+      query += ' AND ' + column + ' <= ?'
+      args.append(dt.DateOrdinal(end))
+    return query, args
+
+"""
+Rides along with the PMs in ReplayMarketData and every collect_every updates hands
+ledger rows the store hasn't seen yet to it. With max_rows, traders only keep their
+newest max_rows rows in memory & count the rest in trader.spilled_rows,
+RestoreTrades reads the rest back when a full ledger is needed, e.g. for summaries.
+"""
+class ResultSink:
+  def __init__(self, store, pm_list, max_rows=None, collect_every=1000):
+    self.store = store
+    self.pm_list = pm_list
+    self.max_rows = max_rows
+    self.collect_every = collect_every
+    self.num_updates = 0
+
+    self.written = {} # (pm, trader) -> rows of the whole ledger already in the store
+    self.trimmed = {} # (pm, trader) -> rows dropped from the front of trader.trades & trader.alloc
+
+  def __repr__(self):
+    return 'Result sink: ' + self.store.filename
+
+  def OnMarketDataUpdate(self, shc, date, line):
+    self.num_updates += 1
+    if self.num_updates % self.collect_every == 0:
+      self.Collect()
+
+  def Collect(self):
+    for pm in self.pm_list:
+      if self.max_rows:
+        pm.UpdateRisk() # needs the dates of rows it hasn't seen yet, before they get trimmed
+      for name, trader in pm.traders.items():
+        key = (str(pm.style), name)
+        written, trimmed = self.written.get(key, 0), self.trimmed.get(key, 0)
+        if trimmed + len(trader.trades) > written:
+          self.store.AddTrades(key[0], name, written, trader.trades[written - trimmed:],
+                               trader.alloc[written - trimmed:len(trader.trades)])
+          self.written[key] = trimmed + len(trader.trades)
+
+        if self.max_rows and len(trader.trades) > 2 * self.max_rows:
+          self.Trim(key, trader)
+
+  def Trim(self, key, trader):
+    drop = len(trader.trades) - max(self.max_rows, 2) # traders look back 2 rows
+    if drop <= 0:
+      return
+    del trader.trades[:drop]
+    del trader.alloc[:drop]
+    trader.spilled_rows += drop
+    self.trimmed[key] = self.trimmed.get(key, 0) + drop
+
+  # put back the rows Trim dropped, so the PM's traders hold their whole ledgers again
+  def RestoreTrades(self, pm):
+    self.store.Flush()
+    for name, trader in pm.traders.items():
+      key = (str(pm.style), name)
+      trimmed = self.trimmed.pop(key, 0)
+      if not trimmed:
+        continue
+
+      rows = self.store.connection.execute(
+        'SELECT date, side, size, price, position, pnl, extra_1, extra_2, extra_3, extra_4, extra_5, alloc'
+        ' FROM trades WHERE series_id = ? AND seq < ? ORDER BY seq', (self.store.SeriesId(*key), trimmed)).fetchall()
+      trader.trades[:0] = list(list(row[:11]) for row in rows)
+      trader.alloc[:0] = list(row[11] for row in rows)
+      trader.spilled_rows -= trimmed
+
+  # write whatever hasn't been yet
+  def Finish(self):
+    self.Collect()
+    self.store.Flush()
+
+def StartFromOptions(opts, pm_list):
+  opts = dict(opts)
+  if '--results' not in opts:
+    return None
+
+  store = ResultStore(opts['--results'])
+  store.StartRun(opts.get('--run-name'), sys.argv[1:])
+  return ResultSink(store, pm_list, max_rows=(int(opts['--results-max-rows']) if '--results-max-rows' in opts else None))
+
+# --results=<file>      store to read, required
+# --run=<id>            run to read (default the latest)
+# --pm=<style>          only this PM, e.g. AllocationStyle.UniformAlloc
+# --trader=<name>       only this trader, e.g. "TradingStyle.PairsTrading|['ES', 'NQ']"
+# --start=<date>        first date, either format
+# --end=<date>          last date, either format
+# --equity              print PM equity curves instead of ledgers
+# without --pm/--trader/--equity lists the runs in the store
+def main(args):
+  opts, args = getopt.getopt(args, '', ['results=', 'run=', 'pm=', 'trader=', 'start=', 'end=', 'equity'])
+  opts = dict(opts)
+  if '--results' not in opts:
+    print('ERROR need --results=<file>')
+    exit(1)
+
+  store = ResultStore(opts['--results'])
+  runs = store.Runs()
+  if not runs:
+    print('No runs in ' + opts['--results'])
+    return
+
+  run_id = int(opts.get('--run', runs[-1][0]))
+  if '--equity' in opts:
+    for pm in (list([opts['--pm']]) if '--pm' in opts else
+               list(row[0] for row in store.connection.execute('SELECT DISTINCT pm FROM pm_daily WHERE run_id = ?', (run_id,)))):
+      for date, equity, alloc in store.PMDaily(run_id, pm, opts.get('--start'), opts.get('--end')):
+        print(','.join([pm, date, str(equity), str(alloc)]))
+  elif '--pm' in opts or '--trader' in opts:
+    print(','.join(['pm', 'trader'] + TRADE_COLUMNS))
+    for row in store.Trades(run_id, opts.get('--pm'), opts.get('--trader'), opts.get('--start'), opts.get('--end')):
+      print(','.join(str(value) for value in row))
+  else:
+    for run in runs:
+      print(str(run[0]) + ' ' + run[1] + ' started ' + run[2])
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,75 @@
+import sys, os, getopt
+import Benchmarks.bench_util as bu
+import Benchmarks.bench_parsers as bench_parsers
+import Benchmarks.bench_traders as bench_traders
+import Benchmarks.bench_portfolio as bench_portfolio
+
+# times every hot path on a fixed slice of market data
+#
+# --bars=<n>          use the oldest n bars of every contract (default 1000)
+# --repeat=<n>        time allocators & aggregation n times (default 5)
+# --output=<file>     save results as json
+# --baseline=<file>   compare against a previously saved run, exit 1 on
+#                     throughput regressions or pnl changes
+# --data-root=<dir>   run on a data set written by market_data_generator
+def main(args):
+  opts, args = getopt.getopt(args, '', ['bars=', 'repeat=', 'output=', 'baseline=', 'data-root='])
+  opts = dict(opts)
+  num_bars = int(opts.get('--bars', 1000))
+  repeat = int(opts.get('--repeat', 5))
+
+  # output paths are relative to where we were started from
+  for option in ['--output', '--baseline']:
+    if option in opts:
+      opts[option] = os.path.abspath(opts[option])
+
+  shortcodes = None
+  if '--data-root' in opts:
+    shortcodes = bu.UseSyntheticData(opts['--data-root'])
+
+  print('\nLoading fixed benchmark input...')
+  shc_market_data_lines = bu.LoadFixedMarketData(num_bars, shortcodes)
+  bars = bu.ReplayOrder(shc_market_data_lines)
+  print(end='\n')
+
+  results = {'bars': len(bars), 'benchmarks': {}}
+
+  print('\nTiming parsers & date utilities...')
+  results['benchmarks'].update(bench_parsers.Run(bars))
+
+  print('\nTiming traders...')
+  results['benchmarks'].update(bench_traders.Run(bars))
+
+  print('\nTiming portfolio managers, allocators, replay & aggregation...')
+  pm_results, results['equivalence'] = bench_portfolio.Run(shc_market_data_lines, bars, repeat)
+  results['benchmarks'].update(pm_results)
+
+  print('\n    ' + format('Benchmark', '45s')
+        + ' ' + format('bars/sec', '>12s')
+        + ' ' + format('p50(us)', '>10s')
+        + ' ' + format('p99(us)', '>10s')
+        + ' ' + format('seconds', '>10s'))
+  for name in sorted(results['benchmarks']):
+    result = results['benchmarks'][name]
+    print('    ' + format(name, '45s')
+          + ' ' + format(result['bars_per_sec'], '12.1f')
+          + ' ' + format(result['p50_us'], '10.1f')
+          + ' ' + format(result['p99_us'], '10.1f')
+          + ' ' + format(result['seconds'], '10.3f'))
+
+  if '--output' in opts:
+    bu.SaveResults(results, opts['--output'])
+    print('\nSaved results to ' + opts['--output'])
+
+  if '--baseline' in opts:
+    print('\nComparing against ' + opts['--baseline'] + '...')
+    regressions, mismatches = bu.CompareResults(results, bu.LoadResults(opts['--baseline']))
+    if regressions:
+      print('Slower than baseline: ' + str(regressions))
+    if mismatches:
+      print('Results changed: ' + str(mismatches))
+    if regressions or mismatches:
+      exit(1)
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,63 @@
+import sys, getopt, asyncio, concurrent.futures
+import Strategies.Plots.plots as plt
+import Strategies.PerfUtil.perf_util as pf
+import live_feed as lf
+import run_portfolios as rp
+import trader_bank as tb
+
+# run the PMs off a live feed instead of replaying files
+#
+# --connect=<address>   take bars from tcp:<host>:<port>, unix:<path> or tail:<file>
+# --serve=<address>     play MarketData/csvs as a feed at tcp:<host>:<port> or unix:<path> for others to connect to
+#                       without either, play MarketData/csvs through an in-process queue
+# --rate=<n>            simulated feed sends n bars per second (default as fast as the PMs take them)
+# --bars=<n>            simulated feed only plays the oldest n bars of every contract
+# --flush-after=<s>     let a bar go after s seconds even if some contract hasn't reached its date
+# --recal-workers=<n>   threads recalibrating allocations (default 1 per PM)
+#
+# regime PMs need the uniform PM's whole history up front, so they can't run live
+def main(args):
+  options = plt.RENDER_OPTIONS + pf.PERF_OPTIONS + tb.BANK_OPTIONS + ['connect=', 'serve=', 'rate=', 'bars=', 'flush-after=', 'recal-workers=']
+  opts, args = getopt.getopt(args, '', options)
+  plt.SetRenderModeFromOptions(opts)
+  pf.SetEnabledFromOptions(opts)
+  banks = tb.BanksFromOptions(opts)
+  opts = dict(opts)
+
+  simulator = lf.FeedSimulator(rp.indep_shortcode_list,
+                               rate=(float(opts['--rate']) if '--rate' in opts else None),
+                               num_bars=(int(opts['--bars']) if '--bars' in opts else None))
+  if '--serve' in opts:
+    asyncio.run(simulator.Serve(opts['--serve']))
+    return
+
+  print('\nInitializing Portfolio Managers...')
+  pm_list, regime_pm = rp.InitializePMs(banks=banks)
+  for pm in pm_list:
+    print(pm)
+
+  executor = concurrent.futures.ThreadPoolExecutor(max_workers=int(opts.get('--recal-workers', len(pm_list))))
+  feed = lf.LiveFeed(pm_list, rp.indep_shortcode_list, executor,
+                     flush_after=(float(opts['--flush-after']) if '--flush-after' in opts else None))
+
+  print('\nRunning sims off the live feed...')
+  asyncio.run(RunFeed(feed, simulator, opts.get('--connect')))
+  executor.shutdown()
+
+  print('\nEnd to end latency, feed to PM...')
+  feed.PrintStats()
+
+  print('\nSummarizing portfolio manager stats...')
+  for pm in pm_list:
+    pm.SummarizePerformance(plot=False)
+
+async def RunFeed(feed, simulator, address):
+  if address:
+    await feed.Run(lf.OpenSource(address))
+    return
+
+  bar_queue = asyncio.Queue(maxsize=lf.MAX_QUEUED_BARS)
+  await asyncio.gather(simulator.Play(bar_queue), feed.Run(lf.QueueSource(bar_queue)))
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
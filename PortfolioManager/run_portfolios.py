@@ -1,8 +1,19 @@
-import sys, getopt, statistics
+import sys, time, glob, getopt, heapq, itertools, statistics, functools
 import Strategies.ContractDef.contract_info as ci
 import Strategies.FileUtil.file_parser as fp
+import Strategies.FileUtil.prefetch as pfch
+import Strategies.FileUtil.shared_data as shd
 import Strategies.DateDef.date_util as dt
 import Strategies.Plots.plots as plt
+import Strategies.PerfUtil.perf_util as pf
+import Strategies.PerfUtil.profiler as prof
+import Strategies.PerfUtil.memory as mem
+import Strategies.PnlUtil.bootstrap as bs
+import engine_state as es
+import result_store as rs
+import trader_bank as tb
+import Strategies.CacheUtil.run_cache as rc
+import parallel_replay as pr
 
 from trader import *
 from portfolio_manager import *
@@ -53,26 +64,38 @@ shortcode_relative = [
   ['ZW', 'ZC']  # wheat using corn
 ]
 
-portfolio_managers_list = [UniformAllocPM, IndividualPnlAllocPM, IndividualSharpeAllocPM, MarkowitzAllocPM]
+portfolio_managers_list = [UniformAllocPM, IndividualPnlAllocPM, IndividualSharpeAllocPM, MarkowitzAllocPM, MLPredictiveAllocPM]
 # portfolio_managers_list = [UniformAllocPM, RegimePredictiveAllocPM]
+# portfolio_managers_list = [UniformAllocPM, InverseVolatilityAllocPM, RiskParityAllocPM] # recalibrate daily
 trader_list = [TrendFollowTrader, MeanReversionTrader, RelativeValueTrader, PairsTrader]
 
+# which contracts every trader style gets to trade & with what parameters
+trader_contracts = {TrendFollowTrader: indep_shortcode_list,
+                    MeanReversionTrader: indep_shortcode_list,
+                    RelativeValueTrader: shortcode_relative,
+                    PairsTrader: shortcode_pairs}
+trader_params = {TrendFollowTrader: {'log_level': 0, 'loss_ticks': 0.1, 'net_change': 0.25},
+                 MeanReversionTrader: {'log_level': 0, 'loss_ticks': 0.2, 'net_change': 0.75},
+                 RelativeValueTrader: {'log_level': 0, 'loss_ticks': 0.2, 'net_change': 0.75, 'min_correlation': 0.65},
+                 PairsTrader: {'log_level': 0, 'loss_ticks': 0.2, 'net_change': 0.75}}
+
+# every possible trader x contract pair, fresh, in the order PMs get them
+def NewTraders():
+  traders = []
+  for trader_type in trader_list:
+    strategy_param = trader_params[trader_type]
+
+    for contract in trader_contracts[trader_type]:
+      traders.append(trader_type(contract, strategy_param))
+  return traders
+
 # create an instance of every portfolio manager style known to us
 # for each one of those instances, add every possible trader x contract pairs
 # return a list of all the instances created
-def InitializePMs():
+# :param banks: step trend following & mean reversion traders in banks, see trader_bank
+def InitializePMs(pm_types=None, banks=True):
   pm_list, regime_pm = [], []
-  contracts = {TrendFollowTrader: indep_shortcode_list,
-               MeanReversionTrader: indep_shortcode_list,
-               RelativeValueTrader: shortcode_relative,
-               PairsTrader: shortcode_pairs}
-  tfd = {'log_level': 0, 'loss_ticks': 0.1, 'net_change': 0.25}
-  mrd = {'log_level': 0, 'loss_ticks': 0.2, 'net_change': 0.75}
-  ptd = {'log_level': 0, 'loss_ticks': 0.2, 'net_change': 0.75}
-  rvd = {'log_level': 0, 'loss_ticks': 0.2, 'net_change': 0.75, 'min_correlation': 0.65}
-  strategy_params = {TrendFollowTrader: tfd, MeanReversionTrader: mrd, RelativeValueTrader: rvd, PairsTrader: ptd}
-
-  for pm_type in portfolio_managers_list:
+  for pm_type in (pm_types or portfolio_managers_list):
     pm = pm_type()
     if pm.style == AllocationStyle.RegimePredictiveAlloc:
       regime_pm.append(pm)
@@ -80,126 +103,327 @@ def InitializePMs():
       pm_list.append(pm)
     # print('\n' + '>' * 5 + ' ' + str(pm))
 
-    for trader_type in trader_list:
-      strategy_param = strategy_params[trader_type]
+    for trader in NewTraders():
+      pm.AddTrader(trader)
+      # print('>' * 10 + ' ' + str(trader))
 
-      for contract in contracts[trader_type]:
-        trader = trader_type(contract, strategy_param)
-        pm.AddTrader(trader)
-        # print('>' * 10 + ' ' + str(trader))
+    if banks:
+      pm.BankTraders()
 
     # print('>' * 5 + ' Finished with ' + str(pm))
+    pf.InstrumentPM(pm)
 
   return pm_list, regime_pm
 
 # open every market data file and read contents in chrono order
 # maintain indices to last line in each list, start at 0
 # fudge list of data for every contract so every list has exactly the
-def LoadMarketDataLines(shc_market_data_lines, shc_market_line_index):
-  for shc in indep_shortcode_list:
+def LoadMarketDataLines(shc_market_data_lines, shc_market_line_index, shortcodes=None):
+  for shc in (shortcodes or indep_shortcode_list):
     filename = 'MarketData/csvs/market_data_' + shc + '.csv'
-    shc_market_data_lines[shc] = list(reversed(list(open(filename, 'r'))))
+    shc_market_data_lines[shc] = list(fp.ReadLinesOldestFirst(filename))
     shc_market_line_index[shc] = 0
 
     print('Loaded:' + shc + ' from:' + filename + ' lines:' + str(len(shc_market_data_lines[shc])))
 
-# check last indexed row of each contract and find out which is the oldest update
-def FindOldestDate(shc_market_data_lines, shc_market_line_index):
-  last_date = None
-  for shc in shc_market_data_lines.keys():
-    contract = ci.ContractInfoDatabase[shc]
-    line = shc_market_data_lines[shc][shc_market_line_index[shc]]
-    date = fp.TokenizeToDate(contract, line)
-    if (not last_date) or (dt.CompareDates(date, last_date) < 0):
-      last_date = date
+# same as LoadMarketDataLines without reading anything up front,
+# every contract gets a stream of lines in chrono order which can only be replayed once.
+# with a prefetcher the files get read & parsed on its threads while we replay,
+# with a cursor only lines newer than the contract's cursor get read
+# with shared data, a shd.SharedMarketData, nothing gets read at all
+def OpenMarketDataStreams(shc_market_data_lines, shortcodes=None, prefetcher=None, cursor=None, shared_data=None):
+  for shc in (shortcodes or indep_shortcode_list):
+    filename = 'MarketData/csvs/market_data_' + shc + '.csv'
+    if shared_data:
+      shc_market_data_lines[shc] = shared_data.Stream(shc, (cursor or {}).get(shc))
+    elif cursor and shc in cursor:
+      shc_market_data_lines[shc] = fp.ReadLinesNewerThan(filename, ci.ContractInfoDatabase[shc], cursor[shc])
+    elif prefetcher:
+      shc_market_data_lines[shc] = prefetcher.Open(ci.ContractInfoDatabase[shc], filename)
+    else:
+      shc_market_data_lines[shc] = fp.ReadLinesOldestFirst(filename)
 
-  return last_date
+# chrono order (date, line) pairs of one contract, starting at line index
+def MarketDataStream(shc, lines, index):
+  if isinstance(lines, (pfch.PrefetchedStream, shd.SharedStream)):
+    return iter(lines) # dates already parsed
+
+  contract = ci.ContractInfoDatabase[shc]
+  if isinstance(lines, list):
+    lines = itertools.islice(lines, index, len(lines) - 1) # -1 because of header in input
+  return ((fp.TokenizeToDate(contract, line), line) for line in lines)
 
 # start from oldest date first,
 # then play back each update in chronological order
 # from list for every contract.
+# updates on the same date go out in contract order, e.g. ES before NQ.
 # for every update portfolio manager with the market update
-def ReplayMarketData(shc_market_data_lines, shc_market_line_index, pm_list):
+# shc_market_data_lines can hold lists (from LoadMarketDataLines) or
+# streams (from OpenMarketDataStreams), lists get replayed from shc_market_line_index.
+# cursor maps contracts to the date ordinal of the last bar replayed, bars on or
+# before it are skipped and it gets moved forward as we go
+def ReplayMarketData(shc_market_data_lines, shc_market_line_index, pm_list, cursor=None):
   print('Running sims for ' + str(pm_list))
 
-  # oldest date
-  last_date = FindOldestDate(shc_market_data_lines, shc_market_line_index)
-  line_num = 0
-
-  while True:
-    if not last_date:
-      break
-
-    next_line = None
-    next_shc = None
-    next_date = last_date
+  # k-way merge, the heap holds the next update of every contract keyed on (date, contract order)
+  streams, next_updates = [], []
+  for order, shc in enumerate(shc_market_data_lines.keys()):
+    streams.append(MarketDataStream(shc, shc_market_data_lines[shc], (shc_market_line_index or {}).get(shc, 0)))
+    PushNextUpdate(next_updates, streams, order, shc)
 
-    for shc in shc_market_data_lines.keys():
-      if shc_market_line_index[shc] >= len(shc_market_data_lines[shc]) - 1: # -1 because of header in input
-        # print('reached end of stream for ' + shc + ' skipping.')
+  line_num = 0
+  progress = pf.Progress('replayed', sum(len(lines) - 1 - (shc_market_line_index or {}).get(shc, 0)
+                                         for shc, lines in shc_market_data_lines.items() if isinstance(lines, list)))
+  # time spent picking the next update, excluding what the PMs do with it,
+  # one counter per phase so the replays of one run, e.g. the regime PM's second pass, don't add up
+  scheduler = pf.GetCounter('replay.scheduler ' + pf.PhaseName()) if pf.ENABLED else None
+  start = time.perf_counter_ns() if scheduler else 0
+
+  # updates of one day go to the PMs together, so trader banks can step through the day at once
+  day, day_ordinal = [], None
+  while next_updates:
+    ordinal, order, next_shc, next_date, next_line = heapq.heappop(next_updates)
+    PushNextUpdate(next_updates, streams, order, next_shc)
+    if cursor is not None:
+      if ordinal <= cursor.get(next_shc, 0):
         continue
+      cursor[next_shc] = ordinal
 
-      contract = ci.ContractInfoDatabase[shc]
-      line = shc_market_data_lines[shc][shc_market_line_index[shc]]
-      date = fp.TokenizeToDate(contract, line)
-      # print('comparing ' + shc + ' date:' + date + ' & next_date:' + next_date)
-
-      if dt.CompareDates(next_date, date) >= 0:
-        next_line, next_shc, last_date, next_date = line, shc, date, date
-        shc_market_line_index[shc] = shc_market_line_index[shc] + 1
-        break
+    if day and ordinal != day_ordinal:
+      if scheduler:
+        scheduler.Add(time.perf_counter_ns() - start)
+      DispatchDay(pm_list, day)
+      if scheduler:
+        start = time.perf_counter_ns()
+      day = []
+    day.append((next_shc, next_date, next_line))
+    day_ordinal = ordinal
 
-    if not next_shc:
-      last_date = FindOldestDate(shc_market_data_lines, shc_market_line_index)
-      continue
+    line_num += 1
+    if line_num % 1000 == 0:
+      progress.Update(line_num)
 
-    for pm in pm_list:
-      pm.OnMarketDataUpdate(next_shc, next_date, next_line)
+  if day:
+    DispatchDay(pm_list, day)
 
-    # print('next_line: ' + next_line.strip() + ' next_shc: ' + next_shc + ' last_date: ' + last_date)
-    # print(shc_market_line_index)
+  progress.Finish(line_num)
+  if scheduler:
+    pf.PrintCounters([scheduler])
 
   for shc in shc_market_data_lines.keys():
-    shc_market_line_index[shc] = 0
+    if isinstance(shc_market_data_lines[shc], list) and shc_market_line_index is not None:
+      shc_market_line_index[shc] = 0
 
-if __name__ == '__main__':
-  print('\nInitializing Portfolio Managers...')
-  # a list of our portfolio manager competing against each other
-  pm_list, regime_pm = InitializePMs()
+# hand one day's updates to every PM, in order, anything else which takes
+# updates, e.g. a ResultSink, gets them one at a time
+def DispatchDay(pm_list, day):
   for pm in pm_list:
-    print(pm)
-  for pm in regime_pm:
-    print(pm)
+    if hasattr(pm, 'OnMarketDataDay'):
+      pm.OnMarketDataDay(day)
+    else:
+      for shc, date, line in day:
+        pm.OnMarketDataUpdate(shc, date, line)
+
+# queue up the next line of a contract which has a date, skipping the header & malformed lines
+def PushNextUpdate(next_updates, streams, order, shc):
+  for date, line in streams[order]:
+    if date:
+      heapq.heappush(next_updates, (dt.DateOrdinal(date), order, shc, date, line))
+      return
+
+# replay everything from the first bar, regime PMs need a second pass
+# once the uniform PM's returns are known
+# :param result_sink: rs.ResultSink to stream ledgers to while replaying
+# :param workers: run pm_list's traders in these many processes, see parallel_replay,
+#                 a result sink only gets the ledgers once they're back
+# :return: replay cursor, see ReplayMarketData
+def ReplayFromScratch(pm_list, regime_pm, prefetcher=None, result_sink=None, workers=None):
+  sinks = [result_sink] if result_sink else []
+  shc_market_data_lines, cursor = {}, {} # this is a map from contract name to market data lines
+  with pf.Phase('replay'):
+    print('\nPlaying data and running sims...')
+    if workers:
+      cursor = pr.ParallelReplay(pm_list, workers, any(pm.banks for pm in pm_list))
+    else:
+      # every contract's file gets streamed in chrono order while we replay,
+      # nothing is read up front, the prefetcher reads ahead in the background
+      OpenMarketDataStreams(shc_market_data_lines, prefetcher=prefetcher)
+      ReplayMarketData(shc_market_data_lines, None, pm_list + sinks, cursor)
+    print(end='\n')
+
+  if regime_pm:
+    ReplayRegime(pm_list, regime_pm, prefetcher, result_sink)
 
-  print('\nLoading up market data files...')
-  # open every market data file and read data
+  return cursor
+
+# second pass of the regime PMs, set up off the uniform PM's returns, over every bar from the first
+def ReplayRegime(pm_list, regime_pm, prefetcher=None, result_sink=None):
+  sinks = [result_sink] if result_sink else []
+  with pf.Phase('regime-setup'):
+    for pm in pm_list:
+      if pm.style == AllocationStyle.UniformAlloc:
+        if result_sink:
+          result_sink.RestoreTrades(pm) # needs the whole ledger
+        regime_pm[0].SetUniformReturns(pm.traders)
+        break
+
+  with pf.Phase('regime-replay'):
+    shc_market_data_lines = {}
+    OpenMarketDataStreams(shc_market_data_lines, prefetcher=prefetcher)
+    ReplayMarketData(shc_market_data_lines, None, regime_pm + sinks)
+    print(end='\n')
+
+# ReplayFromScratch, or the PMs it ended up with the last time it ran on the same data, setup & code
+# :return: (pm_list, regime_pm, cursor), the PMs are new objects on a hit
+def CachedReplayFromScratch(run_cache, pm_list, regime_pm, prefetcher=None, result_sink=None, workers=None):
+  data_files = list('MarketData/csvs/market_data_' + shc + '.csv' for shc in indep_shortcode_list)
+  if regime_pm:
+    data_files += sorted(glob.glob('IndicatorData/csvs/*.csv'))
+  setup = {'pms': list(type(pm) for pm in pm_list + regime_pm), 'traders': trader_list,
+           'banks': any(pm.banks for pm in pm_list + regime_pm),
+           'contracts': {trader_type.__name__: trader_contracts[trader_type] for trader_type in trader_list},
+           'params': {trader_type.__name__: trader_params[trader_type] for trader_type in trader_list}}
+
+  description = run_cache.Description('run_portfolios', data_files, setup)
+  key = rc.DescriptionKey(description)
+  hit, state = run_cache.Get(key)
+  if hit:
+    state = es.RestoreState(state, 'run cache entry ' + key)
+  if hit and state:
+    print('\nReusing results of an identical earlier run, cache entry ' + key)
+    pm_list, regime_pm, cursor = state
+    if result_sink:
+      result_sink.pm_list = pm_list + regime_pm
+      result_sink.Collect()
+    return pm_list, regime_pm, cursor
+
+  cursor = ReplayFromScratch(pm_list, regime_pm, prefetcher, result_sink, workers)
+  if result_sink:
+    for pm in pm_list + regime_pm:
+      result_sink.RestoreTrades(pm) # cache whole ledgers
+  run_cache.Put(key, es.DumpState(pm_list, regime_pm, cursor), description)
+  return pm_list, regime_pm, cursor
+
+# resumed PMs are all set up already, bars newer than the cursor go to them in one pass.
+# the regime PM can't carry on: its matrices & fits are off the uniform PM's whole history, which
+# the new bars change, so it's replaced in regime_pm by a new one set up & replayed from the first
+# bar like ReplayFromScratch does
+def ReplayNewBars(pm_list, regime_pm, cursor, result_sink=None):
   shc_market_data_lines = {} # this is a map from contract name to market data lines
-  shc_market_line_index = {} # this is a map from contract name to last read index
-  LoadMarketDataLines(shc_market_data_lines, shc_market_line_index)
+  sinks = [result_sink] if result_sink else []
+  if result_sink:
+    result_sink.pm_list = list(pm_list) # the old regime PM's ledgers never get stored
+  with pf.Phase('replay'):
+    print('\nPlaying new data and running sims...')
+    OpenMarketDataStreams(shc_market_data_lines, cursor=cursor)
+    ReplayMarketData(shc_market_data_lines, None, pm_list + sinks, cursor)
+    print(end='\n')
+
+  if regime_pm:
+    old = regime_pm[0]
+    pm_type = functools.partial(type(old), reduction=old.reduction, num_components=old.num_components)
+    regime_pm[:] = InitializePMs([pm_type], banks=bool(old.banks))[1]
+    if result_sink:
+      result_sink.pm_list = pm_list + regime_pm
+    ReplayRegime(pm_list, regime_pm, result_sink=result_sink)
 
-  print('\nPlaying data and running sims...')
-  ReplayMarketData(shc_market_data_lines, shc_market_line_index, pm_list)
-  print(end='\n')
-  for pm in pm_list:
-    if pm.style == AllocationStyle.UniformAlloc:
-      regime_pm[0].SetUniformReturns(pm.traders)
-      break
-  ReplayMarketData(shc_market_data_lines, shc_market_line_index, regime_pm)
-  pm_list.append(regime_pm[0])
-  print(end='\n')
-
-  print('\nSummarizing portfolio manager stats...')
-  # summarize one pm at a time, that will summarize strats under management one at a time
-  all_dates, pm_pnl_list, std_mean = [], {}, []
-  for pm in pm_list:
-    pm.SummarizePerformance()
-    if len(all_dates) <= 0:
-      all_dates = pm.all_dates
+if __name__ == '__main__':
+  options = plt.RENDER_OPTIONS + pf.PERF_OPTIONS + prof.PROFILE_OPTIONS + mem.MEMORY_OPTIONS + pfch.PREFETCH_OPTIONS\
+            + es.STATE_OPTIONS + rs.RESULT_OPTIONS + rc.CACHE_OPTIONS + tb.BANK_OPTIONS\
+            + pr.PARALLEL_OPTIONS + bs.BOOTSTRAP_OPTIONS
+  opts, args = getopt.getopt(sys.argv[1:], '', options)
+  plt.SetRenderModeFromOptions(opts)
+  pf.SetEnabledFromOptions(opts)
+  profiler = prof.StartFromOptions(opts, pf.phase_listeners)
+  memory = mem.StartFromOptions(opts, pf.phase_listeners)
+  prefetcher = pfch.PrefetcherFromOptions(opts)
+  banks = tb.BanksFromOptions(opts)
+  workers = pr.WorkersFromOptions(opts)
+  bs.SetFromOptions(opts)
+  opts = dict(opts)
+
+  with pf.Phase('load'):
+    if '--load-state' in opts:
+      print('\nResuming Portfolio Managers...')
+      state = es.LoadState(opts['--load-state'])
+      if not state:
+        exit(1)
+      pm_list, regime_pm, cursor = state
+    else:
+      print('\nInitializing Portfolio Managers...')
+      # a list of our portfolio manager competing against each other
+      pm_list, regime_pm = InitializePMs(banks=banks)
 
-    std_mean.append([pm.stdev_pnl, pm.avg_pnl, str(pm)])
+    for pm in pm_list:
+      print(pm)
+    for pm in regime_pm:
+      print(pm)
+
+  result_sink = rs.StartFromOptions(opts, pm_list + regime_pm)
+  run_cache = rc.CacheFromOptions(opts)
+  if '--load-state' in opts:
+    ReplayNewBars(pm_list, regime_pm, cursor, result_sink)
+  elif run_cache:
+    pm_list, regime_pm, cursor = CachedReplayFromScratch(run_cache, pm_list, regime_pm, prefetcher, result_sink, workers)
+  else:
+    cursor = ReplayFromScratch(pm_list, regime_pm, prefetcher, result_sink, workers)
+
+  if '--save-state' in opts:
+    with pf.Phase('save-state'):
+      if result_sink:
+        for pm in pm_list + regime_pm:
+          result_sink.RestoreTrades(pm) # resuming needs whole ledgers
+      es.SaveState(opts['--save-state'], pm_list, regime_pm, cursor)
+
+  if '--verify-state' in opts and '--load-state' in opts:
+    with pf.Phase('verify-state'):
+      print('\nVerifying resumed state against a replay from scratch...')
+      if result_sink:
+        for pm in pm_list + regime_pm:
+          result_sink.RestoreTrades(pm) # compared on whole ledgers
+      reference_pm_list, reference_regime_pm = InitializePMs(banks=banks)
+      ReplayFromScratch(reference_pm_list, reference_regime_pm, prefetcher)
+      mismatches = es.CompareEngines(pm_list + regime_pm, reference_pm_list + reference_regime_pm)
+      if mismatches:
+        print('ERROR resumed state differs from a replay from scratch: ' + str(mismatches))
+        exit(1)
+      print('Resumed state matches a replay from scratch')
+
+  pm_list = pm_list + regime_pm
+  with pf.Phase('summary'):
+    print('\nSummarizing portfolio manager stats...')
+    # summarize one pm at a time, that will summarize strats under management one at a time
+    all_dates, pm_pnl_list, std_mean = [], {}, []
+    for pm in pm_list:
+      if result_sink:
+        result_sink.RestoreTrades(pm)
+      pm.SummarizePerformance(plot=False)
+      if result_sink:
+        result_sink.store.AddPMDaily(pm)
+        result_sink.Collect() # trims the ledgers again
+      if len(all_dates) <= 0:
+        all_dates = pm.all_dates
+
+      std_mean.append([pm.stdev_pnl, pm.avg_pnl, str(pm)])
 
-    pm_pnl_list[str(pm)] = pm.pnl_list
+      pm_pnl_list[str(pm)] = pm.pnl_list
+    pf.PrintGlobalCounters()
 
-  print('\nComparing portfolio managers...')
-  plt.ComparePlots(all_dates, pm_pnl_list)
-  plt.PlotEfficientFrontierPlot(std_mean)
+  with pf.Phase('plots'):
+    for pm in pm_list:
+      pm.PlotAllocationsAndPnls()
+
+    print('\nComparing portfolio managers...')
+    plt.ComparePlots(all_dates, pm_pnl_list)
+    plt.PlotEfficientFrontierPlot(std_mean)
+    plt.WaitForRenders()
+
+  if prefetcher:
+    prefetcher.Shutdown()
+  if result_sink:
+    result_sink.Finish()
+    result_sink.store.Close()
+    print('\nSaved results to ' + result_sink.store.filename + ' run ' + str(result_sink.store.run_id))
+
+  mem.FinishFromOptions(memory, pm_list)
+  prof.FinishFromOptions(profiler)
@@ -0,0 +1,334 @@
+import sys, getopt
+import numpy
+import Strategies.DateDef.date_util as dt
+import Strategies.PerfUtil.perf_util as pf
+import Strategies.SyntheticData.scenario_generator as sg
+import trader_bank as tb
+import run_portfolios as rp
+from portfolio_manager import *
+
+DEFAULT_SCENARIOS = 1000
+DEFAULT_PMS = [UniformAllocPM, IndividualPnlAllocPM, IndividualSharpeAllocPM, IndividualSortinoAllocPM]
+PERCENTILES = [5, 50, 95]
+
+# command line flags:
+# --scenarios=<n>            perturbed histories replayed together (default 1000)
+# --kinds=<a,b>              scenario kinds, scenarios take turns, see scenario_generator (default history,bootstrap,vol,gaps)
+# --seed=<n>                 same seed same scenarios
+# --block=<days>             calendar days per bootstrapped block (default 20)
+# --pms=<PM>,<PM>,..         PM classes to stress, e.g. UniformAllocPM,IndividualSharpeAllocPM, see SCENARIO_ALLOCATORS
+# --fill-stops-at-stop       stops fill at their stop price even on bars which opened past it, like the traders'
+#                            own do, history scenarios then match a normal replay, gaps scenarios show no gap risk
+SCENARIO_OPTIONS = ['scenarios=', 'kinds=', 'seed=', 'block=', 'pms=', 'fill-stops-at-stop']
+
+"""
+A TraderBank's traders in every scenario at once: windows, positions, vwaps & pnls carry a
+leading scenario axis & one tb.Decide steps all of them. Scenarios share bar dates, so which
+traders are ready & how many rows they have is the same in every scenario. No ledgers are kept,
+every step hands back the daily pnl of the traders which traded.
+Stops on bars which opened past the stop price fill at the open unless gap_fills is off, so
+history scenarios differ from a normal replay on exactly those stops.
+"""
+class ScenarioBank:
+  def __init__(self, bank, num_scenarios, gap_fills=True):
+    self.gap_fills = gap_fills
+    self.names = bank.names
+    self.style = bank.style
+    self.window = bank.window
+    self.instances = bank.instances
+    self.tick_values, self.o_loss_ticks, self.o_net_change = bank.tick_values, bank.o_loss_ticks, bank.o_net_change
+
+    shape = (num_scenarios, len(self.names))
+    self.ranges = numpy.zeros(shape + (self.window,))
+    self.closes = numpy.zeros(shape + (self.window,))
+    self.num_bars = numpy.zeros(len(self.names), dtype=numpy.int64)
+
+    self.position = numpy.zeros(shape)
+    self.vwap = numpy.zeros(shape)
+    self.pnl = numpy.zeros(shape)
+    self.last_row_pnl = numpy.zeros(shape)
+    self.has_rows = numpy.zeros(len(self.names), dtype=bool)
+
+  """
+  :param bars: [num_scenarios x len(instances) x 4] open, high, low, close of every instance's contract
+  :param risk_dollars: [num_scenarios x len(instances)]
+  :return: (instances which traded, their daily pnl [num_scenarios x len(those)])
+  """
+  def Step(self, instances, bars, risk_dollars):
+    opens, highs, lows, closes = bars[:, :, 0], bars[:, :, 1], bars[:, :, 2], bars[:, :, 3]
+    slots = self.num_bars[instances] % self.window
+    self.ranges[:, instances, slots] = highs - lows
+    self.closes[:, instances, slots] = closes
+    self.num_bars[instances] += 1
+
+    # not initialized yet, nothing more to do than push
+    ready = self.num_bars[instances] >= self.window
+    if not ready.all():
+      instances, opens, highs, lows, closes, risk_dollars = (instances[ready], opens[:, ready], highs[:, ready], lows[:, ready],
+                                                             closes[:, ready], risk_dollars[:, ready])
+      if len(instances) <= 0:
+        return instances, numpy.zeros((len(bars), 0))
+
+    ma = self.closes[:, instances].sum(axis=2) / self.window
+    vol = self.ranges[:, instances].sum(axis=2) / self.window
+    step = tb.Decide(self.style, self.position[:, instances], self.vwap[:, instances], self.pnl[:, instances],
+                     self.last_row_pnl[:, instances], self.has_rows[instances], self.o_loss_ticks[instances],
+                     self.o_net_change[instances], self.tick_values[instances], ma, vol, highs, lows, closes, risk_dollars,
+                     opens=(opens if self.gap_fills else None))
+
+    self.position[:, instances] = step['position']
+    self.vwap[:, instances] = step['vwap']
+    self.pnl[:, instances] = step['pnl']
+    self.last_row_pnl[:, instances] = step['row_pnl']
+    self.has_rows[instances] = True
+    return instances, step['daily_pnl']
+
+"""
+A PM with its banked traders in every scenario at once, allocations & every trader's daily pnl
+statistics are [num_scenarios x num_traders], recalibration runs on the same dates as the PM's
+& allocates like it, see SCENARIO_ALLOCATORS. The PM's own daily pnl across its traders runs
+into its final pnl, Sharpe & max drawdown in every scenario, see Results.
+Only banked traders have a scenario axis, the rest of the PM's traders sit it out.
+"""
+class ScenarioPM:
+  def __init__(self, pm, num_scenarios, gap_fills=True):
+    self.style = pm.style
+    self.allocate = SCENARIO_ALLOCATORS[type(pm)]
+    self.banks = list(ScenarioBank(bank, num_scenarios, gap_fills) for bank in pm.banks)
+    self.skipped = list(pm.unbanked)
+    self.names = list(name for bank in self.banks for name in bank.names)
+    self.offsets = list(numpy.cumsum([0] + list(len(bank.names) for bank in self.banks))[:-1])
+
+    shape = (num_scenarios, len(self.names))
+    self.alloc = numpy.full(shape, float(FIRST_ALLOCATION))
+    self.last_recal_date = None
+
+    # every trader's daily pnl, running mean & sum of squared deviations, also of its downside
+    self.num_rows = numpy.zeros(len(self.names), dtype=numpy.int64)
+    self.mean, self.m2 = numpy.zeros(shape), numpy.zeros(shape)
+    self.down_mean, self.down_m2 = numpy.zeros(shape), numpy.zeros(shape)
+
+    # the PM's daily pnl, days count once any trader traded on them
+    self.day_pnl = numpy.zeros(num_scenarios)
+    self.day_has_rows = False
+    self.num_days = 0
+    self.day_mean, self.day_m2 = numpy.zeros(num_scenarios), numpy.zeros(num_scenarios)
+    self.equity, self.high_water, self.max_drawdown = numpy.zeros(num_scenarios), numpy.zeros(num_scenarios), numpy.zeros(num_scenarios)
+
+  def __str__(self):
+    return 'Scenario portfolio manager: ' + str(self.style) + '|' + str(len(self.names))
+
+  # PortfolioManager.OnMarketDataDay, bars are (shc, [num_scenarios x 4] or None if it doesn't parse)
+  def OnMarketDataDay(self, date, bars):
+    # only the day's first update can be due for a recalibration, the rest have to see its allocations
+    if self.last_recal_date and dt.NumDaysBetween(self.last_recal_date, date) >= NUM_DAYS_TO_RECALIBRATE:
+      self.DispatchUpdates(date, bars[:1])
+      self.Recalibrate(date)
+      bars = bars[1:]
+
+    if bars and self.DispatchUpdates(date, bars):
+      self.Recalibrate(date)
+    self.EndDay()
+
+  def DispatchUpdates(self, date, bars):
+    for bank, offset in zip(self.banks, self.offsets):
+      instances, prices = [], []
+      for shc, bar in bars:
+        if bar is None or shc not in bank.instances:
+          continue
+        for index in bank.instances[shc]:
+          instances.append(index)
+          prices.append(bar)
+
+      if instances:
+        instances = numpy.array(instances)
+        traded, daily_pnl = bank.Step(instances, numpy.stack(prices, axis=1), self.alloc[:, offset + instances])
+        if len(traded):
+          self.AddRows(offset + traded, daily_pnl)
+
+    if not self.last_recal_date:
+      self.last_recal_date = date
+      return False
+
+    return dt.NumDaysBetween(self.last_recal_date, date) >= NUM_DAYS_TO_RECALIBRATE
+
+  def AddRows(self, columns, daily_pnl):
+    self.num_rows[columns] += 1
+    count = self.num_rows[columns]
+    for mean, m2, values in [(self.mean, self.m2, daily_pnl), (self.down_mean, self.down_m2, numpy.minimum(daily_pnl, 0))]:
+      delta = values - mean[:, columns]
+      mean[:, columns] += delta / count
+      m2[:, columns] += delta * (values - mean[:, columns])
+
+    self.day_pnl += daily_pnl.sum(axis=1)
+    self.day_has_rows = True
+
+  def EndDay(self):
+    if not self.day_has_rows:
+      return
+    self.num_days += 1
+    delta = self.day_pnl - self.day_mean
+    self.day_mean += delta / self.num_days
+    self.day_m2 += delta * (self.day_pnl - self.day_mean)
+
+    self.equity += self.day_pnl
+    numpy.maximum(self.high_water, self.equity, out=self.high_water)
+    numpy.maximum(self.max_drawdown, self.high_water - self.equity, out=self.max_drawdown)
+    self.day_pnl[:] = 0
+    self.day_has_rows = False
+
+  def Recalibrate(self, date):
+    self.alloc = self.allocate(self)
+    self.last_recal_date = date
+    self.alloc *= TOTAL_ALLOCATION / self.alloc.sum(axis=1, keepdims=True)
+
+  # Trader.DailyAvgPnl, Sharpe & Sortino of every trader in every scenario, ratios are 1 when pnl never moved
+  def DailyAvgPnl(self):
+    return self.mean
+
+  def Sharpe(self):
+    return Ratio(self.mean, self.m2, self.num_rows)
+
+  def Sortino(self):
+    return Ratio(self.mean, self.down_m2, self.num_rows)
+
+  # :return: map from final_pnl, sharpe & max_drawdown to one value per scenario
+  def Results(self):
+    return {'final_pnl': self.equity, 'sharpe': Ratio(self.day_mean, self.day_m2, self.num_days, 0.0),
+            'max_drawdown': self.max_drawdown}
+
+# mean over sample stdev off running sums of squared deviations
+def Ratio(mean, m2, count, flat=1.0):
+  with numpy.errstate(divide='ignore', invalid='ignore'):
+    stdev = numpy.sqrt(m2 / (count - 1))
+    return numpy.where(stdev > 0, mean / stdev, flat)
+
+# UniformAllocPM.RecalibrateAllocations in every scenario
+def UniformAllocations(pm):
+  return numpy.full_like(pm.alloc, TOTAL_ALLOCATION / pm.alloc.shape[1])
+
+"""
+What IndividualPnlAllocPM, IndividualSharpeAllocPM & IndividualSortinoAllocPM do with their
+score of every trader, in every scenario: losers' allocations get cut by 10%, winners split
+what's left in proportion to their score, traders with too short a history keep theirs, & so do
+winners of a scenario where none of them scored above 0 (the PMs would divide by 0).
+"""
+def ScoreAllocations(pm, score):
+  eligible = pm.num_rows >= 2 * NUM_DAYS_TO_RECALIBRATE
+  losing = eligible & (score < 0)
+  winning = eligible & ~(score < 0)
+
+  alloc = numpy.where(losing, numpy.maximum(numpy.trunc(pm.alloc * 0.9), MIN_ALLOCATION), pm.alloc)
+  total_allocation = TOTAL_ALLOCATION - numpy.where(losing | ~eligible, alloc, 0).sum(axis=1, keepdims=True)
+  sum_score = numpy.where(winning, score, 0).sum(axis=1, keepdims=True)
+  winning &= (sum_score != 0)
+  proportional = numpy.trunc(numpy.divide(score * total_allocation, sum_score, out=numpy.zeros_like(alloc), where=winning))
+  return numpy.where(winning, numpy.clip(proportional, MIN_ALLOCATION, MAX_ALLOCATION), alloc)
+
+def PnlAllocations(pm):
+  return ScoreAllocations(pm, pm.DailyAvgPnl())
+
+def SharpeAllocations(pm):
+  return ScoreAllocations(pm, pm.Sharpe())
+
+def SortinoAllocations(pm):
+  return ScoreAllocations(pm, pm.Sortino())
+
+# PMs which can recalibrate across scenarios, & how
+SCENARIO_ALLOCATORS = {UniformAllocPM: UniformAllocations, IndividualPnlAllocPM: PnlAllocations,
+                       IndividualSharpeAllocPM: SharpeAllocations, IndividualSortinoAllocPM: SortinoAllocations}
+
+"""
+Replay every scenario through every scenario PM at once, bars in the order ReplayMarketData
+has them: by date, then by contract, one day at a time. Bars come off the generator a chunk of
+every contract at a time.
+"""
+def ReplayScenarios(scenario_pms, generator):
+  print('Running ' + str(generator.num_scenarios) + ' scenarios for ' + str(list(str(pm) for pm in scenario_pms)))
+  shortcodes = list(generator.history.keys())
+  ordinals = numpy.concatenate(list(generator.history[shc]['ordinals'] for shc in shortcodes))
+  orders = numpy.concatenate(list(numpy.full(generator.NumBars(shc), order) for order, shc in enumerate(shortcodes)))
+  indices = numpy.concatenate(list(numpy.arange(generator.NumBars(shc)) for shc in shortcodes))
+  sequence = numpy.lexsort((orders, ordinals))
+
+  chunks = {} # contract to (first bar, bars)
+  progress = pf.Progress('replayed', len(sequence))
+  day, day_ordinal = [], None
+  for line_num, (ordinal, order, index) in enumerate(zip(ordinals[sequence].tolist(), orders[sequence].tolist(),
+                                                        indices[sequence].tolist())):
+    shc = shortcodes[order]
+    if day and ordinal != day_ordinal:
+      for pm in scenario_pms:
+        pm.OnMarketDataDay(day_date, day)
+      day = []
+
+    start, bars = chunks.get(shc, (0, None))
+    if bars is None or index >= start + bars.shape[1]:
+      start = 0 if bars is None else start + bars.shape[1]
+      bars = generator.Bars(shc, start, min(start + sg.CHUNK_BARS, generator.NumBars(shc)))
+      chunks[shc] = (start, bars)
+
+    valid = not numpy.isnan(generator.history[shc]['ticks'][index]).any()
+    day.append((shc, (bars[:, index - start] if valid else None)))
+    day_ordinal, day_date = ordinal, generator.history[shc]['dates'][index].decode()
+
+    if (line_num + 1) % 1000 == 0:
+      progress.Update(line_num + 1)
+
+  if day:
+    for pm in scenario_pms:
+      pm.OnMarketDataDay(day_date, day)
+  progress.Finish(len(sequence))
+
+# distribution of every scenario PM's results, over all scenarios & by kind
+def PrintDistributions(scenario_pms, generator):
+  kinds = numpy.array(generator.kinds)
+  percentiles = '/'.join('p' + str(percentile) for percentile in PERCENTILES)
+  for pm in scenario_pms:
+    print('  Summarizing: ' + str(pm) + (', without ' + str(len(pm.skipped)) + ' unbanked traders' if pm.skipped else ''))
+    print('    ' + format('Scenarios', '20s')
+          + ' ' + format('FinalPnl(K$) ' + percentiles, '32s')
+          + ' ' + format('Sharpe ' + percentiles, '32s')
+          + ' ' + format('MaxDrawdown(K$) ' + percentiles, '32s'))
+    results = pm.Results()
+    for kind in ['all'] + list(dict.fromkeys(generator.kinds)):
+      chosen = (kinds == kind) if kind != 'all' else numpy.ones(len(kinds), dtype=bool)
+      line = '    ' + format(kind + ' (' + str(chosen.sum()) + ')', '20s')
+      for key, scale in [('final_pnl', 1000.0), ('sharpe', 1), ('max_drawdown', 1000.0)]:
+        values = numpy.percentile(results[key][chosen] / scale, PERCENTILES)
+        line += ' ' + ' '.join(format(value, '10.3f') for value in values)
+      print(line)
+
+def main(args):
+  opts, args = getopt.getopt(args, '', pf.PERF_OPTIONS + SCENARIO_OPTIONS)
+  pf.SetEnabledFromOptions(opts)
+  opts = dict(opts)
+
+  pm_types = DEFAULT_PMS
+  if '--pms' in opts:
+    pm_types = list(getattr(sys.modules[__name__], name) for name in opts['--pms'].split(','))
+  for pm_type in pm_types:
+    if pm_type not in SCENARIO_ALLOCATORS:
+      print('ERROR ' + pm_type.__name__ + ' can\'t recalibrate across scenarios, pick from '
+            + str(list(supported.__name__ for supported in SCENARIO_ALLOCATORS)))
+      exit(1)
+
+  with pf.Phase('load'):
+    generator = sg.ScenarioGenerator(sg.LoadHistory(rp.indep_shortcode_list), int(opts.get('--scenarios', DEFAULT_SCENARIOS)),
+                                     kinds=opts.get('--kinds', ','.join(sg.SCENARIO_KINDS)).split(','),
+                                     seed=int(opts.get('--seed', sg.DEFAULT_SEED)),
+                                     block_length=int(opts.get('--block', sg.DEFAULT_BLOCK_LENGTH)))
+    pm_list, regime_pm = rp.InitializePMs(pm_types)
+    gap_fills = '--fill-stops-at-stop' not in opts
+    scenario_pms = list(ScenarioPM(pm, generator.num_scenarios, gap_fills) for pm in pm_list)
+
+  with pf.Phase('replay'):
+    print('\nPlaying scenarios...')
+    ReplayScenarios(scenario_pms, generator)
+
+  with pf.Phase('summary'):
+    print('\nSummarizing scenario distributions...')
+    PrintDistributions(scenario_pms, generator)
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
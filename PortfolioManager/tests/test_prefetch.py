@@ -0,0 +1,17 @@
+import sys, concurrent.futures
+import Strategies.ContractDef.contract_info as ci
+import Strategies.FileUtil.prefetch as pfch
+
+# every line of a file, in order, however the pool threads interleave
+def test_stream_keeps_every_line_in_order():
+  contract = ci.ContractInfoDatabase['ES']
+  lines = list('01-' + format(day, '02d') + '-17,2400,2410,2390,2405' for day in range(1, 11))
+  switch_interval = sys.getswitchinterval()
+  sys.setswitchinterval(1e-6)
+  try:
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+      for run in range(3000):
+        stream = pfch.PrefetchedStream(pool, contract, lines, chunk_size=2, max_chunks=4)
+        assert list(line for date, line in stream) == lines, 'run ' + str(run)
+  finally:
+    sys.setswitchinterval(switch_interval)
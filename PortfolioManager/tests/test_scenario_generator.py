@@ -0,0 +1,42 @@
+import numpy
+import Strategies.SyntheticData.scenario_generator as sg
+
+WINDOW = 20
+
+# a random walk with the same volatility throughout, laid out like shared_data.ParseContract's arrays
+def RandomWalk(num_bars, seed=1):
+  rng = numpy.random.default_rng(seed)
+  closes = 2400 + numpy.cumsum(rng.normal(0, 10, num_bars))
+  opens = closes + rng.normal(0, 2, num_bars)
+  highs = numpy.maximum(opens, closes) + numpy.abs(rng.normal(0, 5, num_bars))
+  lows = numpy.minimum(opens, closes) - numpy.abs(rng.normal(0, 5, num_bars))
+  return {'ordinals': numpy.arange(736330, 736330 + num_bars), 'ticks': numpy.stack([opens, highs, lows, closes], axis=1),
+          'dates': numpy.array(list(b'01-01-17' for bar in range(num_bars)))}
+
+# close to close moves in units of the mean high - low range of the window before, what traders size off
+def NormalizedMoves(bars):
+  ranges = bars[:, :, 1] - bars[:, :, 2]
+  trailing = numpy.cumsum(ranges, axis=1)
+  vol = (trailing[:, WINDOW:-1] - trailing[:, :-WINDOW - 1]) / WINDOW
+  return numpy.abs(numpy.diff(bars[:, :, 3], axis=1)[:, WINDOW:]) / vol
+
+def Replay(num_bars, **kwargs):
+  generator = sg.ScenarioGenerator({'ES': RandomWalk(num_bars)}, 20, kinds=['history', 'vol'], **kwargs)
+  bars = numpy.concatenate(list(generator.Bars('ES', start, min(start + sg.CHUNK_BARS, num_bars))
+                                for start in range(0, num_bars, sg.CHUNK_BARS)), axis=1)
+  return generator, NormalizedMoves(bars)
+
+# vol regimes change faster than traders' windows catch up, normalized moves get fatter tails than history's
+def test_vol_scenarios_change_the_normalized_distribution():
+  generator, moves = Replay(2000)
+  is_vol = numpy.array(generator.kinds) == 'vol'
+  assert (generator.scale[is_vol].min(axis=1) < generator.scale[is_vol].max(axis=1)).all()
+  history_tail = numpy.percentile(moves[~is_vol], 99.9)
+  vol_tail = numpy.percentile(moves[is_vol], 99.9)
+  assert vol_tail > 1.2 * history_tail
+
+# one scale for the whole path only rescales prices, normalized moves come out as history's
+def test_one_vol_regime_leaves_the_normalized_distribution():
+  generator, moves = Replay(2000, vol_regime_length=10000)
+  is_vol = numpy.array(generator.kinds) == 'vol'
+  numpy.testing.assert_allclose(moves[is_vol], numpy.broadcast_to(moves[~is_vol][0], moves[is_vol].shape), rtol=1e-9)
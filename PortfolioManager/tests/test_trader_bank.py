@@ -0,0 +1,49 @@
+import os, itertools
+import Strategies.FileUtil.file_parser as fp
+import run_portfolios as rp
+import trader_bank as tb
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+
+# every bar of the repo's market data, by date then by contract like ReplayMarketData, as lists of (shc, date, line)
+def MarketDataDays():
+  updates = []
+  for order, shc in enumerate(rp.indep_shortcode_list):
+    lines = fp.ReadLinesOldestFirst(os.path.join(REPO_ROOT, 'MarketData', 'csvs', 'market_data_' + shc + '.csv'))
+    contract = rp.ci.ContractInfoDatabase[shc]
+    for line in lines:
+      date = fp.TokenizeToDate(contract, line)
+      if date:
+        updates.append((rp.dt.DateOrdinal(date), order, shc, date, line))
+  updates.sort()
+  return list(list((shc, date, line) for ordinal, order, shc, date, line in day)
+              for ordinal, day in itertools.groupby(updates, key=lambda update: update[0]))
+
+def BankableTraders():
+  return list(trader for trader in rp.NewTraders() if type(trader) in tb.BANKABLE_TRADERS)
+
+"""
+Banks sum their windows in numpy where the traders take statistics.mean, means can differ in the
+last bit, so stop prices & pnl only agree to rounding. Every decision has to come out the same on
+all the data: date, side & size of every ledger row, & the position it leaves.
+"""
+def test_banks_decide_like_traders_on_all_market_data():
+  days = MarketDataDays()
+  traders, banked = BankableTraders(), BankableTraders()
+  banks = tb.MakeBanks(banked)
+  alloc = {trader.Name(): 10000.0 + 1000 * index for index, trader in enumerate(traders)}
+
+  for day in days:
+    for shc, date, line in day:
+      for trader in traders:
+        if shc in trader.ContractList():
+          trader.OnMarketDataUpdate(shc, date, line, alloc[trader.Name()])
+    for bank in banks:
+      bank.OnMarketDataUpdates(list((shc, line) for shc, date, line in day), alloc)
+
+  for trader, twin in zip(traders, banked):
+    assert len(trader.trades) == len(twin.trades) > 0, trader.Name()
+    for row, twin_row in zip(trader.trades, twin.trades):
+      assert row[:3] + row[4:5] == twin_row[:3] + twin_row[4:5], trader.Name()
+      assert abs(row[3] - twin_row[3]) <= 1e-9 * abs(row[3]), trader.Name()
+      assert abs(row[5] - twin_row[5]) <= 1e-6 * max(1.0, abs(row[5])), trader.Name()
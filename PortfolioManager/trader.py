@@ -3,6 +3,7 @@ import statistics
 import Strategies.FileUtil.file_parser as fp
 import Strategies.ContractDef.contract_info as ci
 import Strategies.DateDef.date_util as dt
+import Strategies.PnlUtil.risk_tracker as rt
 import math
 import numpy
 
@@ -29,9 +30,11 @@ class Trader:
   def __init__(self, contracts, strategy_params):
     self.style = TradingStyle.NoTrading
     self.trades = []
+    self.spilled_rows = 0 # oldest trades rows only kept in a result store, see result_store.ResultSink
     self.daily_pnl = []
     self.pct_pnl_change = []
     self.alloc = []
+    self.risk = rt.RiskTracker() # only catches up with daily_pnl when asked, see Risk
     self.stdev_pnl = 1
     self.sharpe = 0
     self.num_days = 0
@@ -52,6 +55,15 @@ class Trader:
   def DailyAvgPnl(self):
     return statistics.mean(self.daily_pnl)
 
+  # length of the whole trades history, including rows spilled to a result store
+  def NumTradeRows(self):
+    return self.spilled_rows + len(self.trades)
+
+  # contracts to trade so a loss_ticks move against us costs about risk_dollars,
+  # policy_backtest.UnitRiskRecorder hooks in here to record sizing inputs
+  def TradeSize(self, risk_dollars, tick_value, loss_ticks):
+    return int((risk_dollars / tick_value) / loss_ticks + 1)
+
   def LastMonthPnl(self):
     return sum(self.daily_pnl[-29:])
 
@@ -77,6 +89,10 @@ class Trader:
 
     return ratio
 
+  # drawdown, time under water, VaR & CVaR of daily_pnl, only the days since the last call cost anything
+  def Risk(self):
+    return self.risk.CatchUp(self.daily_pnl)
+
   def __str__(self):
     return ('Trader: [' + str(self.Name()) + ' log:' + str(self.log_level)
             + ' ma_look:' + str(self.ma_lookback_days) + ' oloss:' + str(self.o_loss_ticks)
@@ -161,7 +177,7 @@ class TrendFollowTrader(Trader):
       # +ve value means breaking out to the upside
       # -ve value means breaking out to the downside
       if abs(dev_from_ma) > net_change: # trend starting
-        trade_size = int((risk_dollars / contract.TickValue) / loss_ticks + 1)
+        trade_size = self.TradeSize(risk_dollars, contract.TickValue, loss_ticks)
         self.my_position = trade_size * (1 if dev_from_ma > 0 else -1)
         self.my_vwap = close_price
         self.trades.append([date,('B' if dev_from_ma > 0 else 'S'), trade_size, close_price, self.my_position, self.my_pnl, vol, ma, dev_from_ma, high_price, low_price])
@@ -275,7 +291,7 @@ class MeanReversionTrader(Trader):
       # +ve value means breaking out to the upside
       # -ve value means breaking out to the downside
       if abs(dev_from_ma) > net_change: # blown out
-        trade_size = int((risk_dollars / contract.TickValue) / loss_ticks + 1)
+        trade_size = self.TradeSize(risk_dollars, contract.TickValue, loss_ticks)
         self.my_position = trade_size * (1 if dev_from_ma < 0 else -1)
         self.my_vwap = close_price
         self.trades.append([date,('B' if dev_from_ma < 0 else 'S'), trade_size, close_price, self.my_position, self.my_pnl, vol, ma, dev_from_ma, high_price, low_price])
@@ -459,7 +475,7 @@ class RelativeValueTrader(Trader):
       # +ve value means breaking out to the upside
       # -ve value means breaking out to the downside
       if abs(dev_from_projection) > net_change: # blown out
-        trade_size = int((risk_dollars / contracts[0].TickValue) / loss_ticks + 1)
+        trade_size = self.TradeSize(risk_dollars, contracts[0].TickValue, loss_ticks)
         self.my_position = trade_size * (1 if dev_from_projection > 0 else -1)
         self.my_vwap = close_price[0]
         self.trades.append([date[0],('B' if dev_from_projection > 0 else 'S'), trade_size, close_price[0], self.my_position, self.my_pnl, dev_from_projection_vol, ma[0], dev_from_projection, projected_price, corr_0_1])
@@ -542,7 +558,7 @@ class PairsTrader(Trader):
       [0, 0, 0], [0, 0, 0], [0, 0, 0]  # position, position vwap, pnl
 
   def DailyAvgPnl(self):
-    return (self.my_pnl[0] + self.my_pnl[1]) / len(self.trades) if len(self.trades) > 0 else 0
+    return (self.my_pnl[0] + self.my_pnl[1]) / self.NumTradeRows() if self.NumTradeRows() > 0 else 0
 
   def ComputeSpreadPrice(self, ratio, is_inverted, price_1, price_2):
     # basic idea is to multiply the leg with lower dollar volatility
@@ -635,7 +651,7 @@ class PairsTrader(Trader):
       # +ve value means breaking out to the upside
       # -ve value means breaking out to the downside
       if abs(dev_from_ma) > net_change: # blown out
-        trade_size = int((risk_dollars / spread_tick_value) / loss_ticks + 1)
+        trade_size = self.TradeSize(risk_dollars, spread_tick_value, loss_ticks)
         self.my_position[0] = trade_size * (ratio if is_inverted else 1)
         self.my_position[1] = trade_size * (1 if is_inverted else ratio)
         self.my_vwap = list(close_price)
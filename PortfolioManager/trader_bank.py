@@ -0,0 +1,220 @@
+import functools
+import numpy
+import Strategies.FileUtil.file_parser as fp
+import Strategies.ContractDef.contract_info as ci
+from trader import *
+
+# trader types a bank can step, the logic in TraderBank.Step mirrors their OnMarketDataUpdate
+BANKABLE_TRADERS = [TrendFollowTrader, MeanReversionTrader]
+
+# command line flags for the entry points:
+# --no-banks                 run every trader as its own object instead of stepping them in banks
+BANK_OPTIONS = ['no-banks']
+
+def BanksFromOptions(opts):
+  return '--no-banks' not in dict(opts)
+
+# every bank of every PM gets the same lines, only parse each one once
+@functools.lru_cache(maxsize=256)
+def ParseBar(shc, line):
+  return fp.TokenizeToPriceInfo(ci.ContractInfoDatabase[shc], line)
+
+"""
+Every trend following or mean reversion trader of a PM with the same lookback, run as one:
+their rolling windows, positions, vwaps & pnls are parallel arrays and every update of a day
+goes through the same numpy step, with only the traders of contracts which printed taking part.
+The trader objects stay on as ledgers, every step still appends to their trades, daily_pnl,
+pct_pnl_change & alloc so PMs recalibrate & summarize off them like before, their own
+position/vwap/pnl & lookback fields go stale while they're in a bank.
+
+Windows get summed up from scratch on every step instead of keeping running sums, so there's
+nothing to drift, means can still differ from statistics.mean in the last bit & so can stop prices
+& pnl. Decisions can't, tests/test_trader_bank.py pins them to the traders' on all the market data.
+"""
+class TraderBank:
+  def __init__(self, traders):
+    self.traders = list(traders)
+    self.names = list(trader.Name() for trader in self.traders)
+    self.style = self.traders[0].style
+    self.window = self.traders[0].ma_lookback_days + 1
+
+    # instances trading each contract
+    self.instances = {}
+    for index, trader in enumerate(self.traders):
+      self.instances.setdefault(trader.contracts, []).append(index)
+
+    self.tick_values = numpy.array(list(ci.ContractInfoDatabase[trader.contracts].TickValue for trader in self.traders))
+    self.o_loss_ticks = numpy.array(list(trader.o_loss_ticks for trader in self.traders))
+    self.o_net_change = numpy.array(list(trader.o_net_change for trader in self.traders))
+
+    # ring buffers of the last window bars, num_bars % window is where the next bar goes
+    self.ranges = numpy.zeros((len(self.traders), self.window))
+    self.closes = numpy.zeros((len(self.traders), self.window))
+    self.num_bars = numpy.zeros(len(self.traders), dtype=numpy.int64)
+
+    self.position = numpy.zeros(len(self.traders))
+    self.vwap = numpy.zeros(len(self.traders))
+    self.pnl = numpy.zeros(len(self.traders))
+    self.last_row_pnl = numpy.zeros(len(self.traders))
+    self.has_rows = numpy.zeros(len(self.traders), dtype=bool)
+
+    # pick up wherever the traders got to on their own
+    for index, trader in enumerate(self.traders):
+      for high_price, low_price, close_price in trader.lookback_prices:
+        self.Push(numpy.array([index]), high_price - low_price, close_price)
+      self.position[index], self.vwap[index], self.pnl[index] = trader.my_position, trader.my_vwap, trader.my_pnl
+      if trader.trades:
+        self.last_row_pnl[index], self.has_rows[index] = trader.trades[-1][5], True
+
+  def Name(self):
+    return 'bank.' + str(self.style).split('.')[-1] + '|' + str(len(self.traders))
+
+  def Push(self, instances, ranges, closes):
+    slots = self.num_bars[instances] % self.window
+    self.ranges[instances, slots] = ranges
+    self.closes[instances, slots] = closes
+    self.num_bars[instances] += 1
+
+  """
+  Same as handing every update to every trader in the bank which trades that contract.
+  :param updates: list of (shc, line), all on the same date
+  :param alloc: PM allocations by trader name
+  """
+  def OnMarketDataUpdates(self, updates, alloc):
+    instances, dates, highs, lows, closes = [], [], [], [], []
+    for shc, line in updates:
+      if shc not in self.instances:
+        continue
+      try:
+        # unpack list
+        date, open_price, high_price, low_price, close_price = ParseBar(shc, line)
+      except ValueError:
+        continue
+
+      for index in self.instances[shc]:
+        instances.append(index)
+        dates.append(date)
+        highs.append(high_price)
+        lows.append(low_price)
+        closes.append(close_price)
+
+    if instances:
+      self.Step(numpy.array(instances), dates, numpy.array(highs), numpy.array(lows), numpy.array(closes),
+                list(alloc[self.names[index]] for index in instances))
+
+  def Step(self, instances, dates, highs, lows, closes, risk_dollars):
+    self.Push(instances, highs - lows, closes)
+
+    # not initialized yet, nothing more to do than push
+    ready = self.num_bars[instances] >= self.window
+    if not ready.all():
+      instances, highs, lows, closes = instances[ready], highs[ready], lows[ready], closes[ready]
+      dates = list(date for date, is_ready in zip(dates, ready) if is_ready)
+      risk_dollars = list(risk for risk, is_ready in zip(risk_dollars, ready) if is_ready)
+      if len(instances) <= 0:
+        return
+
+    ma = self.closes[instances].sum(axis=1) / self.window
+    vol = self.ranges[instances].sum(axis=1) / self.window
+    step = Decide(self.style, self.position[instances], self.vwap[instances], self.pnl[instances],
+                  self.last_row_pnl[instances], self.has_rows[instances], self.o_loss_ticks[instances],
+                  self.o_net_change[instances], self.tick_values[instances], ma, vol, highs, lows, closes,
+                  numpy.array(risk_dollars))
+    enter, stop, leave, trade_size, direction = step['enter'], step['stop'], step['leave'], step['trade_size'], step['direction']
+    row_pnl, daily_pnl = step['row_pnl'], step['daily_pnl']
+
+    position = self.position[instances]
+    previous_pnl = self.last_row_pnl[instances]
+    changed = self.has_rows[instances] & (previous_pnl != 0)
+    pct_pnl_change = numpy.divide(100 * daily_pnl, numpy.abs(previous_pnl), out=numpy.zeros(len(instances)), where=changed)
+
+    self.position[instances] = step['position']
+    self.vwap[instances] = step['vwap']
+    self.pnl[instances] = step['pnl']
+    self.last_row_pnl[instances] = row_pnl
+    self.has_rows[instances] = True
+
+    # ledgers, laid out like the traders' own
+    columns = zip(instances.tolist(), dates, enter.tolist(), stop.tolist(), leave.tolist(), trade_size.tolist(),
+                  direction.tolist(), position.tolist(), step['stopout_price'].tolist(), highs.tolist(), lows.tolist(),
+                  closes.tolist(), row_pnl.tolist(), daily_pnl.tolist(), changed.tolist(), pct_pnl_change.tolist(),
+                  vol.tolist(), ma.tolist(), step['dev_from_ma'].tolist(), risk_dollars)
+    for (index, date, is_enter, is_stop, is_leave, size, sign, held, stop_price, high_price, low_price,
+         close_price, pnl_row, daily, is_changed, pct, vol_row, ma_row, dev, risk) in columns:
+      trader = self.traders[index]
+      if is_enter:
+        trader.trades.append([date, ('B' if sign > 0 else 'S'), size, close_price, size * sign, pnl_row,
+                              vol_row, ma_row, dev, high_price, low_price])
+      elif is_stop or is_leave:
+        trader.trades.append([date, ('S' if held > 0 else 'B'), abs(int(held)), (stop_price if is_stop else close_price),
+                              0, pnl_row, vol_row, ma_row, dev, high_price, low_price])
+      else:
+        trader.trades.append([date, '-', 0, close_price, int(held), pnl_row, vol_row, ma_row, dev, high_price, low_price])
+
+      trader.alloc.append(risk)
+      trader.daily_pnl.append(daily)
+      if is_changed:
+        trader.pct_pnl_change.append(pct)
+
+"""
+What one step does to the traders taking part, the trend following & mean reversion logic
+in array form. Every argument is an array over them, or anything broadcasting to closes,
+e.g. with a leading scenario axis, see scenario_replay.ScenarioBank.
+:param ma, vol: mean close & high - low range over the window
+:param opens: if given, a stop on a bar which opened past its stop price fills at the open, like it
+  would have in the market, else at the stop price whatever the bar did, like the traders do
+:return: map of arrays shaped like closes:
+  enter, stop, leave:     what each one does
+  trade_size, direction:  size & sign of entries
+  stopout_price:          where a stop out fills
+  dev_from_ma:            close - ma
+  row_pnl, daily_pnl:     pnl since inception of the new ledger row & its change since the last one
+  position, vwap, pnl:    state after the step
+"""
+def Decide(style, position, vwap, pnl, last_row_pnl, has_rows, o_loss_ticks, o_net_change, tick_value,
+           ma, vol, highs, lows, closes, risk_dollars, opens=None):
+  loss_ticks = o_loss_ticks * vol
+  net_change = o_net_change * vol
+  dev_from_ma = closes - ma
+
+  # flat, see if we want to get into a position
+  flat = position == 0
+  enter = flat & (numpy.abs(dev_from_ma) > net_change)
+  # have a position already, check for stop outs, then for the move dying out
+  stop = ~flat & (((position > 0) & (vwap - lows > loss_ticks)) | ((position < 0) & (highs - vwap > loss_ticks)))
+  leave = ~flat & ~stop & (numpy.abs(dev_from_ma) < 0.5 * net_change)
+
+  trade_size = numpy.zeros(enter.shape, dtype=numpy.int64)
+  if enter.any():
+    trade_size[enter] = ((numpy.broadcast_to(risk_dollars, enter.shape)[enter] / numpy.broadcast_to(tick_value, enter.shape)[enter])
+                         / numpy.broadcast_to(loss_ticks, enter.shape)[enter] + 1)
+  if style == TradingStyle.MeanReversionTrading:
+    direction = numpy.where(dev_from_ma < 0, 1, -1) # fade the move
+  else:
+    direction = numpy.where(dev_from_ma > 0, 1, -1) # follow it
+  stopout_price = vwap + (loss_ticks * numpy.where(position < 0, 1, -1))
+  if opens is None:
+    stop_pnl = pnl - numpy.abs(position) * loss_ticks * tick_value
+  else:
+    # gapped through, longs get out no higher than the open & shorts no lower
+    stopout_price = numpy.where(position > 0, numpy.minimum(opens, stopout_price), numpy.maximum(opens, stopout_price))
+    stop_pnl = pnl + position * (stopout_price - vwap) * tick_value
+
+  # marks & wins both come to pnl + position * (close - vwap) * tick value
+  row_pnl = numpy.where(enter, pnl, numpy.where(stop, stop_pnl, pnl + position * (closes - vwap) * tick_value))
+  daily_pnl = numpy.where(has_rows, row_pnl - last_row_pnl, row_pnl)
+
+  return {'enter': enter, 'stop': stop, 'leave': leave, 'trade_size': trade_size, 'direction': direction,
+          'stopout_price': stopout_price, 'dev_from_ma': dev_from_ma, 'row_pnl': row_pnl, 'daily_pnl': daily_pnl,
+          'position': numpy.where(enter, trade_size * direction, numpy.where(stop | leave, 0, position)),
+          'vwap': numpy.where(enter, closes, vwap),
+          'pnl': numpy.where(stop | leave, row_pnl, pnl)}
+
+# banks for every bankable trader, grouped by style & lookback
+def MakeBanks(traders):
+  groups = {}
+  for trader in traders:
+    if type(trader) in BANKABLE_TRADERS and trader.log_level <= 0:
+      groups.setdefault((type(trader), trader.ma_lookback_days), []).append(trader)
+
+  return list(TraderBank(group) for group in groups.values())